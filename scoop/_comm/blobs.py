@@ -0,0 +1,118 @@
+#
+#    This file is part of Scalable COncurrent Operations in Python (SCOOP).
+#
+#    SCOOP is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    SCOOP is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
+#
+"""This file contains the content-addressed storage of large arguments.
+
+Arguments larger than BLOB_THRESHOLD and callables larger than
+CALLABLE_THRESHOLD are replaced in the sent futures by a BlobReference. The
+worker owning them serves their serialized frames to the workers asking for
+them, which keep them in a BlobCache."""
+from collections import OrderedDict
+import hashlib
+
+
+# Arguments whose serialized size (in bytes) is larger are sent as blobs
+BLOB_THRESHOLD = 256 * 1024
+
+# Callables whose serialized size (in bytes) is larger are sent as blobs
+CALLABLE_THRESHOLD = 1024
+
+# Maximal size (in bytes) of the blobs kept by a worker
+BLOB_CACHE_SIZE = 256 * 1024 * 1024
+
+# Maximal number of deserialized callables kept by a worker
+CALLABLE_CACHE_SIZE = 128
+
+# Types never large enough to be sent as blobs
+SMALL_TYPES = (bool, int, float, complex, type(None))
+
+
+class BlobReference(object):
+    """Placeholder of an argument or callable sent as a blob."""
+    __slots__ = ('digest', 'owner')
+
+    def __init__(self, digest, owner):
+        self.digest = digest
+        self.owner = owner
+
+    def __getstate__(self):
+        return self.digest, self.owner
+
+    def __setstate__(self, state):
+        self.digest, self.owner = state
+
+
+def getDigest(frames):
+    """Returns the digest of the serialized frames of an object."""
+    digest = hashlib.sha1()
+    for frame in frames:
+        digest.update(frame)
+    return digest.digest()
+
+
+def isSmall(value):
+    """Tells if a value is obviously too small to be sent as a blob."""
+    if isinstance(value, SMALL_TYPES):
+        return True
+    if isinstance(value, (str, bytes)):
+        return len(value) < BLOB_THRESHOLD
+    return False
+
+
+def isImmutable(value):
+    """Tells if a value cannot be modified once sent, so its digest can be
+    reused for the next futures it is passed to."""
+    if isinstance(value, bytes):
+        return True
+    if isinstance(value, memoryview):
+        return value.readonly
+    if type(value).__module__ == 'numpy':
+        # Read-only NumPy arrays
+        return not value.flags.writeable
+    return False
+
+
+def framesSize(frames):
+    """Returns the size in bytes of the frames of a blob."""
+    return sum(len(frame) for frame in frames)
+
+
+class BlobCache(object):
+    """Least recently used cache of received blobs. By default, it holds
+    their frames up to BLOB_CACHE_SIZE bytes."""
+    def __init__(self, maxsize=BLOB_CACHE_SIZE, sizeof=framesSize):
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        self.blobs = OrderedDict()
+
+    def __contains__(self, digest):
+        return digest in self.blobs
+
+    def __getitem__(self, digest):
+        frames = self.blobs.pop(digest)
+        self.blobs[digest] = frames
+        return frames
+
+    def __setitem__(self, digest, value):
+        if digest in self.blobs:
+            return
+        self.blobs[digest] = value
+        self.size += self.sizeof(value)
+        # Always keep the newest blob, even if larger than the cache
+        while self.size > self.maxsize and len(self.blobs) > 1:
+            _, evicted = self.blobs.popitem(last=False)
+            self.size -= self.sizeof(evicted)
@@ -0,0 +1,145 @@
+#
+#    This file is part of Scalable COncurrent Operations in Python (SCOOP).
+#
+#    SCOOP is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    SCOOP is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
+#
+"""This file contains the thread performing the socket operations of a
+communicator.
+
+Once started, the thread owns the sockets: it receives the inbound messages
+as soon as they arrive and performs the operations queued by the other
+threads, so messages are transferred while the worker executes futures.
+
+Only the requests which read data that does not change while it is read, such
+as the requests of blobs, can be answered by the thread itself. The other
+messages, among which the requests of stealing and of status, stay in the
+inbound deques until the main loop reads them between two futures."""
+from collections import deque
+import socket
+import threading
+
+import zmq
+
+import scoop
+
+
+class IOThread(threading.Thread):
+    """Thread owning the sockets of a communicator."""
+    def __init__(self):
+        super(IOThread, self).__init__()
+        self.daemon = True
+        self.running = True
+        # (socket, inbound deque, copy, answer) of the sockets received from
+        self.receivers = []
+        # Calls (function, args, kargs) queued by the other threads
+        self.outbound = deque()
+        self.received = threading.Event()
+        # Wakes up the thread when a call is queued
+        self.wakeupReader, self.wakeupWriter = socket.socketpair()
+        self.wakeupReader.setblocking(False)
+        self.wakeupWriter.setblocking(False)
+
+    def receive(self, sock, inbound, copy=True, answer=None):
+        """Appends the messages received on sock to the inbound deque. If
+        given, answer is called by this thread with every received message
+        and the messages for which it returns True are not appended."""
+        self.receivers.append((sock, inbound, copy, answer))
+
+    def execute(self, function, *args, **kargs):
+        """Queues a call to be made by this thread. The call is made right
+        away if this thread is the caller or is not running."""
+        if not self.is_alive() or threading.current_thread() is self:
+            return function(*args, **kargs)
+        self.outbound.append((function, args, kargs))
+        try:
+            self.wakeupWriter.send(b"\0")
+        except socket.error:
+            # Already woken up
+            pass
+
+    def wait(self, timeout):
+        """Blocks until a message is received or timeout milliseconds
+        elapsed."""
+        if timeout is not None and timeout >= 0:
+            timeout = timeout / 1000.
+        else:
+            timeout = None
+        self.received.wait(timeout)
+        self.received.clear()
+
+    def stop(self):
+        """Makes the queued calls and ends the thread."""
+        self.execute(self._stop)
+        self.join()
+        self.wakeupReader.close()
+        self.wakeupWriter.close()
+
+    def _stop(self):
+        self.running = False
+
+    def run(self):
+        poller = zmq.Poller()
+        for sock, _, _, _ in self.receivers:
+            poller.register(sock, zmq.POLLIN)
+        poller.register(self.wakeupReader, zmq.POLLIN)
+        try:
+            while self.running:
+                while self.outbound:
+                    function, args, kargs = self.outbound.popleft()
+                    try:
+                        function(*args, **kargs)
+                    except Exception as e:
+                        scoop.logger.error(
+                            "I/O thread could not call {0}: {1}".format(
+                                getattr(function, '__name__', function), e,
+                            )
+                        )
+                if not self.running:
+                    break
+                events = dict(poller.poll())
+                if self.wakeupReader in events:
+                    try:
+                        while self.wakeupReader.recv(4096):
+                            pass
+                    except socket.error:
+                        pass
+                for sock, inbound, copy, answer in self.receivers:
+                    if sock not in events:
+                        continue
+                    while True:
+                        try:
+                            msg = sock.recv_multipart(zmq.NOBLOCK, copy=copy)
+                        except zmq.Again:
+                            break
+                        if answer is not None and answer(msg):
+                            continue
+                        inbound.append(msg)
+                        self.received.set()
+        except zmq.ZMQError as e:
+            # The sockets were closed
+            scoop.logger.debug("I/O thread stopped: {0}".format(e))
+
+
+class SocketProxy(object):
+    """Socket whose methods are called by the I/O thread owning it."""
+    def __init__(self, sock, thread):
+        self.socket = sock
+        self.thread = thread
+
+    def __getattr__(self, name):
+        method = getattr(self.socket, name)
+
+        def call(*args, **kargs):
+            return self.thread.execute(method, *args, **kargs)
+        return call
@@ -138,14 +138,14 @@ class TCPCommunicator(object):
         ))
         scoop.CONFIGURATION.update(pickle.loads(self.socket.recv()))
         inboundVariables = pickle.loads(self.socket.recv())
-        shared.elements = dict([
+        shared.setElements(dict([
             (pickle.loads(key),
                 dict([(pickle.loads(varName),
                        pickle.loads(varValue))
                     for varName, varValue in value.items()
                 ]))
                 for key, value in inboundVariables.items()
-        ])
+        ]))
         for broker in pickle.loads(self.socket.recv()):
             # Skip already connected brokers
             if broker in self.broker_set:
@@ -246,8 +246,12 @@ class TCPCommunicator(object):
                 key = pickle.loads(msg[3])
                 varValue = pickle.loads(msg[2])
                 varName = pickle.loads(msg[1])
-                shared.elements.setdefault(key, {}).update({varName: varValue})
+                # The TCP broker does not version the variables
+                shared.storeElement(key, varName, varValue,
+                                    shared.versions.get(varName, 0) + 1)
                 self.convertVariable(key, varName, varValue)
+            elif msg[0] == b"VARIABLE_DEL":
+                shared.removeElement(pickle.loads(msg[1]))
             elif msg[0] == b"BROKER_INFO":
                 # TODO: find out what to do here ...
                 if len(self.broker_set) == 0: # The first update
@@ -272,7 +276,10 @@ class TCPCommunicator(object):
                     self.broker_set.update(new_brokers)
 
     def convertVariable(self, key, varName, varValue):
-        """Puts the function in the globals() of the main module."""
+        """Puts the function in the globals() of the main module. The values
+        shared in memory are only mapped once used."""
+        if isinstance(varValue, encapsulation.MappedEncapsulation):
+            varValue.releasePrevious()
         if isinstance(varValue, encapsulation.FunctionEncapsulation):
             result = varValue.getFunction()
 
@@ -281,9 +288,7 @@ class TCPCommunicator(object):
             result.__name__ = varName
             result.__globals__.update(mainModule.__dict__)
             setattr(mainModule, varName, result)
-            shared.elements[key].update({
-                varName: result,
-            })
+            shared.storeElement(key, varName, result)
 
     def recvFuture(self):
         while self._poll(0):
@@ -312,6 +317,21 @@ class TCPCommunicator(object):
                                                      pickle.HIGHEST_PROTOCOL)])
             future.callable = previousCallable
 
+    def loadArguments(self, future):
+        """Arguments are received deserialized, nothing to do."""
+        pass
+
+    def releaseBlobs(self, fid):
+        """Arguments are always sent by value, nothing to do."""
+        pass
+
+    def stealFutures(self, credit=1):
+        """Futures are only given by the broker with this backend."""
+        return False
+
+    def advertiseLoad(self, busy):
+        pass
+
     def sendResult(self, future):
         """Send a terminated future back to its parent."""
         future = copy.copy(future)
@@ -363,6 +383,28 @@ class TCPCommunicator(object):
                                     pickle.dumps(scoop.worker,
                                                  pickle.HIGHEST_PROTOCOL)])
 
+    def deleteVariables(self, keys):
+        for key in keys:
+            self.socket.send_multipart([b"VARIABLE_DEL", pickle.dumps(key)])
+
+    def mapVariable(self, value):
+        """Values shared in memory are only available on the host of the
+        worker which set them with this backend, since workers do not
+        connect to each other."""
+        view = value.getView()
+        if view is None:
+            raise ReferenceBroken("The value of {0} is shared in memory on "
+                                  "another host.".format(value.name))
+        return view
+
+    def receiveVariables(self, timeout):
+        time.sleep(timeout)
+
+    def waitVariables(self, names, timeout=0.1):
+        """The shared variables are not acknowledged by the TCP broker, they
+        are deemed set once received back."""
+        time.sleep(timeout)
+
     def taskEnd(self, groupID, askResults=False):
         self.socket.send_multipart([
             b"TASKEND",
@@ -376,7 +418,8 @@ class TCPCommunicator(object):
             ),
         ])
 
-    def sendRequest(self):
+    def sendRequest(self, credit=1):
+        # This backend serves a single future per request
         for _ in range(len(self.broker_set)):
             self.socket.send(b"REQUEST")
 
@@ -14,6 +14,7 @@
 #    You should have received a copy of the GNU Lesser General Public
 #    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
 #
+import os
 import time
 import sys
 import random
@@ -21,6 +22,7 @@ import socket
 import copy
 import logging
 import threading
+from collections import defaultdict, deque
 try:
     import cPickle as pickle
 except ImportError:
@@ -32,28 +34,59 @@ import scoop
 from .. import shared, encapsulation, utils
 from ..shared import SharedElementEncapsulation
 from .scoopexceptions import Shutdown, ReferenceBroken
+from .serializers import getSerializer, SerializedValue
+from .iothread import IOThread, SocketProxy
+from .blobs import (BlobReference, BlobCache, BLOB_THRESHOLD,
+                    CALLABLE_THRESHOLD, CALLABLE_CACHE_SIZE, getDigest,
+                    isSmall, isImmutable, framesSize)
+from ..broker.protocol import (INIT, REQUEST, TASK, REPLY, SHUTDOWN, VARIABLE,
+                               VARIABLE_ACK, VARIABLE_DEL, VARIABLE_REQ,
+                               VARIABLE_CHUNK, BROKER_INFO, STATUS_REQ, STATUS_ANS,
+                               STATUS_DONE, STATUS_UPDATE, BLOB_REQ, BLOB,
+                               BUSY, GIVEN, PEERS, STEAL, STATUS_HERE,
+                               STATUS_NONE, encodeId, decodeId,
+                               encodeList, decodeList, encodeCount,
+                               decodeCount, encodeKey, encodeFlag)
 
-# Worker requests
-INIT = b"I"
-REQUEST = b"RQ"
-TASK = b"T"
-REPLY = b"RP"
-SHUTDOWN = b"S"
-VARIABLE = b"V"
-BROKER_INFO = b"B"
-STATUS_REQ = b"SR"
-STATUS_ANS = b"SA"
-STATUS_DONE = b"SD"
-STATUS_UPDATE = b"SU"
-
-# Task statuses
-STATUS_HERE = b"H"
-STATUS_GIVEN = b"G"
-STATUS_NONE = b"N"
+# Kinds of out-of-band buffer frames
+BUFFER_RAW = b"R"
 
 
 LINGER_TIME = 1000
 
+# Time in seconds after which an unacknowledged shared variable is resent
+TIME_BETWEEN_VARIABLE_RESENDS = 1.
+
+# Time in seconds after which a value shared in memory which could not be
+# fetched from the worker which set it is considered lost
+TIME_BEFORE_MAPPED_FAILURE = 60.
+
+# Pending value of a shared variable being deleted
+DELETED = object()
+
+# Shared variables larger than this size (in bytes) are broadcast through the
+# workers when enabled, in chunks of the given size, each worker forwarding
+# them to TREE_FANOUT peers
+TREE_BROADCAST_THRESHOLD = 1024 * 1024
+TREE_CHUNK_SIZE = 1024 * 1024
+TREE_FANOUT = 2
+
+# Time in seconds after which a worker still waiting for a shared variable
+# broadcast through the workers requests it to the broker
+TIME_BEFORE_VARIABLE_REQUEST = 1.
+
+# Minimal time in seconds between two steal attempts of an idle worker, or
+# between two changes of the advertised load of a busy one
+TIME_BETWEEN_STEALS = 0.1
+
+try:
+    IPC_AVAILABLE = zmq.has("ipc")
+except AttributeError:
+    IPC_AVAILABLE = False
+
+# Ends the address of the workers which bound their ipc direct socket
+IPC_SUFFIX = ":ipc"
+
 
 class ZMQCommunicator(object):
     """This class encapsulates the communication features toward the broker."""
@@ -75,9 +108,11 @@ class ZMQCommunicator(object):
 
         if external_addr in utils.loopbackReferences or info[0] == socket.AF_INET6:
             external_addr = scoop.BROKER.externalHostname
+        self.external_addr = external_addr
 
         # Create an inter-worker socket
         self.direct_socket_peers = []
+        self.peersLock = threading.Lock()
         self.direct_socket = self.createZMQSocket(zmq.ROUTER)
         # TODO: This doesn't seems to be respected in the ROUTER socket
         self.direct_socket.setsockopt(zmq.SNDTIMEO, 0)
@@ -103,6 +138,18 @@ class ZMQCommunicator(object):
                 break
         else:
             raise Exception("Could not create direct connection socket")
+        self.ipcPath = None
+        if IPC_AVAILABLE:
+            path = utils.ipcPath(self.direct_socket_port, "peer")
+            try:
+                self.direct_socket.bind("ipc://" + path)
+            except zmq.ZMQError:
+                scoop.logger.warning("Could not bind the ipc direct socket.")
+            else:
+                self.ipcPath = path
+                # Tells the workers of this host to connect through ipc
+                scoop.worker += IPC_SUFFIX.encode()
+                self.direct_socket.setsockopt(zmq.IDENTITY, scoop.worker)
 
         # Update the logger to display our name
         try:
@@ -142,20 +189,83 @@ class ZMQCommunicator(object):
         ])
         scoop.CONFIGURATION.update(pickle.loads(self.socket.recv()))
         inboundVariables = pickle.loads(self.socket.recv())
-        shared.elements = dict([
-            (pickle.loads(key),
+        # Versions up to this one are included in the inbound variables
+        self.variableVersion, inboundVersions = pickle.loads(
+            self.socket.recv()
+        )
+        shared.setElements(dict([
+            (key,
                 dict([(pickle.loads(varName),
                        pickle.loads(varValue))
                     for varName, varValue in value.items()
                 ]))
                 for key, value in inboundVariables.items()
-        ])
+        ]), dict([
+            (pickle.loads(varName), version)
+            for varName, version in inboundVersions.items()
+        ]))
         for broker in pickle.loads(self.socket.recv()):
             # Skip already connected brokers
             if broker in self.broker_set:
                 continue
             self._addBroker(broker)
 
+        self.serializer = getSerializer(
+            scoop.CONFIGURATION.get('serializer', 'pickle')
+        )
+
+        # Status answers expected from the brokers: [round, remaining answers,
+        # merged statuses, requested ids]
+        self.statusRound = 0
+        self.statusAnswers = None
+
+        # Shared variables sent and not yet acknowledged by a broker
+        # {pickled name: (name, value or DELETED, pickled value)}
+        self.pendingVariables = {}
+
+        # Shared variables broadcast through the workers: the chunks received
+        # {(pickled name, version): [chunks]}, the announced variables
+        # {pickled name: (version, announcement time)} and the values received
+        # before their announcement {pickled name: (value, owner, version)}
+        self.treeBroadcast = scoop.CONFIGURATION.get('treeBroadcast', False)
+        self.treeChunks = {}
+        self.treeAnnounced = {}
+        self.treeValues = {}
+
+        # Blobs owned by this worker {digest: [frames, futures count]}, the
+        # blobs of every sent future and the cache of the received blobs
+        self.blobStore = {}
+        self.futureBlobs = {}
+        # Digests of the immutable objects kept as blobs
+        # {id: (object, digest)}
+        self.blobDigests = {}
+        self.blobCache = BlobCache()
+        # Deserialized callables received as blobs
+        self.callableCache = BlobCache(CALLABLE_CACHE_SIZE, lambda value: 1)
+        # Received futures waiting for blobs {digest: [futures]}
+        self.pendingBlobs = defaultdict(list)
+        # Values shared in memory requested to the workers which set them
+        self.fetchedMapped = {}
+
+        # Busy workers known to this worker, which can be stolen from
+        self.workStealing = scoop.CONFIGURATION.get('workStealing', False)
+        self.busyPeers = deque()
+        self.lastSteal = 0
+        # Number of futures given to thieves and stolen from peers
+        self.futuresGiven = 0
+        self.futuresStolen = 0
+        # Requests of blobs answered by the I/O thread
+        self.blobsAnswered = 0
+        # Shared variables requested after their broadcast was missed
+        self.variablesRequested = 0
+        self.advertisedBusy = False
+        self.lastAdvertised = 0
+
+        # Socket operations made by a dedicated thread, if enabled
+        self.ioThread = None
+        if scoop.CONFIGURATION.get('ioThread', False):
+            self._startIOThread()
+
         # Putting futures status reporting in place
         self.status_update_thread = threading.Thread(target=self._reportFutures)
         self.status_update_thread.daemon = True
@@ -188,33 +298,66 @@ class ZMQCommunicator(object):
         try:
             while True:
                 time.sleep(scoop.TIME_BETWEEN_STATUS_REPORTS)
-                fids = set(x.id for x in scoop._control.execQueue.movable)
-                fids.update(set(x.id for x in scoop._control.execQueue.ready))
-                fids.update(set(x.id for x in scoop._control.execQueue.inprogress))
+                # Ids are encoded the same way as in the TASK messages
+                execQueue = scoop._control.execQueue
+                fids = set(
+                    encodeId(x.id)
+                    for queue in (execQueue.movable, execQueue.ready,
+                                  execQueue.inprogress)
+                    for x in queue
+                )
+                # The running future is in none of the queues
+                current = scoop._control.current
+                if current is not None and not current._ended():
+                    fids.add(encodeId(current.id))
                 self.socket.send_multipart([
                     STATUS_UPDATE,
-                    pickle.dumps(fids),
+                    encodeList(fids),
                 ])
         except AttributeError:
             # The process is being shut down.
             pass
 
+    def _isLocal(self, hostname):
+        """Tells if hostname is this host, reachable through ipc."""
+        return IPC_AVAILABLE and (hostname in utils.localHostnames
+                                  or hostname == self.external_addr)
+
+    def _peerEndpoint(self, peer):
+        """Returns the endpoint of the direct socket of a worker. Workers of
+        this host are reached through ipc if they advertise it in their
+        address."""
+        address = peer.decode("utf-8")
+        if address.endswith(IPC_SUFFIX):
+            address = address[:-len(IPC_SUFFIX)]
+            hostname, port = address.rsplit(":", 1)
+            if self._isLocal(hostname):
+                return "ipc://" + utils.ipcPath(port, "peer")
+        return "tcp://{0}".format(address)
+
     def addPeer(self, peer):
-        if peer not in self.direct_socket_peers:
-            self.direct_socket_peers.append(peer)
-            new_peer = "tcp://{0}".format(peer.decode("utf-8"))
-            self.direct_socket.connect(new_peer)
+        # Also called by the I/O thread when it forwards chunks
+        with self.peersLock:
+            if peer not in self.direct_socket_peers:
+                self.direct_socket_peers.append(peer)
+                self.direct_socket.connect(self._peerEndpoint(peer))
 
     def _addBroker(self, brokerEntry):
         # Add a broker to the socket and the infosocket.
-        broker_address = "tcp://{hostname}:{port}".format(
-            hostname=brokerEntry.hostname,
-            port=brokerEntry.task_port,
-        )
-        meta_address = "tcp://{hostname}:{port}".format(
-            hostname=brokerEntry.hostname,
-            port=brokerEntry.info_port,
-        )
+        if brokerEntry.ipc and self._isLocal(brokerEntry.hostname):
+            broker_address = "ipc://" + utils.ipcPath(brokerEntry.task_port,
+                                                      "task")
+            meta_address = "ipc://" + utils.ipcPath(brokerEntry.info_port,
+                                                    "info")
+        else:
+            broker_address = "tcp://{hostname}:{port}".format(
+                hostname=brokerEntry.hostname,
+                port=brokerEntry.task_port,
+            )
+            meta_address = "tcp://{hostname}:{port}".format(
+                hostname=brokerEntry.hostname,
+                port=brokerEntry.info_port,
+            )
         self.socket.connect(broker_address)
 
         self.infoSocket.connect(meta_address)
@@ -222,56 +365,437 @@ class ZMQCommunicator(object):
 
         self.broker_set.add(brokerEntry)
 
+    def _startIOThread(self):
+        """Hands the sockets over to an I/O thread. Afterwards, received
+        messages are read from the inbound deques and socket operations are
+        queued to the thread."""
+        self.directInbound = deque()
+        self.brokerInbound = deque()
+        self.infoInbound = deque()
+        self.ioThread = IOThread()
+        self.ioThread.receive(self.direct_socket, self.directInbound,
+                              copy=False, answer=self._answerDirect)
+        self.ioThread.receive(self.socket, self.brokerInbound, copy=False,
+                              answer=self._answerRouted)
+        self.ioThread.receive(self.infoSocket, self.infoInbound)
+        self.direct_socket = SocketProxy(self.direct_socket, self.ioThread)
+        self.socket = SocketProxy(self.socket, self.ioThread)
+        self.infoSocket = SocketProxy(self.infoSocket, self.ioThread)
+        self.ioThread.start()
+
+    def _answerDirect(self, msg):
+        """Answers in the I/O thread a message received directly from a
+        worker. Returns whether it was answered."""
+        return self._answerInThread(msg[1:] + msg[:1])
+
+    def _answerRouted(self, msg):
+        """Answers in the I/O thread a message received from a broker."""
+        return self._answerInThread(msg)
+
+    def _answerInThread(self, msg):
+        """Answers the requests of blobs and forwards the chunks of shared
+        variables while a future executes, so a busy worker does not delay
+        the workers below it in a broadcast. The stores of blobs are only
+        read here; the chunks and the other messages are left to the main
+        loop."""
+        if len(msg) >= 8 and msg[0].bytes == VARIABLE_CHUNK:
+            self._forwardChunk(msg[:6], decodeList(msg[6].bytes), msg[7])
+            return False
+        if len(msg) < 3 or msg[0].bytes != BLOB_REQ:
+            return False
+        digest = msg[1].bytes
+        self._trySendDirect(msg[-1].bytes,
+                            [BLOB, digest] + self._blobFrames(digest))
+        self.blobsAnswered += 1
+        return True
+
+    def _execute(self, function, *args):
+        """Calls function in the I/O thread, if any."""
+        if self.ioThread is not None:
+            return self.ioThread.execute(function, *args)
+        return function(*args)
+
     def _poll(self, timeout):
         self.pumpInfoSocket()
+        if self.ioThread is not None:
+            if not (self.directInbound or self.brokerInbound):
+                self.ioThread.wait(timeout)
+            return len(self.directInbound) + len(self.brokerInbound)
         return self.poller.poll(timeout)
 
+    def _dumps(self, obj):
+        """Serializes an object into a list of frames: a header holding the
+        kind of every out-of-band buffer, the payload and the buffers."""
+        payload, buffers = self.serializer.dumps(obj)
+        return [BUFFER_RAW * len(buffers), payload] + buffers
+
+    def _loads(self, frames, index=0):
+        """Deserializes the object whose frames begin at frames[index].
+        Returns the object and the index of the frame following it."""
+        count = len(frames[index].bytes)
+        end = index + 2 + count
+        buffers = [frame.buffer for frame in frames[index + 2:end]]
+        return self.serializer.loads(frames[index + 1].buffer, buffers), end
+
     def _recv(self):
+        """Receives a message and returns the list of futures it contains."""
         # Prioritize answers over new tasks
-        if self.direct_socket.poll(0):
-            router_msg = self.direct_socket.recv_multipart()
-            # Remove the sender address
+        router_msg = None
+        if self.ioThread is not None:
+            if self.directInbound:
+                router_msg = self.directInbound.popleft()
+            else:
+                msg = self.brokerInbound.popleft()
+        elif self.direct_socket.poll(0):
+            router_msg = self.direct_socket.recv_multipart(copy=False)
+        else:
+            msg = self.socket.recv_multipart(copy=False)
+        if router_msg is not None:
+            # Move the sender address at the end
             msg = router_msg[1:] + [router_msg[0]]
+        msgType = msg[0].bytes
+
+        if msgType == STATUS_ANS:
+            self._processStatusAnswer(msg)
+            return []
+
+        if msgType == VARIABLE_ACK:
+            recipients = None
+            if len(msg) > 4:
+                recipients = decodeList(msg[3].bytes)
+            self._variableAcknowledged(msg[1].bytes,
+                                       decodeCount(msg[2].bytes),
+                                       recipients)
+            return []
+
+        if msgType == VARIABLE_CHUNK:
+            self._receiveChunk(msg)
+            return []
+
+        if msgType == VARIABLE:
+            # Requested to the broker
+            self._receiveVariable(msg[1].bytes, msg[2].bytes, msg[3].bytes,
+                                  decodeCount(msg[4].bytes))
+            return []
+
+        if msgType == BLOB_REQ:
+            self._sendBlob(msg[-1].bytes, msg[1].bytes)
+            return []
+
+        if msgType == STEAL:
+            self._giveFutures(msg[-1].bytes, decodeCount(msg[1].bytes))
+            return []
+
+        if msgType == PEERS:
+            for peer in decodeList(msg[1].bytes):
+                if peer not in self.busyPeers:
+                    self.busyPeers.append(peer)
+            return []
+
+        if msgType == BLOB:
+            futures = self._receiveBlob(msg)
+        elif msgType == TASK:
+            # A task message may contain a batch of futures
+            futures = []
+            index = 1
+            end = len(msg)
+            if router_msg is not None:
+                # Answer of a peer to a steal attempt
+                end -= 1
+                if end == 1:
+                    self._discardPeer(msg[-1].bytes)
+            while index < end:
+                start = index
+                thisFuture, index = self._loadFuture(msg, index)
+                # Kept to be forwarded unchanged if it is not run here
+                thisFuture.wireFrames = msg[start:index]
+                original = scoop._control.futureDict.get(thisFuture.id)
+                if original is not None and original.greenlet is None:
+                    # Own future sent back, it replaces the received one
+                    original.wireFrames = thisFuture.wireFrames
+                futures.append(thisFuture)
+            if router_msg is not None:
+                self.futuresStolen += len(futures)
+            for thisFuture in futures:
+                # Try to connect directly to this worker to send the result
+                # afterwards if Future is from a map.
+                if thisFuture.sendResultBack:
+                    self.addPeer(thisFuture.id[0])
+            futures = [thisFuture for thisFuture in futures
+                       if self._resolveBlobs(thisFuture)]
         else:
-            msg = self.socket.recv_multipart()
-        
+            # The reply holds the id of its future before the future
+            futures = [self._loadFuture(msg, 2)[0]]
+            for thisFuture in futures:
+                self.releaseBlobs(thisFuture.id)
+
+        for thisFuture in futures:
+            self._resolveCallable(thisFuture)
+        return futures
+
+    def _extractBlobs(self, future):
+        """Replaces the large arguments and callable of a future created by
+        this worker by references to blobs kept until it ends. The other
+        arguments are kept in the serialized form obtained to measure them.
+        An immutable object passed to many futures, as in a map, is
+        serialized once while its blob is kept."""
+        if future.id[0] != scoop.worker:
+            return
+        if future.id in self.futureBlobs:
+            # Sent again, reuse its blobs
+            (future.callable, future.args,
+             future.kargs) = self.futureBlobs[future.id][1:]
+            return
+
+        digests = []
+
+        def toBlob(value, threshold=BLOB_THRESHOLD, keepFrames=True):
+            if isSmall(value):
+                return value
+            # Mutable values are serialized again, they may have changed
+            immutable = isImmutable(value)
+            cached = self.blobDigests.get(id(value)) if immutable else None
+            if cached is not None and cached[0] is value:
+                digest = cached[1]
+            else:
+                try:
+                    frames = self._dumps(value)
+                except (pickle.PicklingError, TypeError, AttributeError):
+                    return value
+                if framesSize(frames[1:]) < threshold:
+                    if keepFrames:
+                        return SerializedValue(*frames[1:])
+                    return value
+                frames = [bytes(frame) for frame in frames]
+                digest = getDigest(frames)
+                self.blobStore.setdefault(digest, [frames, 0, set()])
+                if immutable:
+                    self.blobDigests[id(value)] = (value, digest)
+            entry = self.blobStore[digest]
+            entry[1] += 1
+            if immutable:
+                entry[2].add(id(value))
+            digests.append(digest)
+            return BlobReference(digest, scoop.worker)
+
+        future.callable = toBlob(future.callable, CALLABLE_THRESHOLD, False)
+        future.args = tuple(toBlob(arg) for arg in future.args)
+        future.kargs = dict((key, toBlob(value))
+                            for key, value in future.kargs.items())
+        if digests:
+            self.futureBlobs[future.id] = (digests, future.callable,
+                                           future.args, future.kargs)
+
+    def releaseBlobs(self, fid):
+        """Forgets the blobs of an own future which ended, here or on the
+        worker which sent its result back."""
+        try:
+            digests = self.futureBlobs.pop(fid)[0]
+        except KeyError:
+            return
+        for digest in digests:
+            entry = self.blobStore[digest]
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self.blobStore[digest]
+                for valueId in entry[2]:
+                    self.blobDigests.pop(valueId, None)
+
+    def _sendBlob(self, destination, digest):
+        """Answers the request of a worker for an owned blob, or for the value
+        of a constant shared in memory set by this worker."""
+        self._sendDirect(destination, [BLOB, digest] + self._blobFrames(digest))
+
+    def _blobFrames(self, digest):
+        """Returns the frames of an owned blob or of the value of a constant
+        shared in memory, or no frame if it is no longer available."""
+        try:
+            frames = self.blobStore[digest][0]
+        except KeyError:
+            view = encapsulation.ownedView(digest.decode("ascii", "replace"))
+            if view is not None:
+                if hasattr(pickle, 'PickleBuffer'):
+                    # Sent out-of-band, without copying the mapped file
+                    view = pickle.PickleBuffer(view)
+                else:
+                    view = view.tobytes()
+                frames = self._dumps(view)
+            else:
+                # Every future using it is done, the requester will drop them
+                frames = []
+        return frames
+
+    def _receiveBlob(self, msg):
+        """Caches a received blob and returns the futures it completes."""
+        digest = msg[1].bytes
+        if digest in self.fetchedMapped:
+            # Value of a constant shared in memory, False if it was replaced
+            self.fetchedMapped[digest] = (self._loads(msg, 2)[0]
+                                          if len(msg) >= 5 else False)
+            return []
+        if digest not in self.pendingBlobs:
+            # Answer to a request which was resent
+            return []
+        futures = self.pendingBlobs.pop(digest)
+        if len(msg) < 5:
+            scoop.logger.debug("Dropped {0} futures whose blob is no longer "
+                               "available.".format(len(futures)))
+            for thisFuture in futures:
+                for pending in self.pendingBlobs.values():
+                    if thisFuture in pending:
+                        pending.remove(thisFuture)
+            return []
+        end = 4 + len(msg[2].bytes)
+        self.blobCache[digest] = [frame.bytes for frame in msg[2:end]]
+        return [thisFuture for thisFuture in futures
+                if self._resolveBlobs(thisFuture)]
+
+    def _blobValue(self, frames):
+        """Deserializes a new copy of the value of a blob."""
+        return self.serializer.loads(
+            frames[1], [bytearray(frame) for frame in frames[2:]]
+        )
+
+    def _resolveBlobs(self, future):
+        """Replaces the blob callable of a received future by its value and
+        keeps the blobs of its arguments until they are loaded.
+        Returns False and requests the missing blobs if some are not cached."""
+        argumentBlobs = getattr(future, 'argumentBlobs', None) or []
+        references = list(argumentBlobs)
+        if isinstance(future.callable, BlobReference):
+            references.append(future.callable)
+        if not references:
+            return True
+        for reference in references:
+            if reference.digest in self.blobStore:
+                # Own future coming back
+                self.blobCache[reference.digest] = \
+                    self.blobStore[reference.digest][0]
+        missing = [reference for reference in references
+                   if reference.digest not in self.blobCache
+                   and reference.digest not in self.callableCache]
+        if missing:
+            for reference in missing:
+                if future in self.pendingBlobs[reference.digest]:
+                    continue
+                if not self.pendingBlobs[reference.digest]:
+                    self.addPeer(reference.owner)
+                    self._sendDirect(reference.owner,
+                                     [BLOB_REQ, reference.digest])
+                self.pendingBlobs[reference.digest].append(future)
+            return False
+
+        if isinstance(future.callable, BlobReference):
+            # Callables are deserialized once and shared by their futures
+            digest = future.callable.digest
+            if digest not in self.callableCache:
+                self.callableCache[digest] = \
+                    self._blobValue(self.blobCache[digest])
+            future.callable = self.callableCache[digest]
+        # Held by the future in case the cache evicts them before it runs
+        future.blobFrames = dict(
+            (reference.digest, self.blobCache[reference.digest])
+            for reference in argumentBlobs
+        )
+        return True
+
+    def _packArguments(self, future):
+        """Serializes the arguments of a future apart, so they are only
+        deserialized by the worker running it."""
+        references = [value for value in
+                      list(future.args) + list(future.kargs.values())
+                      if isinstance(value, BlobReference)]
+        future.packedArguments = SerializedValue(
+            *self._dumps((future.args, future.kargs))[1:]
+        )
+        future.argumentBlobs = references
+        future.args = future.kargs = None
+
+    def loadArguments(self, future):
+        """Deserializes the arguments of a received future about to run."""
+        future.wireFrames = None
+        packed = getattr(future, 'packedArguments', None)
+        if packed is None:
+            return
+
+        def fromBlob(value):
+            if isinstance(value, BlobReference):
+                return self._blobValue(future.blobFrames[value.digest])
+            if isinstance(value, SerializedValue):
+                return value.load(self.serializer)
+            return value
+
+        # Blobs and arguments kept serialized are only deserialized here
         try:
-            thisFuture = pickle.loads(msg[1])
+            args, kargs = packed.load(self.serializer)
+            args = tuple(fromBlob(arg) for arg in args)
+            kargs = dict((key, fromBlob(value))
+                         for key, value in kargs.items())
         except (AttributeError, ImportError) as e:
-            scoop.logger.error(
-                "An instance could not find its base reference on a worker. "
-                "Ensure that your objects have their definition available in "
-                "the root scope of your program.\n{error}".format(
-                    error=e,
+            self._referenceBroken(e)
+        future.args, future.kargs = args, kargs
+        future.packedArguments = future.argumentBlobs = None
+        future.blobFrames = None
+
+    def _processStatusAnswer(self, msg):
+        """Merges the answer of a broker to a status request. Once every
+        broker answered, lost futures are resent."""
+        # TODO: This should not be here but in FuturesQueue.
+        if (self.statusAnswers is None
+                or decodeCount(msg[2].bytes) != self.statusAnswers[0]):
+            # Answer to an outdated request
+            return
+        # The answer holds one status byte per requested future
+        statuses = msg[1].bytes
+        merged = self.statusAnswers[2]
+        for index in range(len(statuses)):
+            if merged[index] == STATUS_NONE:
+                merged[index] = statuses[index:index + 1]
+        self.statusAnswers[1] -= 1
+        if self.statusAnswers[1] > 0:
+            return
+        task_ids = self.statusAnswers[3]
+        self.statusAnswers = None
+
+        if STATUS_HERE in merged:
+            # TODO: Don't know why should that be done?
+            self.sendRequest()
+        for task_id, status in zip(task_ids, merged):
+            if status != STATUS_NONE:
+                continue
+            # If a task was requested but is nowhere to be found, resend it
+            future_id = decodeId(task_id)
+            try:
+                scoop.logger.warning(
+                    "Lost track of future {0}. Resending it..."
+                    "".format(scoop._control.futureDict[future_id])
                 )
+                self.sendFuture(scoop._control.futureDict[future_id])
+            except KeyError:
+                # Future was received and processed meanwhile
+                pass
+
+    def _loadFuture(self, frames, index):
+        """Deserializes a received future."""
+        try:
+            return self._loads(frames, index)
+        except (AttributeError, ImportError) as e:
+            self._referenceBroken(e)
+
+    @staticmethod
+    def _referenceBroken(e):
+        """Reports an object whose definition is not found on this worker."""
+        scoop.logger.error(
+            "An instance could not find its base reference on a worker. "
+            "Ensure that your objects have their definition available in "
+            "the root scope of your program.\n{error}".format(
+                error=e,
             )
-            raise ReferenceBroken(e)
-
-        if msg[0] == TASK:
-            # Try to connect directly to this worker to send the result
-            # afterwards if Future is from a map.
-            if thisFuture.sendResultBack:
-                self.addPeer(thisFuture.id[0])
-
-        elif msg[0] == STATUS_ANS:
-            # TODO: This should not be here but in FuturesQueue.
-            if msg[2] == STATUS_HERE:
-                # TODO: Don't know why should that be done?
-                self.sendRequest()
-            elif msg[2] == STATUS_NONE:
-                # If a task was requested but is nowhere to be found, resend it
-                future_id = pickle.loads(msg[1])
-                try:
-                    scoop.logger.warning(
-                        "Lost track of future {0}. Resending it..."
-                        "".format(scoop._control.futureDict[future_id])
-                    )
-                    self.sendFuture(scoop._control.futureDict[future_id])
-                except KeyError:
-                    # Future was received and processed meanwhile
-                    pass
-            return
+        )
+        raise ReferenceBroken(e)
 
+    def _resolveCallable(self, thisFuture):
+        """Retrieves the callable of a future that was passed by name."""
         isCallable = callable(thisFuture.callable)
         isDone = thisFuture._ended()
         if not isCallable and not isDone:
@@ -287,12 +811,10 @@ class ZMQCommunicator(object):
             else:
                 raise ReferenceBroken("This element could not be pickled: "
                                       "{0}.".format(thisFuture))
-        return thisFuture
 
     def pumpInfoSocket(self):
         try:
-            while self.infoSocket.poll(0):
-                msg = self.infoSocket.recv_multipart()
+            for msg in self._infoMessages():
                 if msg[0] == SHUTDOWN:
                     if scoop.IS_ORIGIN is False:
                         raise Shutdown("Shutdown received")
@@ -303,11 +825,25 @@ class ZMQCommunicator(object):
                         )
                         raise Shutdown("Unexpected shutdown received")
                 elif msg[0] == VARIABLE:
-                    key = pickle.loads(msg[3])
-                    varValue = pickle.loads(msg[2])
-                    varName = pickle.loads(msg[1])
-                    shared.elements.setdefault(key, {}).update({varName: varValue})
-                    self.convertVariable(key, varName, varValue)
+                    version = decodeCount(msg[4])
+                    if version <= self.variableVersion:
+                        # Already received when this worker started
+                        continue
+                    self.variableVersion = version
+                    self.treeAnnounced.pop(msg[1], None)
+                    if msg[2]:
+                        self._storeVariable(msg[1], msg[2], msg[3], version)
+                    else:
+                        self._announceVariable(msg[1], version)
+                elif msg[0] == VARIABLE_DEL:
+                    version = decodeCount(msg[2])
+                    if version <= self.variableVersion:
+                        continue
+                    self.variableVersion = version
+                    self.treeAnnounced.pop(msg[1], None)
+                    self.treeValues.pop(msg[1], None)
+                    self._dropChunks(msg[1], version)
+                    shared.removeElement(pickle.loads(msg[1]), version)
                 elif msg[0] == BROKER_INFO:
                     # TODO: find out what to do here ...
                     if len(self.broker_set) == 0: # The first update
@@ -333,8 +869,29 @@ class ZMQCommunicator(object):
         except zmq.error.ZMQError:
             pass
 
+        # Requests the variables whose broadcast did not reach this worker
+        for key, (version, timestamp) in list(self.treeAnnounced.items()):
+            if time.time() - timestamp > TIME_BEFORE_VARIABLE_REQUEST:
+                scoop.logger.debug("Requesting a shared variable missed "
+                                   "during its broadcast.")
+                self.treeAnnounced[key] = (version, time.time())
+                self.variablesRequested += 1
+                self.socket.send_multipart([VARIABLE_REQ, key])
+
+    def _infoMessages(self):
+        """Yields the messages received on the info socket."""
+        if self.ioThread is not None:
+            while self.infoInbound:
+                yield self.infoInbound.popleft()
+        else:
+            while self.infoSocket.poll(0):
+                yield self.infoSocket.recv_multipart()
+
     def convertVariable(self, key, varName, varValue):
-        """Puts the function in the globals() of the main module."""
+        """Puts the function in the globals() of the main module. The values
+        shared in memory are only mapped once used."""
+        if isinstance(varValue, encapsulation.MappedEncapsulation):
+            varValue.releasePrevious()
         if isinstance(varValue, encapsulation.FunctionEncapsulation):
             result = varValue.getFunction()
 
@@ -343,18 +900,32 @@ class ZMQCommunicator(object):
             result.__name__ = varName
             result.__globals__.update(mainModule.__dict__)
             setattr(mainModule, varName, result)
-            shared.elements[key].update({
-                varName: result,
-            })
+            shared.storeElement(key, varName, result)
 
     def recvFuture(self):
         while self._poll(0):
-            received = self._recv()
-            if received:
+            for received in self._recv():
                 yield received
 
     def sendFuture(self, future):
         """Send a Future to be executed remotely."""
+        # The broker queues the tasks in order of their scheduling key
+        header = [
+            TASK,
+            encodeId(future.id),
+            encodeKey(future.remoteKey()),
+        ]
+        self.socket.send_multipart(header + self._futureFrames(future),
+                                   copy=False)
+
+    def _futureFrames(self, future):
+        """Returns the frames of a Future sent to be executed remotely."""
+        frames = getattr(future, 'wireFrames', None)
+        if frames is not None:
+            # Received and not started, forward it as it was received
+            future.wireFrames = None
+            return frames
+
         future = copy.copy(future)
         future.greenlet = None
         future.children = {}
@@ -363,21 +934,86 @@ class ZMQCommunicator(object):
             if shared.getConst(hash(future.callable), timeout=0):
                 # Enforce name reference passing if already shared
                 future.callable = SharedElementEncapsulation(hash(future.callable))
-            self.socket.send_multipart([
-                TASK,
-                pickle.dumps(future.id, pickle.HIGHEST_PROTOCOL),
-                pickle.dumps(future, pickle.HIGHEST_PROTOCOL),
-            ])
+            self._extractBlobs(future)
+            self._packArguments(future)
+            frames = self._dumps(future)
         except (pickle.PicklingError, TypeError) as e:
             # If element not picklable, pickle its name
             # TODO: use its fully qualified name
             scoop.logger.warn("Pickling Error: {0}".format(e))
             future.callable = hash(future.callable)
-            self.socket.send_multipart([
-                TASK,
-                pickle.dumps(future.id, pickle.HIGHEST_PROTOCOL),
-                pickle.dumps(future, pickle.HIGHEST_PROTOCOL),
-            ])
+            frames = self._dumps(future)
+        return frames
+
+    def _giveFutures(self, thief, credit):
+        """Answers a steal attempt with queued futures. The brokers are told
+        where they went, so they are not deemed lost."""
+        futures = scoop._control.execQueue.giveFutures(credit)
+        frames = [frame for future in futures
+                  for frame in self._futureFrames(future)]
+        # An empty answer tells the thief there is nothing left to steal
+        self.addPeer(thief)
+        self._execute(self._tryGive, thief, [TASK] + frames, futures)
+
+    def _tryGive(self, thief, msg, futures):
+        try:
+            self.direct_socket.send_multipart([thief] + msg,
+                                              flags=zmq.NOBLOCK, copy=False)
+        except zmq.error.ZMQError:
+            # The thief left, the futures will be resent as lost
+            scoop.logger.debug("Could not give futures to {0}.".format(thief))
+            return
+        if not futures:
+            return
+        self.futuresGiven += len(futures)
+        given = [GIVEN, thief] + [encodeId(future.id) for future in futures]
+        # Every broker tracks the location of the futures
+        for _ in range(len(self.broker_set)):
+            self.socket.send_multipart(given)
+
+    def stealFutures(self, credit=1):
+        """Asks a busy peer for up to credit futures. Called by an idle
+        worker, at most every TIME_BETWEEN_STEALS seconds. Returns whether
+        busy peers are known."""
+        if not self.busyPeers:
+            return False
+        if time.time() - self.lastSteal < TIME_BETWEEN_STEALS:
+            return True
+        self.lastSteal = time.time()
+        # Try the known busy peers in turn
+        peer = self.busyPeers[0]
+        self.busyPeers.rotate(-1)
+        self.addPeer(peer)
+        self._execute(self._trySteal, peer, credit)
+        return True
+
+    def _trySteal(self, peer, credit):
+        try:
+            self.direct_socket.send_multipart(
+                [peer, STEAL, encodeCount(credit)],
+                flags=zmq.NOBLOCK,
+            )
+        except zmq.error.ZMQError:
+            self._discardPeer(peer)
+
+    def _discardPeer(self, peer):
+        try:
+            self.busyPeers.remove(peer)
+        except ValueError:
+            pass
+
+    def advertiseLoad(self, busy):
+        """Tells the brokers whether this worker has futures to be stolen.
+        Changes are sent at most every TIME_BETWEEN_STEALS seconds."""
+        if not self.workStealing or busy == self.advertisedBusy:
+            return
+        if time.time() - self.lastAdvertised < TIME_BETWEEN_STEALS:
+            return
+        self.advertisedBusy = busy
+        self.lastAdvertised = time.time()
+        busy = encodeFlag(busy)
+        for _ in range(len(self.broker_set)):
+            self.socket.send_multipart([BUSY, busy])
 
     def sendResult(self, future):
         """Send a terminated future back to its parent."""
@@ -390,58 +1026,280 @@ class ZMQCommunicator(object):
             # Don't reply back the result if it isn't asked
             future.resultValue = None
 
+        destination = future.id[0]
+        self.addPeer(destination)
+        # Serialized by the I/O thread, if any, while the next future runs
+        self._execute(self._sendResult, future)
+
+    def _sendResult(self, future):
         self._sendReply(
             future.id[0],
-            pickle.dumps(future.id, pickle.HIGHEST_PROTOCOL),
-            pickle.dumps(future, pickle.HIGHEST_PROTOCOL),
+            encodeId(future.id),
+            *self._dumps(future)
         )
 
     def _sendReply(self, destination, fid, *args):
         """Send a REPLY directly to its destination. If it doesn't work, launch
         it back to the broker."""
-        # Try to send the result directly to its parent
+        self._sendDirect(destination, [REPLY, fid] + list(args))
+
+        self.socket.send_multipart([
+            STATUS_DONE,
+            fid,
+        ])
+
+    def _sendDirect(self, destination, msg):
+        """Send a message directly to a worker, or through the broker if no
+        direct connection is possible."""
+        # Try to send the message directly to the worker
         self.addPeer(destination)
+        # The fallback depends on the outcome of the send
+        self._execute(self._trySendDirect, destination, msg)
 
+    def _trySendDirect(self, destination, msg):
         try:
-            self.direct_socket.send_multipart([
-                destination,
-                REPLY,
-            ] + list(args),
-                flags=zmq.NOBLOCK)
+            self.direct_socket.send_multipart([destination] + msg,
+                                              flags=zmq.NOBLOCK, copy=False)
         except zmq.error.ZMQError as e:
             # Fallback on Broker routing if no direct connection possible
             scoop.logger.debug(
-                "{0}: Could not send result directly to peer {1}, routing through "
-                "broker.".format(scoop.worker, destination)
+                "{0}: Could not send message directly to peer {1}, routing "
+                "through broker.".format(scoop.worker, destination)
             )
+            self.socket.send_multipart(msg + [destination], copy=False)
+
+    def sendStatusRequest(self, futures):
+        """Request the status of a list of futures to every broker in a
+        single message per broker."""
+        self.statusRound += 1
+        task_ids = [encodeId(future.id) for future in futures]
+        # The answers only hold the statuses, in the order of the ids
+        self.statusAnswers = [self.statusRound, len(self.broker_set),
+                              [STATUS_NONE] * len(futures), task_ids]
+        task_ids = encodeList(task_ids)
+        statusRound = encodeCount(self.statusRound)
+        for _ in range(len(self.broker_set)):
+            self.socket.send_multipart([STATUS_REQ, task_ids, statusRound])
+
+    def sendVariable(self, key, value):
+        pickledKey = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self.pendingVariables[pickledKey] = (key, value, payload)
+        msg = [
+            VARIABLE,
+            pickledKey,
+            payload,
+            scoop.worker,
+        ]
+        if self.treeBroadcast and len(payload) >= TREE_BROADCAST_THRESHOLD:
+            # Asks the broker for the workers to send it to
+            msg.append(encodeFlag(True))
+        self.socket.send_multipart(msg)
+
+    def deleteVariables(self, keys):
+        for key in keys:
+            pickledKey = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+            self.pendingVariables[pickledKey] = (key, DELETED, None)
             self.socket.send_multipart([
-                REPLY, 
-                ] + list(args) + [
-                destination,
+                VARIABLE_DEL,
+                pickledKey,
+                scoop.worker,
             ])
 
-        self.socket.send_multipart([
-            STATUS_DONE,
-            fid,
-        ])
+    def _variableAcknowledged(self, pickledKey, version, recipients=None):
+        """Makes a shared variable available, or removes it, on this worker
+        once a broker stored it. Sends its value to the recipients given by
+        the broker, if any."""
+        try:
+            varName, varValue, payload = self.pendingVariables.pop(pickledKey)
+        except KeyError:
+            # Acknowledgement of a resent variable
+            return
+        if recipients:
+            self._broadcastVariable(pickledKey, payload, version, recipients)
+        announced = self.treeAnnounced.get(pickledKey)
+        if announced is not None and announced[0] == version:
+            # Own variable announced before its acknowledgement
+            del self.treeAnnounced[pickledKey]
+        elif version <= self.variableVersion:
+            # Already received from the info socket
+            return
+        if varValue is DELETED:
+            shared.removeElement(varName, version)
+        elif shared.storeElement(scoop.worker, varName, varValue, version):
+            self.convertVariable(scoop.worker, varName, varValue)
 
-    def sendStatusRequest(self, future):
-        self.socket.send_multipart([
-            STATUS_REQ,
-            pickle.dumps(future.id, pickle.HIGHEST_PROTOCOL),
-        ])
+    def _storeVariable(self, pickledKey, payload, owner, version):
+        """Makes a shared variable received from a broker or the workers
+        available on this worker."""
+        self._dropChunks(pickledKey, version)
+        varName = pickle.loads(pickledKey)
+        if version <= shared.versions.get(varName, -1):
+            # Already acknowledged to this worker
+            return
+        varValue = pickle.loads(payload)
+        if shared.storeElement(owner, varName, varValue, version):
+            self.convertVariable(owner, varName, varValue)
 
-    def sendVariable(self, key, value):
-        self.socket.send_multipart([
-            VARIABLE,
-            pickle.dumps(key, pickle.HIGHEST_PROTOCOL),
-            pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
-            pickle.dumps(scoop.worker, pickle.HIGHEST_PROTOCOL),
-        ])
+    def _announceVariable(self, pickledKey, version):
+        """Waits for the value of a shared variable broadcast through the
+        workers, unless it was already received."""
+        if version <= shared.versions.get(pickle.loads(pickledKey), -1):
+            return
+        received = self.treeValues.pop(pickledKey, None)
+        if received is not None and received[2] >= version:
+            self._storeVariable(pickledKey, *received)
+        else:
+            self.treeAnnounced[pickledKey] = (version, time.time())
+
+    def _receiveVariable(self, pickledKey, payload, owner, version):
+        """Handles the value of a shared variable broadcast through the
+        workers, received from them or from a broker."""
+        announced = self.treeAnnounced.get(pickledKey)
+        if announced is not None and version >= announced[0]:
+            del self.treeAnnounced[pickledKey]
+            self._storeVariable(pickledKey, payload, owner, version)
+        elif announced is None and version > self.variableVersion:
+            # Received before its announcement
+            self.treeValues[pickledKey] = (payload, owner, version)
+        else:
+            self._dropChunks(pickledKey, version)
+
+    def _broadcastVariable(self, pickledKey, payload, version, recipients):
+        """Sends the chunks of a shared variable to the recipients, through
+        each other."""
+        count = max(1, -(-len(payload) // TREE_CHUNK_SIZE))
+        view = memoryview(payload)
+        for index in range(count):
+            self._forwardChunk(
+                [VARIABLE_CHUNK, pickledKey, scoop.worker,
+                 encodeCount(version), encodeCount(index),
+                 encodeCount(count)],
+                recipients,
+                view[index * TREE_CHUNK_SIZE:(index + 1) * TREE_CHUNK_SIZE],
+            )
+
+    def _forwardChunk(self, head, recipients, chunk):
+        """Sends a chunk to the first worker of every part of the recipients,
+        which forwards it to the rest of its part."""
+        size = -(-len(recipients) // TREE_FANOUT)
+        for start in range(0, len(recipients), size or 1):
+            part = recipients[start:start + size]
+            self._sendDirect(part[0], head + [encodeList(part[1:]), chunk])
+
+    def _receiveChunk(self, msg):
+        """Forwards a chunk of a shared variable broadcast through the
+        workers, and handles the variable once every chunk is received."""
+        pickledKey, owner = msg[1].bytes, msg[2].bytes
+        version = decodeCount(msg[3].bytes)
+        index, count = decodeCount(msg[4].bytes), decodeCount(msg[5].bytes)
+        if self.ioThread is None:
+            # The I/O thread forwards the chunks on reception. Without it,
+            # they are only forwarded once the current future ends
+            self._forwardChunk(msg[:6], decodeList(msg[6].bytes), msg[7])
+
+        # Remaining chunks count and chunks
+        entry = self.treeChunks.setdefault((pickledKey, version),
+                                           [count, [None] * count])
+        if entry[1][index] is None:
+            entry[0] -= 1
+            entry[1][index] = msg[7].bytes
+        if entry[0] == 0:
+            del self.treeChunks[(pickledKey, version)]
+            self._receiveVariable(pickledKey, b"".join(entry[1]), owner,
+                                  version)
+
+    def _dropChunks(self, pickledKey, version):
+        """Forgets the chunks of the outdated values of a shared variable."""
+        for key in list(self.treeChunks):
+            if key[0] == pickledKey and key[1] <= version:
+                del self.treeChunks[key]
 
-    def sendRequest(self):
+    def waitVariables(self, names, timeout=TIME_BETWEEN_VARIABLE_RESENDS):
+        """Blocks until the shared variables are acknowledged or timeout
+        seconds elapsed. The futures received meanwhile are queued."""
+        names = set(names)
+        deadline = time.time() + timeout
+        while any(entry[0] in names
+                  for entry in self.pendingVariables.values()):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            if self._poll(remaining * 1000):
+                scoop._control.execQueue.updateQueue()
+
+    def mapVariable(self, value):
+        """Returns a view on a value shared in memory, or None if it was
+        updated or deleted since. The first worker of the host needing it
+        fetches it from the worker which set it and writes its file, the
+        others wait for this file. The futures received meanwhile are
+        queued. Raises ReferenceBroken if the value could not be fetched
+        within TIME_BEFORE_MAPPED_FAILURE seconds."""
+        deadline = time.time() + TIME_BEFORE_MAPPED_FAILURE
+        while True:
+            view = value.getView()
+            if view is not None:
+                return view
+            if value.lock():
+                try:
+                    # Written by the previous holder of the lock
+                    view = value.getView()
+                    if view is not None:
+                        return view
+                    data = self._fetchMapped(value, deadline)
+                    if data is None:
+                        return None
+                    value.writeFile(data)
+                finally:
+                    value.unlock()
+            elif time.time() > deadline:
+                raise ReferenceBroken(
+                    "The value shared in memory {0} was not written on this "
+                    "host in time.".format(value.name)
+                )
+            elif self._poll(10):
+                scoop._control.execQueue.updateQueue()
+
+    def _fetchMapped(self, value, deadline):
+        """Requests the value of a constant shared in memory to the worker
+        which set it, until deadline. Returns None if this worker no longer
+        has it."""
+        digest = value.uid.encode("ascii")
+        self.fetchedMapped[digest] = None
+        nextRequest = 0
+        try:
+            while self.fetchedMapped[digest] is None:
+                now = time.time()
+                if now > deadline:
+                    raise ReferenceBroken(
+                        "The value shared in memory {0} could not be fetched "
+                        "from worker {1}.".format(value.name, value.owner)
+                    )
+                if now >= nextRequest:
+                    # Resent in case the request or the worker was lost
+                    self._sendDirect(value.owner, [BLOB_REQ, digest])
+                    nextRequest = now + TIME_BETWEEN_VARIABLE_RESENDS
+                if self._poll((min(nextRequest, deadline) - now) * 1000):
+                    scoop._control.execQueue.updateQueue()
+        finally:
+            data = self.fetchedMapped.pop(digest)
+        if data is False:
+            return None
+        return data
+
+    def receiveVariables(self, timeout):
+        """Waits up to timeout seconds for the shared variables broadcast
+        through the workers. The futures received meanwhile are queued."""
+        if not self.treeAnnounced:
+            time.sleep(timeout)
+        elif self._poll(timeout * 1000):
+            scoop._control.execQueue.updateQueue()
+
+    def sendRequest(self, credit=1):
+        """Request up to credit futures from every broker."""
+        credit = encodeCount(credit)
         for _ in range(len(self.broker_set)):
-            self.socket.send(REQUEST)
+            self.socket.send_multipart([REQUEST, credit])
 
     def workerDown(self):
         self.socket.send(WORKERDOWN)
@@ -451,6 +1309,9 @@ class ZMQCommunicator(object):
         if self.ZMQcontext and not self.ZMQcontext.closed:
             scoop.SHUTDOWN_REQUESTED = True
             self.socket.send(SHUTDOWN)
+            if self.ioThread is not None:
+                # Send the queued messages and take the sockets back
+                self.ioThread.stop()
             
             # pyzmq would issue an 'no module named zmqerror' on windows
             # without this
@@ -463,3 +1324,8 @@ class ZMQCommunicator(object):
                 pass
 
             self.ZMQcontext.destroy()
+            if self.ipcPath is not None:
+                try:
+                    os.unlink(self.ipcPath)
+                except OSError:
+                    pass
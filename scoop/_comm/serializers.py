@@ -0,0 +1,114 @@
+#
+#    This file is part of Scalable COncurrent Operations in Python (SCOOP).
+#
+#    SCOOP is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    SCOOP is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
+#
+"""This file contains the serializers used to transmit objects between
+workers.
+
+A serializer converts an object into a payload and a list of out-of-band
+buffers. The buffers are sent as separate frames without being copied, so
+large arrays must not be modified until the Future using them completes."""
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+# Buffers smaller than this size (in bytes) are kept inside the payload
+OUT_OF_BAND_THRESHOLD = 64 * 1024
+
+
+class PickleSerializer(object):
+    """Serializes objects using pickle. The out-of-band buffers of pickle
+    protocol 5 are used when available."""
+    def __init__(self, module=pickle):
+        self.module = module
+        self.protocol = pickle.HIGHEST_PROTOCOL
+
+    def dumps(self, obj):
+        """Returns the payload and the out-of-band buffers of an object."""
+        if self.protocol < 5:
+            return self.module.dumps(obj, self.protocol), []
+
+        buffers = []
+
+        def bufferCallback(picklebuffer):
+            # Returning a true value serializes the buffer in-band
+            try:
+                raw = picklebuffer.raw()
+            except BufferError:
+                # Non-contiguous buffer
+                return True
+            if raw.nbytes < OUT_OF_BAND_THRESHOLD:
+                return True
+            buffers.append(raw)
+            return False
+
+        payload = self.module.dumps(obj, self.protocol,
+                                    buffer_callback=bufferCallback)
+        return payload, buffers
+
+    def loads(self, payload, buffers=()):
+        """Rebuilds an object from its payload and out-of-band buffers."""
+        if buffers:
+            return pickle.loads(payload, buffers=buffers)
+        return pickle.loads(payload)
+
+
+class SerializedValue(object):
+    """Value kept in its serialized form until it is loaded. Its payload and
+    buffers are pickled out-of-band, so a value received and sent again is
+    neither deserialized nor copied."""
+    __slots__ = ('payload', 'buffers')
+
+    def __init__(self, payload, *buffers):
+        self.payload = payload
+        self.buffers = list(buffers)
+
+    def __reduce_ex__(self, protocol):
+        frames = [self.payload] + self.buffers
+        if protocol >= 5:
+            frames = [pickle.PickleBuffer(frame) for frame in frames]
+        else:
+            frames = [bytes(frame) for frame in frames]
+        return SerializedValue, tuple(frames)
+
+    def load(self, serializer):
+        """Deserializes the value using serializer."""
+        return serializer.loads(self.payload, self.buffers)
+
+
+class CloudPickleSerializer(PickleSerializer):
+    """Serializes objects using cloudpickle, which handles lambdas, closures
+    and interactively defined objects by value."""
+    def __init__(self):
+        import cloudpickle
+        super(CloudPickleSerializer, self).__init__(cloudpickle)
+
+
+# Available serializers by name; other serializers implementing dumps() and
+# loads() can be registered here.
+SERIALIZERS = {
+    'pickle': PickleSerializer,
+    'cloudpickle': CloudPickleSerializer,
+}
+
+
+def getSerializer(name='pickle'):
+    """Returns an instance of the serializer registered under name."""
+    try:
+        return SERIALIZERS[name]()
+    except KeyError:
+        raise ValueError("Unknown serializer: {0}.".format(name))
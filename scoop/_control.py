@@ -131,6 +131,21 @@ def delFuture(afuture):
         pass
 
 
+def updateStats(callable_, executionTime):
+    """Add an execution time to the worker inner work statistics of a
+    callable."""
+    if executionTime != 0. and hasattr(callable_, '__name__'):
+        recordStats(hash(callable_), executionTime)
+
+
+def recordStats(callableHash, executionTime):
+    """Add an execution time to the statistics of the callable of the given
+    hash."""
+    execStats[callableHash].appendleft(executionTime)
+    if execQueue is not None:
+        execQueue.statsChanged(callableHash)
+
+
 def runFuture(future):
     """Callable greenlet in charge of running tasks."""
     global debug_stats
@@ -147,6 +162,8 @@ def runFuture(future):
         uniqueReference = None
     future.executor = (scoop.worker, uniqueReference)
     try:
+        # Arguments of received futures are deserialized only when run
+        execQueue.socket.loadArguments(future)
         future.resultValue = future.callable(*future.args, **future.kargs)
     except BaseException as err:
         future.exceptionValue = err
@@ -160,8 +177,8 @@ def runFuture(future):
     future.isDone = True
 
     # Update the worker inner work statistics
-    if future.executionTime != 0. and hasattr(future.callable, '__name__'):
-        execStats[hash(future.callable)].appendleft(future.executionTime)
+    updateStats(future.callable, future.executionTime)
+    execQueue.futureExecuted(future)
 
     # Set debugging informations if needed
     if scoop.DEBUG:
@@ -176,7 +193,7 @@ def runFuture(future):
                 else 'No name',
            'parent': future.parentId
         })
-        QueueLength.append((t, len(execQueue), execQueue.timelen(execQueue)))
+        QueueLength.append((t, len(execQueue), execQueue.timelen()))
 
     # Run callback (see http://www.python.org/dev/peps/pep-3148/#future-objects)
     future._execute_callbacks(CallbackType.universal)
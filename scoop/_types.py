@@ -15,6 +15,7 @@
 #    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
 #
 from collections import namedtuple, deque
+import heapq
 import itertools
 import time
 import sys
@@ -30,6 +31,24 @@ else:
 
 
 POLLING_TIME = 2000
+# Polling time (in ms) of an idle worker able to steal futures from its peers
+STEAL_POLLING_TIME = 100
+# Time (in seconds) of execution kept on a worker whose futures can be stolen
+STEAL_HIGHWATERMARK = 1.
+# Maximum number of futures requested at once to a broker
+MAX_PREFETCH = 64
+# The straggling futures of a speculative map are sent again once this ratio
+# of its futures is done and none completed for SPECULATIVE_SLOWDOWN times
+# the median execution time of its callable
+SPECULATIVE_DONE_RATIO = 0.9
+SPECULATIVE_SLOWDOWN = 3.
+# Futures are scheduled as if submitted PRIORITY_AGING seconds earlier per
+# priority level, so a future never waits behind futures of higher priority
+# submitted more than that long after it
+PRIORITY_AGING = 60.
+# Workers run their deepest futures first, as if submitted DEPTH_AGING seconds
+# earlier per level of nesting, and hand out their shallowest ones first
+DEPTH_AGING = 10.
 
 
 class CallbackType:
@@ -98,12 +117,33 @@ class Future(object):
         self.isDone = False
         self.callback = []  # set callback
         self.children = {}  # set children list of the callable (dict for speedier delete)
+        self.priority = 0  # futures of greater priority are executed first
+        self.depth = 0  # number of ancestors of the future
+        self.submitTime = time.time()
         # insert future into global dictionary
         scoop._control.futureDict[self.id] = self
 
     def __lt__(self, other):
-        """Order futures by creation time."""
-        return self.creationTime < other.creationTime
+        """Order futures by local scheduling key, then by id."""
+        return ((self.localKey(), self.id)
+                < (other.localKey(), other.id))
+
+    def schedulingKey(self):
+        """Returns the key in increasing order of which futures are
+        executed: their submission time, moved back by their priority."""
+        return self.submitTime - self.priority * PRIORITY_AGING
+
+    def localKey(self):
+        """Returns the scheduling key of the future on its worker. Deep
+        futures go first, so nested futures are executed depth-first and
+        the futures their ancestors wait on are completed early."""
+        return self.schedulingKey() - self.depth * DEPTH_AGING
+
+    def remoteKey(self):
+        """Returns the scheduling key of the future when sent to other
+        workers. Shallow futures, which hold the largest subtrees of work,
+        go first."""
+        return self.schedulingKey() + self.depth * DEPTH_AGING
 
     def __eq__(self, other):
         # This uses he fact that id's are unique
@@ -256,20 +296,253 @@ class Future(object):
         scoop._control.execQueue.inprogress.discard(self)
         for child in self.children:
             child.exceptionValue = CancelledError()
+        if self.id[0] == scoop.worker:
+            # No other worker needs its arguments anymore
+            scoop._control.execQueue.socket.releaseBlobs(self.id)
         scoop._control.delFuture(self)
 
 
+class TimeEstimate(object):
+    """Running estimate of the time needed to execute a collection of
+    futures, based on the execution statistics of their callables. The
+    estimate is updated as futures are added or removed and when the
+    statistics of a callable change, so it is obtained in constant time."""
+    def __init__(self):
+        self.counts = Counter()  # callable hash: number of queued futures
+        self.medians = {}  # callable hash: median included in the estimate
+        self.knownTime = 0.
+        self.unknown = 0  # number of futures without execution statistics
+
+    def _add(self, future):
+        key = hash(future.callable)
+        try:
+            median = self.medians[key]
+        except KeyError:
+            median = scoop._control.execStats[key].median()
+            self.medians[key] = median
+        self.counts[key] += 1
+        if median == float("inf"):
+            self.unknown += 1
+        else:
+            self.knownTime += median
+
+    def _discard(self, future):
+        key = hash(future.callable)
+        if key not in self.medians:
+            return
+        median = self.medians[key]
+        self.counts[key] -= 1
+        if self.counts[key] <= 0:
+            del self.counts[key]
+            del self.medians[key]
+        if median == float("inf"):
+            self.unknown -= 1
+        else:
+            self.knownTime -= median
+        if not self.counts:
+            # Avoid accumulating floating point errors
+            self.knownTime = 0.
+
+    def _reset(self):
+        self.counts.clear()
+        self.medians.clear()
+        self.knownTime = 0.
+        self.unknown = 0
+
+    def statsChanged(self, key):
+        """Update the estimate after the statistics of a callable changed."""
+        if key not in self.medians:
+            return
+        count = self.counts[key]
+        median = self.medians[key]
+        if median == float("inf"):
+            self.unknown -= count
+        else:
+            self.knownTime -= median * count
+        median = scoop._control.execStats[key].median()
+        self.medians[key] = median
+        if median == float("inf"):
+            self.unknown += count
+        else:
+            self.knownTime += median * count
+
+    def timelen(self):
+        """Returns the estimated time needed to execute the queued futures."""
+        if self.unknown:
+            return float("inf")
+        return self.knownTime
+
+
+class TimedDeque(TimeEstimate, deque):
+    """Deque of futures keeping a running estimate of the time needed to
+    execute its elements."""
+    def __init__(self):
+        deque.__init__(self)
+        TimeEstimate.__init__(self)
+
+    def append(self, future):
+        super(TimedDeque, self).append(future)
+        self._add(future)
+
+    def appendleft(self, future):
+        super(TimedDeque, self).appendleft(future)
+        self._add(future)
+
+    def pop(self):
+        future = super(TimedDeque, self).pop()
+        self._discard(future)
+        return future
+
+    def popleft(self):
+        future = super(TimedDeque, self).popleft()
+        self._discard(future)
+        return future
+
+    def remove(self, future):
+        super(TimedDeque, self).remove(future)
+        self._discard(future)
+
+    def clear(self):
+        super(TimedDeque, self).clear()
+        self._reset()
+
+
+class TimedHeap(TimeEstimate):
+    """Heap of futures keeping a running estimate of the time needed to
+    execute its elements. Futures are popped from the left in increasing
+    order of scheduling key, which accounts for their priority, or first in
+    increasing order of the given key.
+
+    Both orders are kept in a heap of entries. Removed entries are only
+    flagged and skipped once they reach the top of a heap, so every
+    operation runs in logarithmic time."""
+    def __init__(self, key=None):
+        TimeEstimate.__init__(self)
+        self.key = key
+        self.sequence = itertools.count()
+        self.clear()
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return (entry[0] for _, _, entry in self.heap if entry[1])
+
+    def __contains__(self, future):
+        return future in self.entries
+
+    def append(self, future):
+        # Entries are [future, alive]
+        entry = [future, True]
+        sequence = next(self.sequence)
+        heapq.heappush(self.heap, (future, sequence, entry))
+        if self.key is not None:
+            heapq.heappush(self.keyHeap, (self.key(future), sequence, entry))
+        self.entries.setdefault(future, []).append(entry)
+        self.size += 1
+        self._add(future)
+
+    def popleft(self):
+        return self._pop(self.heap)
+
+    def popFirst(self):
+        """Removes and returns the first future in increasing order of the
+        key of the heap."""
+        return self._pop(self.keyHeap if self.key is not None else self.heap)
+
+    def remove(self, future):
+        try:
+            entry = self.entries[future][0]
+        except KeyError:
+            raise ValueError("Future not in the heap.")
+        self._forget(entry)
+
+    def clear(self):
+        self.heap = []
+        self.keyHeap = []
+        # Alive entries of every future
+        self.entries = {}
+        self.size = 0
+        self._reset()
+
+    def _pop(self, heap):
+        while heap:
+            entry = heapq.heappop(heap)[2]
+            if entry[1]:
+                self._forget(entry)
+                return entry[0]
+        raise IndexError("pop from an empty heap")
+
+    def _forget(self, entry):
+        """Flags an entry as removed from both heaps."""
+        future = entry[0]
+        entry[1] = False
+        entries = self.entries[future]
+        entries.remove(entry)
+        if not entries:
+            del self.entries[future]
+        self.size -= 1
+        self._discard(future)
+        # Drop the removed entries once they outnumber the alive ones
+        for heap in (self.heap, self.keyHeap):
+            if len(heap) > 2 * self.size + 16:
+                heap[:] = [item for item in heap if item[2][1]]
+                heapq.heapify(heap)
+
+
+class StragglerGroup(object):
+    """Futures of a speculative map, watched for the ones lagging behind."""
+    def __init__(self, futures):
+        self.futures = list(futures)
+        self.pending = list(futures)
+        self.lastProgress = time.time()
+        # Execution times of the futures of the map run remotely
+        self.execTimes = scoop._control._stat()
+        self.resent = set()
+
+    def stragglers(self):
+        """Returns the unfinished futures to send again."""
+        now = time.time()
+        pending = []
+        for future in self.pending:
+            if future._ended():
+                executionTime = getattr(future, 'executionTime', 0.)
+                if executionTime > 0.:
+                    self.execTimes.appendleft(executionTime)
+                self.lastProgress = now
+            else:
+                pending.append(future)
+        self.pending = pending
+
+        allowed = max(1, int((1. - SPECULATIVE_DONE_RATIO) * len(self.futures)))
+        if not pending or len(pending) > allowed:
+            return []
+        median = scoop._control.execStats[hash(pending[0].callable)].median()
+        if median == float("inf"):
+            median = self.execTimes.median()
+        if now - self.lastProgress < SPECULATIVE_SLOWDOWN * median:
+            return []
+        return [future for future in pending if future not in self.resent]
+
+
 class FutureQueue(object):
     """This class encapsulates a queue of futures that are pending execution.
     Within this class lies the entry points for future communications."""
     def __init__(self):
         """Initialize queue to empty elements and create a communication
         object."""
-        self.movable = deque()
-        self.ready = deque()
+        # Futures not started yet, by local scheduling key, and the done ones
+        self.movable = TimedHeap(Future.remoteKey)
+        self.ready = TimedDeque()
         self.inprogress = set()
         self.socket = Communicator()
         self.lastStatus = 0.0
+        # Execution times of the futures run by this worker
+        self.execTimes = scoop._control._stat()
+        # Speculative maps and ids of the futures sent again by them
+        self.stragglerGroups = []
+        self.speculated = set()
+        self.workStealing = scoop.CONFIGURATION.get('workStealing', False)
         if scoop.SIZE == 1 and not scoop.CONFIGURATION.get('headless', False):
             self.lowwatermark = float("inf")
             self.highwatermark = float("inf")
@@ -277,6 +550,9 @@ class FutureQueue(object):
             # TODO: Make it dependent on the network latency
             self.lowwatermark = 0.01
             self.highwatermark = 0.01
+            if self.workStealing:
+                # Futures are kept until idle peers steal them
+                self.highwatermark = STEAL_HIGHWATERMARK
 
     def __del__(self):
         """Destructor. Ensures Communicator is correctly discarted."""
@@ -291,10 +567,18 @@ class FutureQueue(object):
         lengths."""
         return len(self.movable) + len(self.ready)
 
-    def timelen(self, queue_):
-        stats = scoop._control.execStats
-        times = Counter(hash(f.callable) for f in queue_)
-        return sum(stats[f].median() * occur for f, occur in times.items())
+    def timelen(self, queue_=None):
+        """Returns the estimated execution time of the given deque, or of the
+        whole queue if none is given."""
+        if queue_ is None or queue_ is self:
+            return self.movable.timelen() + self.ready.timelen()
+        return queue_.timelen()
+
+    def statsChanged(self, callableHash):
+        """Notify the queue that the execution statistics of a callable
+        changed."""
+        self.movable.statsChanged(callableHash)
+        self.ready.statsChanged(callableHash)
 
     def append(self, future):
         """Append a future to the queue."""
@@ -307,10 +591,10 @@ class FutureQueue(object):
         else:
             self.movable.append(future)
 
-            # Send the oldest future in the movable deque until under the hwm
+            # Send the shallowest movable futures until under the hwm
             over_hwm = self.timelen(self.movable) > self.highwatermark
             while over_hwm and len(self.movable) > 1:
-                sending_future = self.movable.popleft()
+                sending_future = self.movable.popFirst()
                 if sending_future.id[0] != scoop.worker:
                     sending_future._delete()
                 self.socket.sendFuture(sending_future)
@@ -324,22 +608,24 @@ class FutureQueue(object):
             return
         self.lastStatus = time.time()
 
-        for future in scoop._control.futureDict.values():
+        futures = [
+            future for future in scoop._control.futureDict.values()
             # Skip the root future
-            if scoop.IS_ORIGIN and future.id == (scoop.worker, 0):
-                continue
-
-            if future not in self.inprogress:
-                self.socket.sendStatusRequest(future)
+            if not (scoop.IS_ORIGIN and future.id == (scoop.worker, 0))
+            and future not in self.inprogress
+        ]
+        if futures:
+            self.socket.sendStatusRequest(futures)
 
     def pop(self):
         """Pop the next future from the queue;
         in progress futures have priority over those that have not yet started;
-        higher level futures have priority over lower level ones; """
+        deeper futures have priority over shallower ones; """
         self.updateQueue()
+        self.socket.advertiseLoad(len(self.movable) > 1)
 
         # If our buffer is underflowing, request more Futures
-        if self.timelen(self) < self.lowwatermark:
+        if self.timelen() < self.lowwatermark:
             self.requestFuture()
 
         # If an unmovable Future is ready to be executed, return it
@@ -355,7 +641,11 @@ class FutureQueue(object):
             while len(self) == 0:
                 # Block until message arrives
                 self.askForPreviousFutures()
-                self.socket._poll(POLLING_TIME)
+                self.sendStragglers()
+                if self.socket.stealFutures(self.prefetchCredit()):
+                    self.socket._poll(STEAL_POLLING_TIME)
+                else:
+                    self.socket._poll(POLLING_TIME)
                 self.updateQueue()
             if len(self.ready) != 0:
                 return self.ready.popleft()
@@ -372,9 +662,50 @@ class FutureQueue(object):
         self.ready.clear()
         self.movable.clear()
 
+    def watchStragglers(self, futures):
+        """Watch the futures of a speculative map, so the ones lagging behind
+        the others are sent again to be executed by another worker."""
+        self.stragglerGroups.append(StragglerGroup(futures))
+
+    def sendStragglers(self):
+        """Send again the straggling futures of the speculative maps. The
+        first result received wins."""
+        for group in list(self.stragglerGroups):
+            for future in group.stragglers():
+                if future.greenlet is not None or future in self.movable:
+                    # Running or waiting on this worker
+                    continue
+                scoop.logger.debug("Sending again straggling future "
+                                   "{0}".format(future.id))
+                group.resent.add(future)
+                self.speculated.add(future.id)
+                self.socket.sendFuture(future)
+            if not group.pending:
+                # The broker mostly drops the late results of the futures
+                # sent again, so their ids would never be discarded
+                self.speculated.difference_update(
+                    future.id for future in group.resent
+                )
+                self.stragglerGroups.remove(group)
+
     def requestFuture(self):
         """Request futures from the broker"""
-        self.socket.sendRequest()
+        self.socket.sendRequest(self.prefetchCredit())
+
+    def prefetchCredit(self):
+        """Returns the number of futures to request at once: enough to fill
+        the local buffer up to the high watermark according to the measured
+        execution time of the futures run by this worker."""
+        taskTime = self.execTimes.median()
+        room = self.highwatermark - self.timelen()
+        if room <= 0 or taskTime == float("inf"):
+            return 1
+        return int(max(1, min(MAX_PREFETCH, room / taskTime)))
+
+    def futureExecuted(self, future):
+        """Record the execution time of a future run by this worker."""
+        if future.executionTime > 0.:
+            self.execTimes.appendleft(future.executionTime)
 
     def updateQueue(self):
         """Process inbound communication buffer.
@@ -385,6 +716,10 @@ class FutureQueue(object):
                 try:
                     thisFuture = scoop._control.futureDict[future.id]
                 except KeyError:
+                    if future.id in self.speculated:
+                        # Late result of a future sent again
+                        self.speculated.discard(future.id)
+                        continue
                     # Already received?
                     scoop.logger.warn('{0}: Received an unexpected future: '
                                       '{1}'.format(scoop.worker, future.id))
@@ -393,16 +728,37 @@ class FutureQueue(object):
                 thisFuture.exceptionValue = future.exceptionValue
                 thisFuture.executor = future.executor
                 thisFuture.isDone = future.isDone
+                thisFuture.executionTime = getattr(future, 'executionTime',
+                                                   0.)
+                if self.workStealing:
+                    # Estimate the futures kept for the peers from the ones
+                    # executed remotely
+                    scoop._control.updateStats(thisFuture.callable,
+                                               thisFuture.executionTime)
                 # Execute standard callbacks here (on parent)
                 thisFuture._execute_callbacks(CallbackType.standard)
                 self.append(thisFuture)
                 future._delete()
             elif future.id not in scoop._control.futureDict:
+                if future.id[0] == scoop.worker:
+                    # Own future already done, sent more than once
+                    continue
                 scoop._control.futureDict[future.id] = future
                 self.append(scoop._control.futureDict[future.id])
             else:
                 self.append(scoop._control.futureDict[future.id])
 
+    def giveFutures(self, credit):
+        """Removes up to credit futures, the shallowest first, for an idle
+        peer. At most half of the movable futures are given."""
+        futures = []
+        for _ in range(min(credit, len(self.movable) // 2)):
+            future = self.movable.popFirst()
+            if future.id[0] != scoop.worker:
+                future._delete()
+            futures.append(future)
+        return futures
+
     def remove(self, future):
         """Remove a future from the queue. The future must be cancellable or
         this method will raise a ValueError."""
@@ -115,6 +115,9 @@ class Bootstrap(object):
         self.parser.add_argument('--metaPort',
                                  help="The port of the broker meta socket",
                                  type=int)
+        self.parser.add_argument('--brokerIpc',
+                                 help="The broker bound its ipc endpoints",
+                                 action='store_true')
         self.parser.add_argument('--size',
                                  help="The size of the worker pool",
                                  type=int,
@@ -137,6 +140,26 @@ class Bootstrap(object):
                                  help="Choice of communication backend",
                                  choices=['ZMQ', 'TCP'],
                                  default='ZMQ')
+        self.parser.add_argument('--serializer',
+                                 help="Choice of serializer used to transmit "
+                                      "futures",
+                                 choices=['pickle', 'cloudpickle'],
+                                 default='pickle')
+        self.parser.add_argument('--io-thread',
+                                 help="Perform the communications in a "
+                                      "separate thread",
+                                 action='store_true',
+                                 dest='ioThread')
+        self.parser.add_argument('--work-stealing',
+                                 help="Let idle workers steal futures from "
+                                      "busy ones",
+                                 action='store_true',
+                                 dest='workStealing')
+        self.parser.add_argument('--tree-broadcast',
+                                 help="Broadcast the large shared constants "
+                                      "through the workers",
+                                 action='store_true',
+                                 dest='treeBroadcast')
         self.parser.add_argument('executable',
                                  nargs='?',
                                  help='The executable to start with scoop')
@@ -167,6 +190,7 @@ class Bootstrap(object):
             self.args.externalBrokerHostname
                 if self.args.externalBrokerHostname
                 else self.args.brokerHostname,
+            self.args.brokerIpc,
         )
         scoop.SIZE = self.args.size
         scoop.DEBUG = self.args.debug
@@ -174,6 +198,10 @@ class Bootstrap(object):
         scoop.CONFIGURATION = {
           'headless': not bool(self.args.executable),
           'backend': self.args.backend,
+          'serializer': self.args.serializer,
+          'ioThread': self.args.ioThread,
+          'workStealing': self.args.workStealing,
+          'treeBroadcast': self.args.treeBroadcast,
         }
         scoop.WORKING_DIRECTORY = self.args.workingDirectory
         scoop.logger = self.log
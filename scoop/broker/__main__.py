@@ -57,7 +57,21 @@ if __name__ == "__main__":
     parser.add_argument('--echoPorts',
                         help="Echo the listening ports",
                         action='store_true')
+    parser.add_argument('--threaded',
+                        help="Relay the replies, shared variables and tasks "
+                             "for idle workers in a separate thread",
+                        action='store_true')
+    parser.add_argument('--upstream',
+                        help="Run as the sub-broker of the root broker at "
+                             "HOST:TASKPORT:INFOPORT",
+                        metavar="Address")
+    parser.add_argument('--externalHostname',
+                        help="The externally routable hostname / ip of this "
+                             "sub-broker",
+                        default="127.0.0.1")
     args = parser.parse_args()
+    if args.backend != 'ZMQ' and (args.threaded or args.upstream):
+        parser.error("--threaded and --upstream need the ZMQ backend.")
 
     if args.echoGroup:
         import os
@@ -78,16 +92,32 @@ if __name__ == "__main__":
     else:
         from ..broker.brokertcp import Broker
 
-    thisBroker = Broker("tcp://*:" + args.tPort,
-                        "tcp://*:" + args.mPort,
-                        debug=args.debug,
-                        headless=args.headless,
-                        )
+    if args.upstream:
+        from ..broker.subbroker import SubBroker
+        from ..broker.structs import BrokerInfo
+        hostname, taskPort, infoPort = args.upstream.rsplit(":", 2)
+        thisBroker = SubBroker(BrokerInfo(hostname, taskPort, infoPort,
+                                          hostname),
+                               "tcp://*:" + args.tPort,
+                               "tcp://*:" + args.mPort,
+                               debug=args.debug,
+                               hostname=args.externalHostname,
+                               )
+    else:
+        thisBroker = Broker("tcp://*:" + args.tPort,
+                            "tcp://*:" + args.mPort,
+                            debug=args.debug,
+                            headless=args.headless,
+                            )
+        # Relay thread started by the run of the ZMQ broker
+        thisBroker.threaded = args.threaded
 
-    signal(SIGTERM,
-           lambda signum, stack_frame: thisBroker.shutdown())
-    signal(SIGINT,
-           lambda signum, stack_frame: thisBroker.shutdown())
+    def stop(signum, stack_frame):
+        # Leaves the loop of the broker, which is then shut down once along
+        # with its sockets and ipc files
+        raise SystemExit(0)
+    signal(SIGTERM, stop)
+    signal(SIGINT, stop)
 
     # Handle nicing functionnality
     if args.nice:
@@ -100,9 +130,10 @@ if __name__ == "__main__":
     if args.echoPorts:
         import os
         import sys
-        sys.stdout.write("{0},{1}\n".format(
+        sys.stdout.write("{0},{1},{2:d}\n".format(
             thisBroker.t_sock_port,
             thisBroker.info_sock_port,
+            getattr(thisBroker, 'ipc', False),
         ))
         sys.stdout.flush()
 
@@ -39,6 +39,7 @@ TASK = b"TASK"
 REPLY = b"REPLY"
 SHUTDOWN = b"SHUTDOWN"
 VARIABLE = b"VARIABLE"
+VARIABLE_DEL = b"VARIABLE_DEL"
 BROKER_INFO = b"BROKER_INFO"
 # Broker interconnection
 CONNECT = b"CONNECT"
@@ -110,6 +111,13 @@ class TaskHandler(asyncore.dispatcher_with_send):
                                             value,
                                             address])
 
+        # Shared variable to free
+        elif msg_type == VARIABLE_DEL:
+            key = msg[2]
+            for values in self.sharedVariables.values():
+                values.pop(key, None)
+            self.infoSocket.send_multipart([VARIABLE_DEL, key])
+
         # Initialize the variables of a new worker
         elif msg_type == INIT:
             address = msg[0]
@@ -16,8 +16,13 @@
 #    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
 #
 from collections import deque, defaultdict
+import heapq
+import itertools
+import random
+import struct
 import time
 import zmq
+import os
 import sys
 import copy
 import logging
@@ -32,26 +37,41 @@ from .. import discovery, utils
 from .structs import BrokerInfo
 
 
-# Worker requests
-INIT = b"I"
-REQUEST = b"RQ"
-TASK = b"T"
-REPLY = b"RP"
-SHUTDOWN = b"S"
-VARIABLE = b"V"
-BROKER_INFO = b"B"
-STATUS_REQ = b"SR"
-STATUS_ANS = b"SA"
-STATUS_DONE = b"SD"
-STATUS_UPDATE = b"SU"
+from .protocol import (INIT, REQUEST, TASK, REPLY, SHUTDOWN, VARIABLE,
+                       VARIABLE_ACK, VARIABLE_DEL, VARIABLE_REQ,
+                       VARIABLE_CHUNK, STATUS_REQ, STATUS_ANS, STATUS_DONE,
+                       STATUS_UPDATE, BLOB_REQ, BLOB,
+                       BUSY, GIVEN, PEERS, CONNECT, STEAL, FORWARD,
+                       STATUS_HERE, STATUS_GIVEN, STATUS_NONE, kind,
+                       isCompatible, encodeList, decodeList, encodeCount,
+                       decodeCount, encodeKey, decodeKey, decodeFlag)
 
-# Task statuses
-STATUS_HERE = b"H"
-STATUS_GIVEN = b"G"
-STATUS_NONE = b"N"
 
-# Broker interconnection
-CONNECT = b"C"
+# A task was handed to an idle worker by the relay thread
+HANDED = kind(b"HD")
+
+# Location of a task waiting in the broker queue
+QUEUED = None
+
+# Messages relayed as is to the worker whose address ends them
+RELAYED = (REPLY, BLOB_REQ, BLOB, VARIABLE_CHUNK)
+
+# Minimal time in seconds between two prunings of the assigned tasks
+TIME_BETWEEN_PRUNING_CHECKS = 1
+
+# Time in seconds between two steal attempts of a broker with idle workers
+TIME_BETWEEN_STEALS = 0.1
+
+# Number of done task ids remembered to discard their late duplicates
+DONE_TASKS_HISTORY = 10000
+
+# Maximal number of busy workers given to a worker asking for tasks
+MAX_PEERS = 8
+
+try:
+    IPC_AVAILABLE = zmq.has("ipc")
+except AttributeError:
+    IPC_AVAILABLE = False
 
 
 class LaunchingError(Exception): pass
@@ -59,19 +79,23 @@ class LaunchingError(Exception): pass
 
 class Broker(object):
     def __init__(self, tSock="tcp://*:*", mSock="tcp://*:*", debug=False,
-                 headless=False, hostname="127.0.0.1"):
+                 headless=False, hostname="127.0.0.1", threaded=False):
         """This function initializes a broker.
 
         :param tSock: Task Socket Address.
         Must contain protocol, address  and port information.
         :param mSock: Meta Socket Address.
         Must contain protocol, address and port information.
+        :param threaded: Relay the answers, shared variables and tasks for
+        idle workers in a separate thread.
         """
         # Initialize zmq
         self.context = zmq.Context(1)
 
         self.debug = debug
         self.hostname = hostname
+        self.threaded = threaded
+        self.relay = None
 
         # zmq Socket for the tasks, replies and request.
         self.task_socket = self.context.socket(zmq.ROUTER)
@@ -114,6 +138,24 @@ class Broker(object):
         self.info_socket.setsockopt(zmq.SNDHWM, 0)
         self.info_socket.setsockopt(zmq.RCVHWM, 0)
 
+        # Local workers connect through ipc when available, once it is
+        # advertised in the BrokerInfo of this broker
+        self.ipc = False
+        self.ipcPaths = []
+        if IPC_AVAILABLE:
+            try:
+                for sock, port, name in ((self.task_socket,
+                                          self.t_sock_port, "task"),
+                                         (self.info_socket,
+                                          self.info_sock_port, "info")):
+                    path = utils.ipcPath(port, name)
+                    sock.bind("ipc://" + path)
+                    self.ipcPaths.append(path)
+            except zmq.ZMQError:
+                self.logger.warning("Could not bind the ipc sockets.")
+            else:
+                self.ipc = True
+
         # Init connection to fellow brokers
         self.cluster_socket = self.context.socket(zmq.DEALER)
         self.cluster_socket.setsockopt(zmq.IPV4ONLY, 0)
@@ -140,11 +182,31 @@ class Broker(object):
         # Initializing the queue of workers and tasks
         # The busy workers variable will contain a dict (map) of workers: task
         self.available_workers = deque()
-        self.unassigned_tasks = deque()
+        # Heap of the queued tasks (scheduling key, sequence, id, frames)
+        self.unassigned_tasks = []
+        self.task_sequence = itertools.count()
         self.assigned_tasks = defaultdict(set)
         self.status_times = {}
+        # Workers having futures to be stolen by their idle peers
+        self.busy_workers = set()
+        # Addresses of the sub-brokers and of the workers behind them
+        self.sub_brokers = set()
+        self.routes = {}
+        # Index of the tasks locations {taskID: workerID or QUEUED}
+        self.task_locations = {}
+        # Ids of the recently done tasks, in order and as a set
+        self.done_order = deque()
+        self.done_tasks = set()
+        self.lastPruneTs = 0
+        self.lastStealTs = 0
+        # Workers connected to this broker
+        self.workers = set()
         # Shared variables containing {workerID:{varName:varVal},}
         self.shared_variables = defaultdict(dict)
+        # Version of the live shared variables {varName: version}, taken
+        # from a counter increasing on every update or deletion
+        self.variable_versions = {}
+        self.variable_counter = 0
 
         # Start a worker-like communication if needed
         self.execQueue = None
@@ -162,13 +224,31 @@ class Broker(object):
         # If we need another connection to a fellow broker
         # TODO: only connect to a given number
         for aBrokerInfo in aBrokerInfoList:
+            self.connectBroker(aBrokerInfo)
+
+    def connectBroker(self, aBrokerInfo):
+        """Connects to a fellow broker to steal its tasks."""
+        if (IPC_AVAILABLE and aBrokerInfo.ipc
+                and aBrokerInfo.hostname in utils.localHostnames):
+            self.cluster_socket.connect(
+                "ipc://" + utils.ipcPath(aBrokerInfo.task_port, "task")
+            )
+        else:
             self.cluster_socket.connect(
                 "tcp://{hostname}:{port}".format(
                     hostname=aBrokerInfo.hostname,
                     port=aBrokerInfo.task_port,
                 )
             )
-            self.cluster.append(aBrokerInfo)
+        self.cluster.append(aBrokerInfo)
+
+    def addSubBroker(self, address, aBrokerInfo):
+        """Registers a sub-broker relaying the traffic of the workers of a
+        host. Its tasks are stolen like those of a fellow broker, but it is
+        not advertised to the workers."""
+        self.logger.info("Sub-broker {0} registered.".format(aBrokerInfo))
+        self.sub_brokers.add(address)
+        self.connectBroker(aBrokerInfo)
 
     def processConfig(self, worker_config):
         """Update the pool configuration with a worker configuration.
@@ -181,14 +261,47 @@ class Broker(object):
                     port=",".join(str(a) for a in self.getPorts()),
                 )
 
+    def createPoller(self):
+        """Returns a poller of the sockets this broker receives from."""
+        poller = zmq.Poller()
+        poller.register(self.task_socket, zmq.POLLIN)
+        poller.register(self.cluster_socket, zmq.POLLIN)
+        return poller
+
+    def startRelay(self):
+        """Hands the task and info sockets over to a relay thread."""
+        from .relay import RelayThread
+        self.relay = RelayThread(self)
+        self.relay.start()
+
     def run(self):
         """Redirects messages until a shutdown message is received."""
+        if self.threaded and self.relay is None:
+            self.startRelay()
+        poller = self.createPoller()
         while True:
-            if not self.task_socket.poll(-1):
+            # Fetch tasks from fellow brokers while workers are idle
+            if self.cluster and self.available_workers:
+                self.stealTasks()
+                timeout = TIME_BETWEEN_STEALS * 1000
+            else:
+                timeout = -1
+
+            sockets = dict(poller.poll(timeout))
+            if self.processSockets(sockets):
+                break
+            if self.task_socket not in sockets:
                 continue
 
-            msg = self.task_socket.recv_multipart()
-            msg_type = msg[1]
+            # Payload frames are relayed without being copied
+            msg = self.task_socket.recv_multipart(copy=False)
+            msg_type = msg[1].bytes
+            if not isCompatible(msg_type):
+                self.logger.error("Message of another protocol version "
+                                  "received from {0}.".format(msg[0].bytes))
+                continue
+            if msg_type != TASK and msg_type not in RELAYED:
+                msg = [frame.bytes for frame in msg]
 
             if self.debug:
                 self.stats.append((time.time(),
@@ -201,102 +314,192 @@ class Broker(object):
                     ))
                     self.lastDebugTs = time.time()
 
+            if self.interceptMessage(msg_type, msg):
+                continue
+
             # New task inbound
             if msg_type == TASK:
-                task_id = msg[2]
-                task = msg[3]
+                task_id = msg[2].bytes
                 self.logger.debug("Received task {0}".format(task_id))
-                try:
-                    address = self.available_workers.popleft()
-                except IndexError:
-                    self.unassigned_tasks.append((task_id, task))
-                else:
-                    self.logger.debug("Sent {0}".format(task_id))
-                    self.task_socket.send_multipart([address, TASK, task])
-                    self.assigned_tasks[address].add(task_id)
+                self.dispatchTask(task_id, msg[3].bytes, msg[4:])
 
-            # Request for task
+            # Request for tasks, up to the given credit
             elif msg_type == REQUEST:
                 address = msg[0]
                 try:
-                    task_id, task = self.unassigned_tasks.popleft()
-                except IndexError:
-                    self.available_workers.append(address)
+                    credit = decodeCount(msg[2])
+                except (IndexError, struct.error):
+                    credit = 1
+                tasks = []
+                while len(tasks) < credit and self.unassigned_tasks:
+                    key, _, task_id, task = heapq.heappop(
+                        self.unassigned_tasks
+                    )
+                    if task_id in self.done_tasks:
+                        # Duplicate of a task done meanwhile
+                        self.task_locations.pop(task_id, None)
+                        continue
+                    self.assignTask(address, task_id)
+                    tasks.append((task_id, key, task))
+                if tasks:
+                    self.logger.debug("Sent {0} tasks".format(len(tasks)))
+                    self.sendTasks(address, tasks)
                 else:
-                    self.logger.debug("Sent {0}".format(task_id))
-                    self.task_socket.send_multipart([address, TASK, task])
-                    self.assigned_tasks[address].add(task_id)
+                    self.available_workers.append(address)
+                    self.sendPeers(address)
 
             # A task status request is requested
             elif msg_type == STATUS_REQ:
-                self.pruneAssignedTasks()
+                if time.time() - self.lastPruneTs > TIME_BETWEEN_PRUNING_CHECKS:
+                    self.pruneAssignedTasks()
                 address = msg[0]
-                task_id = msg[2]
-
-                if any(task_id in x for x in self.assigned_tasks.values()):
-                    status = STATUS_GIVEN
-                elif task_id in (x[0] for x in self.unassigned_tasks):
-                    status = STATUS_HERE
-                else:
-                    status = STATUS_NONE
+                try:
+                    task_ids = decodeList(msg[2])
+                except struct.error:
+                    self.logger.error("Could not decode status request.")
+                    continue
 
+                # The requester keeps the ids of its request round
                 self.task_socket.send_multipart([
-                    address, STATUS_ANS, task_id, status
-                ])
+                    address, STATUS_ANS,
+                    b"".join(self.taskStatuses(task_ids)),
+                ] + msg[3:])
 
-            # A task status set (task done) is received
-            elif msg_type == STATUS_DONE:
-                address = msg[0]
-                task_id = msg[2]
+            # A fellow broker with idle workers asks for tasks
+            elif msg_type == STEAL:
+                try:
+                    credit = decodeCount(msg[2])
+                except struct.error:
+                    self.logger.error("Could not decode steal request.")
+                    continue
+                self.forwardTasks(msg[0], credit)
 
+            # A worker has futures to be stolen, or not anymore
+            elif msg_type == BUSY:
                 try:
-                    self.assigned_tasks[address].discard(task_id)
-                except KeyError:
-                    pass
+                    busy = decodeFlag(msg[2])
+                except struct.error:
+                    self.logger.error("Could not decode load message.")
+                    continue
+                if busy:
+                    self.busy_workers.add(msg[0])
+                else:
+                    self.busy_workers.discard(msg[0])
+
+            # A task was sent to an idle worker by the relay thread
+            elif msg_type == HANDED:
+                self.assignTask(msg[0], msg[2])
+
+            # Tasks were stolen from a worker by one of its peers
+            elif msg_type == GIVEN:
+                address = msg[2]
+                for task_id in msg[3:]:
+                    if task_id not in self.done_tasks:
+                        self.assignTask(address, task_id)
+
+            # Task status sets (tasks done) are received
+            elif msg_type == STATUS_DONE:
+                for task_id in msg[2:]:
+                    self.releaseTask(msg[0], task_id)
+                    self.recordDone(task_id)
 
             elif msg_type == STATUS_UPDATE:
                 address = msg[0]
                 try:
-                    tasks_ids = pickle.loads(msg[2])
-                except:
-                    self.logger.error("Could not unpickle status update message.")
+                    tasks_ids = set(decodeList(msg[2]))
+                    workers = []
+                    if len(msg) > 3 and address in self.sub_brokers:
+                        # The workers behind the sub-broker
+                        workers = decodeList(msg[3])
+                except struct.error:
+                    self.logger.error("Could not decode status update message.")
                 else:
+                    previous = self.assigned_tasks.get(address, set())
+                    for task_id in previous.difference(tasks_ids):
+                        self.releaseTask(address, task_id)
+                    for task_id in tasks_ids:
+                        self.task_locations[task_id] = address
                     self.assigned_tasks[address] = tasks_ids
                     self.status_times[address] = time.time()
+                    for worker in workers:
+                        self.routes[worker] = address
 
-            # Answer needing delivery
-            elif msg_type == REPLY:
+            # Answer or blob needing delivery
+            elif msg_type in RELAYED:
+                if msg_type == REPLY and msg[2].bytes in self.done_tasks:
+                    # Late result of a task executed more than once
+                    continue
                 self.logger.debug("Relaying")
-                destination = msg[-1]
-                origin = msg[0]
-                self.task_socket.send_multipart([destination] + msg[1:] + [origin])
+                self.relayMessage(msg)
 
             # Shared variable to distribute
             elif msg_type == VARIABLE:
                 address = msg[4]
                 value = msg[3]
                 key = msg[2]
-                self.shared_variables[address].update(
-                    {key: value},
-                )
+                version = encodeCount(self.storeVariable(key, value, address))
+                recipients = []
+                try:
+                    if len(msg) > 5 and decodeFlag(msg[5]):
+                        recipients = self.broadcastRecipients(address)
+                except struct.error:
+                    self.logger.error("Could not decode shared variable.")
+                if recipients:
+                    # The owner sends the value through the recipients, its
+                    # announcement only carries an empty value
+                    self.info_socket.send_multipart([VARIABLE,
+                                                    key,
+                                                    b"",
+                                                    address,
+                                                    version])
+                    self.task_socket.send_multipart([msg[0], VARIABLE_ACK,
+                                                     key, version,
+                                                     encodeList(recipients),
+                                                     address])
+                    continue
                 self.info_socket.send_multipart([VARIABLE,
                                                 key,
                                                 value,
-                                                address])
+                                                address,
+                                                version])
+                # The owner stops resending it
+                self.task_socket.send_multipart([msg[0], VARIABLE_ACK, key,
+                                                 version, address])
+
+            # Shared variable missed by a worker
+            elif msg_type == VARIABLE_REQ:
+                self.sendVariable(msg[0], msg[2])
+
+            # Shared variable to free
+            elif msg_type == VARIABLE_DEL:
+                address = msg[3]
+                key = msg[2]
+                version = encodeCount(self.deleteVariable(key))
+                self.info_socket.send_multipart([VARIABLE_DEL, key, version])
+                self.task_socket.send_multipart([msg[0], VARIABLE_ACK, key,
+                                                 version, address])
 
             # Initialize the variables of a new worker
             elif msg_type == INIT:
                 address = msg[0]
                 try:
-                    self.processConfig(pickle.loads(msg[2]))
+                    config = pickle.loads(msg[2])
                 except pickle.PickleError:
                     continue
+                if 'subBroker' in config:
+                    self.addSubBroker(address, config.pop('subBroker'))
+                else:
+                    self.workers.add(address)
+                self.processConfig(config)
                 self.task_socket.send_multipart([
                     address,
                     pickle.dumps(self.config,
                                  pickle.HIGHEST_PROTOCOL),
                     pickle.dumps(self.shared_variables,
                                  pickle.HIGHEST_PROTOCOL),
+                    pickle.dumps((self.variable_counter,
+                                  self.variable_versions),
+                                 pickle.HIGHEST_PROTOCOL),
                 ])
 
                 self.task_socket.send_multipart([
@@ -321,7 +524,237 @@ class Broker(object):
                 self.shutdown()
                 break
 
+    def processSockets(self, sockets):
+        """Handles the messages received on the sockets other than the task
+        socket. Returns True if the broker must stop."""
+        if self.cluster_socket in sockets:
+            self.processClusterMessage()
+        return False
+
+    def interceptMessage(self, msg_type, msg):
+        """Lets a derived broker handle a message of the task socket itself.
+        Returns True if the message was handled."""
+        return False
+
+    def taskStatuses(self, task_ids):
+        """Returns one status byte per task: queued here, given to a worker
+        or unknown."""
+        statuses = []
+        for task_id in task_ids:
+            try:
+                location = self.task_locations[task_id]
+            except KeyError:
+                statuses.append(STATUS_NONE)
+            else:
+                statuses.append(STATUS_HERE if location is QUEUED
+                                else STATUS_GIVEN)
+        return statuses
+
+    def storeVariable(self, key, value, owner, version=None):
+        """Stores a shared variable, freeing its previous value. Returns its
+        version, the next one of the counter if none is given."""
+        version = self.deleteVariable(key, version)
+        self.shared_variables[owner][key] = value
+        self.variable_versions[key] = version
+        return version
+
+    def deleteVariable(self, key, version=None):
+        """Frees a shared variable. Returns the version of its deletion."""
+        if version is None:
+            version = self.variable_counter + 1
+        self.variable_counter = max(self.variable_counter, version)
+        if self.variable_versions.pop(key, None) is not None:
+            for owner, values in list(self.shared_variables.items()):
+                values.pop(key, None)
+                if not values:
+                    del self.shared_variables[owner]
+        return version
+
+    def sendVariable(self, address, key):
+        """Sends the value of a shared variable to a worker which missed it
+        during its broadcast."""
+        for owner, values in self.shared_variables.items():
+            if key in values:
+                self.task_socket.send_multipart([
+                    address, VARIABLE, key, values[key], owner,
+                    encodeCount(self.variable_versions[key]),
+                ])
+                return True
+        return False
+
+    def broadcastRecipients(self, owner):
+        """Returns the workers receiving the value of a shared variable from
+        its owner, directly or through each other."""
+        recipients = self.workers.union(self.routes)
+        recipients.discard(owner)
+        return sorted(recipients)
+
+    def relayMessage(self, msg):
+        """Relays an answer or a blob to the worker whose address ends the
+        message."""
+        try:
+            self.task_socket.send_multipart(self.relayFrames(msg), copy=False)
+        except zmq.ZMQError:
+            # The destination left, its requester resends or gives up
+            self.logger.warning("Could not deliver a message to "
+                                "{0}.".format(msg[-1].bytes))
+
+    def relayFrames(self, msg):
+        """Returns the frames relaying an answer or a blob to its destination,
+        through its sub-broker if it is behind one."""
+        destination = msg[-1].bytes
+        if msg[0].bytes in self.sub_brokers:
+            # Relayed on behalf of a worker, whose address precedes it
+            body, origin = msg[1:-2], msg[-2]
+        else:
+            body, origin = msg[1:-1], msg[0]
+        route = self.routes.get(destination)
+        if route is not None:
+            return [route] + body + [origin, destination]
+        return [destination] + body + [destination, origin]
+
+    def sendTasks(self, address, tasks):
+        """Sends (id, scheduling key, frames) tasks to a worker or a
+        sub-broker."""
+        self.task_socket.send_multipart(self.taskFrames(address, tasks),
+                                        copy=False)
+
+    def taskFrames(self, address, tasks):
+        """Returns the frames sending tasks to a worker, or to a sub-broker
+        along with their ids and keys."""
+        if address in self.sub_brokers:
+            return [address, FORWARD] + [
+                frame for task_id, key, task in tasks
+                for frame in [
+                    task_id,
+                    encodeKey(key),
+                ] + task
+            ]
+        return [address, TASK] + [frame for _, _, task in tasks
+                                  for frame in task]
+
+    def dispatchTask(self, task_id, key, task):
+        """Sends a task to an idle worker or queues it by its encoded
+        scheduling key."""
+        if task_id in self.done_tasks:
+            # Sent again while its result came back
+            return
+        try:
+            key = decodeKey(key)
+        except struct.error:
+            self.logger.error("Could not decode task key.")
+            key = time.time()
+        try:
+            address = self.available_workers.popleft()
+        except IndexError:
+            heapq.heappush(self.unassigned_tasks,
+                           (key, next(self.task_sequence), task_id, task))
+            self.task_locations[task_id] = QUEUED
+        else:
+            self.logger.debug("Sent {0}".format(task_id))
+            self.sendTasks(address, [(task_id, key, task)])
+            self.assignTask(address, task_id)
+
+    def sendPeers(self, address):
+        """Gives to an idle worker the busy workers it can steal from."""
+        peers = list(self.busy_workers.difference([address]))
+        if not peers or address in self.sub_brokers:
+            return
+        if len(peers) > MAX_PEERS:
+            peers = random.sample(peers, MAX_PEERS)
+        self.task_socket.send_multipart([
+            address,
+            PEERS,
+            encodeList(peers),
+        ])
+
+    def stealTasks(self):
+        """Asks the fellow brokers for as many tasks as there are idle
+        workers."""
+        if time.time() - self.lastStealTs < TIME_BETWEEN_STEALS:
+            return
+        self.lastStealTs = time.time()
+        credit = encodeCount(len(self.available_workers))
+        # The cluster socket sends to the fellow brokers in turn
+        for _ in range(len(self.cluster)):
+            try:
+                self.cluster_socket.send_multipart([STEAL, credit],
+                                                   flags=zmq.NOBLOCK)
+            except zmq.ZMQError:
+                break
+
+    def forwardTasks(self, address, credit):
+        """Gives up to half of the queued tasks to the fellow broker at
+        address."""
+        amount = min(credit, (len(self.unassigned_tasks) + 1) // 2)
+        # The last elements of the heap are among its least urgent ones and
+        # removing them keeps the heap ordered
+        tasks = [self.unassigned_tasks.pop() for _ in range(amount)]
+        if not tasks:
+            return
+        try:
+            self.task_socket.send_multipart(
+                [address, FORWARD] + [
+                    frame for key, _, task_id, task in tasks
+                    for frame in [
+                        task_id,
+                        encodeKey(key),
+                    ] + task
+                ],
+                copy=False,
+            )
+        except zmq.ZMQError:
+            # Fellow broker unreachable, keep the tasks
+            for task in tasks:
+                heapq.heappush(self.unassigned_tasks, task)
+            return
+        self.logger.debug("Forwarded {0} tasks".format(len(tasks)))
+        # The tasks are seen as given to the fellow broker until pruned
+        for _, _, task_id, _ in tasks:
+            self.assignTask(address, task_id)
+        self.status_times[address] = time.time()
+
+    def processClusterMessage(self):
+        """Handles a message coming from a fellow broker."""
+        self.processForward(self.cluster_socket.recv_multipart(copy=False))
+
+    def processForward(self, msg):
+        """Dispatches the tasks of a FORWARD message."""
+        if msg[0].bytes != FORWARD:
+            return
+        index = 1
+        while index < len(msg):
+            task_id = msg[index].bytes
+            key = msg[index + 1].bytes
+            # The task header holds one byte per frame following its payload
+            end = index + 4 + len(msg[index + 2].bytes)
+            self.dispatchTask(task_id, key, msg[index + 2:end])
+            index = end
+
+    def assignTask(self, address, task_id):
+        """Records that a task was given to the worker at address."""
+        self.assigned_tasks[address].add(task_id)
+        self.task_locations[task_id] = address
+        # Not pruned before its first status update
+        self.status_times.setdefault(address, time.time())
+
+    def releaseTask(self, address, task_id):
+        """Forgets a task held by the worker at address."""
+        self.assigned_tasks.get(address, set()).discard(task_id)
+        if self.task_locations.get(task_id, QUEUED) == address:
+            del self.task_locations[task_id]
+
+    def recordDone(self, task_id):
+        """Remembers a done task, so its duplicates are discarded."""
+        if task_id in self.done_tasks:
+            return
+        self.done_tasks.add(task_id)
+        self.done_order.append(task_id)
+        if len(self.done_order) > DONE_TASKS_HISTORY:
+            self.done_tasks.discard(self.done_order.popleft())
+
     def pruneAssignedTasks(self):
+        self.lastPruneTs = time.time()
         to_keep = set()
         for address in self.assigned_tasks.keys():
             addr_time = self.status_times.get(address, 0)
@@ -330,11 +763,14 @@ class Broker(object):
 
         to_remove = set(self.assigned_tasks.keys()).difference(to_keep)
         for addr in to_remove:
-            self.assigned_tasks.pop(addr)
+            for task_id in self.assigned_tasks.pop(addr):
+                if self.task_locations.get(task_id, QUEUED) == addr:
+                    del self.task_locations[task_id]
 
         to_remove = set(self.status_times.keys()).difference(to_keep)
         for addr in to_remove:
             self.status_times.pop(addr)
+            self.busy_workers.discard(addr)
 
     def getPorts(self):
         return (self.t_sock_port, self.info_sock_port)
@@ -346,6 +782,10 @@ class Broker(object):
         return self.name
 
     def shutdown(self):
+        if self.relay is not None:
+            self.relay.stop()
+            self.relay = None
+
         # This send may raise an ZMQError
         # Looping over it until it gets through
         for i in range(100):
@@ -358,11 +798,21 @@ class Broker(object):
         time.sleep(0.1)
 
         self.context.destroy(1000)
+        self.removeIpcPaths()
 
         # Write down statistics about this run if asked
         if self.debug:
             self.writeDebug()
 
+    def removeIpcPaths(self):
+        """Removes the files of the ipc endpoints of this broker."""
+        for path in self.ipcPaths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self.ipcPaths = []
+
     def writeDebug(self, path="debug"):
         import os
         import pickle
@@ -0,0 +1,140 @@
+#
+#    This file is part of Scalable COncurrent Operations in Python (SCOOP).
+#
+#    SCOOP is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    SCOOP is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
+#
+"""This file contains the messages exchanged by the workers and the brokers
+of the ZMQ backend.
+
+Every message starts with its kind, prefixed by the version of the protocol.
+The future ids, worker ids and control values are encoded in fixed layouts
+using struct, so the brokers route them without unpickling anything."""
+import struct
+
+
+PROTOCOL_VERSION = 1
+
+# Prefix of the kind of every message
+HEADER = struct.pack("!B", PROTOCOL_VERSION)
+
+
+def kind(name):
+    """Returns the versioned kind of a message."""
+    return HEADER + name
+
+
+# Worker requests
+INIT = kind(b"I")
+REQUEST = kind(b"RQ")
+TASK = kind(b"T")
+REPLY = kind(b"RP")
+SHUTDOWN = kind(b"S")
+VARIABLE = kind(b"V")
+VARIABLE_ACK = kind(b"VA")
+VARIABLE_DEL = kind(b"VD")
+VARIABLE_REQ = kind(b"VQ")
+VARIABLE_CHUNK = kind(b"VC")
+BROKER_INFO = kind(b"B")
+STATUS_REQ = kind(b"SR")
+STATUS_ANS = kind(b"SA")
+STATUS_DONE = kind(b"SD")
+STATUS_UPDATE = kind(b"SU")
+BLOB_REQ = kind(b"BQ")
+BLOB = kind(b"BD")
+BUSY = kind(b"BY")
+GIVEN = kind(b"GV")
+PEERS = kind(b"P")
+
+# Worker and broker interconnection
+CONNECT = kind(b"C")
+STEAL = kind(b"ST")
+FORWARD = kind(b"F")
+
+# Task statuses, one byte per task
+STATUS_HERE = b"H"
+STATUS_GIVEN = b"G"
+STATUS_NONE = b"N"
+
+_ID = struct.Struct("!Q")
+_COUNT = struct.Struct("!I")
+_LENGTH = struct.Struct("!H")
+_KEY = struct.Struct("!d")
+_FLAG = struct.Struct("!?")
+
+
+def isCompatible(msgKind):
+    """Tells if a message kind was sent with this version of the protocol."""
+    return msgKind[:len(HEADER)] == HEADER
+
+
+def encodeId(futureId):
+    """Encodes a (worker, rank) future id. The encoded ids are compared as
+    bytes by the brokers."""
+    return _ID.pack(futureId[1]) + futureId[0]
+
+
+def decodeId(data):
+    """Decodes a future id."""
+    return bytes(data[_ID.size:]), _ID.unpack_from(data)[0]
+
+
+def encodeList(items):
+    """Encodes a sequence of bytes, such as encoded future ids or worker
+    ids."""
+    items = list(items)
+    frames = [_COUNT.pack(len(items))]
+    for item in items:
+        frames.append(_LENGTH.pack(len(item)))
+        frames.append(item)
+    return b"".join(frames)
+
+
+def decodeList(data):
+    """Decodes a list of bytes."""
+    data = bytes(data)
+    count, = _COUNT.unpack_from(data)
+    offset = _COUNT.size
+    items = []
+    for _ in range(count):
+        length, = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        items.append(data[offset:offset + length])
+        offset += length
+    return items
+
+
+def encodeCount(value):
+    """Encodes a credit, a status round or a shared variable version."""
+    return _COUNT.pack(value)
+
+
+def decodeCount(data):
+    return _COUNT.unpack(data)[0]
+
+
+def encodeKey(value):
+    """Encodes a scheduling key."""
+    return _KEY.pack(value)
+
+
+def decodeKey(data):
+    return _KEY.unpack(data)[0]
+
+
+def encodeFlag(value):
+    return _FLAG.pack(value)
+
+
+def decodeFlag(data):
+    return _FLAG.unpack(data)[0]
@@ -0,0 +1,149 @@
+#
+#    This file is part of Scalable COncurrent Operations in Python (SCOOP).
+#
+#    SCOOP is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    SCOOP is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
+#
+"""This file contains the thread relaying the messages of a broker.
+
+Once started, the thread owns the task and info sockets of the broker. It
+relays by itself the answers, the blobs and the tasks sent to idle workers,
+and passes the other messages to the broker loop through inproc sockets
+standing for the task and info sockets. Only the scheduling decisions and the
+shared variables are thus handled by the broker loop."""
+import threading
+
+import zmq
+
+from .brokerzmq import HANDED, RELAYED
+from .protocol import TASK, REPLY, isCompatible, decodeKey
+
+
+class RelayThread(threading.Thread):
+    """Thread owning the sockets of a broker."""
+    def __init__(self, broker):
+        super(RelayThread, self).__init__()
+        self.daemon = True
+        self.broker = broker
+        self.router = broker.task_socket
+        self.publisher = broker.info_socket
+
+        # Inproc sockets, the broker ends standing for its own sockets
+        address = "inproc://relay-{0}".format(id(self))
+        self.taskPipe, broker.task_socket = self._pipe(address + "-task")
+        self.infoPipe, broker.info_socket = self._pipe(address + "-info")
+        self.controlPipe, self.control = self._pipe(address + "-control")
+
+    def _pipe(self, address):
+        """Returns the two ends of an inproc socket pair."""
+        ends = []
+        for _ in range(2):
+            sock = self.broker.context.socket(zmq.PAIR)
+            sock.setsockopt(zmq.SNDHWM, 0)
+            sock.setsockopt(zmq.RCVHWM, 0)
+            sock.setsockopt(zmq.LINGER, 1000)
+            ends.append(sock)
+        ends[0].bind(address)
+        ends[1].connect(address)
+        return ends
+
+    def stop(self):
+        """Ends the thread and gives its sockets back to the broker."""
+        if self.is_alive():
+            self.control.send(b"")
+            self.join()
+        for sock in (self.taskPipe, self.infoPipe, self.controlPipe,
+                     self.control, self.broker.task_socket,
+                     self.broker.info_socket):
+            sock.close()
+        self.broker.task_socket = self.router
+        self.broker.info_socket = self.publisher
+
+    def run(self):
+        poller = zmq.Poller()
+        poller.register(self.router, zmq.POLLIN)
+        poller.register(self.taskPipe, zmq.POLLIN)
+        poller.register(self.infoPipe, zmq.POLLIN)
+        poller.register(self.controlPipe, zmq.POLLIN)
+        try:
+            while True:
+                sockets = dict(poller.poll())
+                if self.controlPipe in sockets:
+                    # Sent by the broker loop before it stopped this thread
+                    self.sendQueued()
+                    break
+                if self.taskPipe in sockets or self.infoPipe in sockets:
+                    self.sendQueued()
+                if self.router in sockets:
+                    while self.router.poll(0):
+                        self.process(self.router.recv_multipart(copy=False))
+        except zmq.ZMQError as e:
+            # The sockets were closed
+            self.broker.logger.debug("Relay thread stopped: {0}".format(e))
+
+    def sendQueued(self):
+        """Sends the messages queued by the broker loop."""
+        while self.taskPipe.poll(0):
+            self.send(self.taskPipe.recv_multipart(copy=False))
+        while self.infoPipe.poll(0):
+            self.publisher.send_multipart(
+                self.infoPipe.recv_multipart(copy=False),
+                copy=False,
+            )
+
+    def send(self, msg):
+        try:
+            self.router.send_multipart(msg, copy=False)
+        except zmq.ZMQError as e:
+            self.broker.logger.warning(
+                "Could not send a message to {0}: {1}".format(
+                    msg[0].bytes if isinstance(msg[0], zmq.Frame) else msg[0],
+                    e,
+                )
+            )
+
+    def process(self, msg):
+        """Relays a message received on the task socket or passes it to the
+        broker loop."""
+        broker = self.broker
+        msg_type = msg[1].bytes
+        if not isCompatible(msg_type):
+            broker.logger.error("Message of another protocol version "
+                                "received from {0}.".format(msg[0].bytes))
+            return
+
+        if msg_type in RELAYED:
+            if msg_type == REPLY and msg[2].bytes in broker.done_tasks:
+                # Late result of a task executed more than once
+                return
+            self.send(broker.relayFrames(msg))
+            return
+
+        if msg_type == TASK:
+            task_id = msg[2].bytes
+            if task_id in broker.done_tasks:
+                return
+            # The idle workers are shared with the broker loop
+            try:
+                address = broker.available_workers.popleft()
+            except IndexError:
+                pass
+            else:
+                self.send(broker.taskFrames(
+                    address,
+                    [(task_id, decodeKey(msg[3].bytes), msg[4:])],
+                ))
+                self.taskPipe.send_multipart([address, HANDED, task_id])
+                return
+
+        self.taskPipe.send_multipart(msg, copy=False)
@@ -19,4 +19,8 @@ from collections import namedtuple
 BrokerInfo = namedtuple('BrokerInfo', ['hostname',
                                        'task_port',
                                        'info_port',
-                                       'externalHostname'])
\ No newline at end of file
+                                       'externalHostname',
+                                       'ipc'])
+# Tells if the broker bound its ipc endpoints, through which the workers of
+# its host connect
+BrokerInfo.__new__.__defaults__ = (False,)
\ No newline at end of file
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+#
+#    This file is part of Scalable COncurrent Operations in Python (SCOOP).
+#
+#    SCOOP is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    SCOOP is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
+#
+"""This file contains the sub-broker relaying the traffic of the workers of a
+host to the root broker.
+
+The workers of the host only talk to their sub-broker, which balances their
+tasks among them first. It asks the root broker for tasks when its queue is
+empty, lets the root broker steal its queued tasks like a fellow broker and
+relays in batches the messages it cannot handle by itself."""
+import struct
+import time
+
+import zmq
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import scoop
+from .brokerzmq import Broker, QUEUED, RELAYED
+from .protocol import (INIT, REQUEST, SHUTDOWN, VARIABLE, VARIABLE_ACK,
+                       VARIABLE_DEL, VARIABLE_REQ, STATUS_REQ, STATUS_ANS,
+                       STATUS_DONE, STATUS_UPDATE, STATUS_NONE, FORWARD,
+                       encodeList, decodeList, decodeCount)
+from .structs import BrokerInfo
+
+
+# Maximal number of done tasks reported at once to the root broker
+DONE_BATCH_SIZE = 256
+
+# Time in seconds to wait for the root broker to answer the registration
+REGISTER_TIMEOUT = 30
+
+
+class SubBroker(Broker):
+    def __init__(self, upstream, tSock="tcp://*:*", mSock="tcp://*:*",
+                 debug=False, hostname="127.0.0.1"):
+        """This function initializes a sub-broker and registers it to the
+        root broker.
+
+        :param upstream: BrokerInfo of the root broker.
+        :param hostname: Externally routable hostname of this host, the root
+        broker connecting to it.
+        """
+        super(SubBroker, self).__init__(tSock, mSock, debug=debug,
+                                        hostname=hostname)
+        self.upstream = upstream
+
+        # Socket relaying the messages to the root broker
+        self.upstream_socket = self.context.socket(zmq.DEALER)
+        self.upstream_socket.setsockopt(zmq.IPV4ONLY, 0)
+        self.upstream_socket.setsockopt_string(zmq.IDENTITY, self.getName())
+        self.upstream_socket.setsockopt(zmq.SNDHWM, 0)
+        self.upstream_socket.setsockopt(zmq.RCVHWM, 0)
+        self.upstream_socket.setsockopt(zmq.LINGER, 1000)
+        self.upstream_socket.connect("tcp://{0}:{1}".format(
+            upstream.hostname, upstream.task_port,
+        ))
+
+        # Socket receiving the shutdown and the shared variables
+        self.upstream_info_socket = self.context.socket(zmq.SUB)
+        self.upstream_info_socket.setsockopt(zmq.IPV4ONLY, 0)
+        self.upstream_info_socket.setsockopt(zmq.RCVHWM, 0)
+        self.upstream_info_socket.connect("tcp://{0}:{1}".format(
+            upstream.hostname, upstream.info_port,
+        ))
+        self.upstream_info_socket.setsockopt(zmq.SUBSCRIBE, b"")
+
+        # Workers connected to this sub-broker
+        self.local_workers = set()
+        # Done tasks not yet reported to the root broker
+        self.done_batch = []
+        # Ids of the status requests relayed to the root broker
+        # {(workerID, request round): [taskIDs]}
+        self.status_requests = {}
+        # Versions of the shared variables broadcast through the workers,
+        # requested to the root broker {varName: version}
+        self.requested_variables = {}
+        self.lastUpdateTs = 0
+
+        self.register()
+
+    def register(self):
+        """Registers this sub-broker to the root broker and fetches the pool
+        configuration and shared variables."""
+        self.upstream_socket.send_multipart([
+            INIT,
+            pickle.dumps({
+                'subBroker': BrokerInfo(self.hostname,
+                                        self.t_sock_port,
+                                        self.info_sock_port,
+                                        self.hostname,
+                                        self.ipc),
+            }, pickle.HIGHEST_PROTOCOL),
+        ])
+        deadline = time.time() + REGISTER_TIMEOUT
+        self.config.update(pickle.loads(self._recvRegistration(deadline)))
+        self.shared_variables.update(
+            pickle.loads(self._recvRegistration(deadline))
+        )
+        self.variable_counter, self.variable_versions = pickle.loads(
+            self._recvRegistration(deadline)
+        )
+        # The fellow brokers of the root broker are not used
+        self._recvRegistration(deadline)
+
+    def _recvRegistration(self, deadline):
+        """Receives a part of the answer of the root broker to the
+        registration. Raises IOError if it did not answer before the
+        deadline."""
+        remaining = max(0, deadline - time.time())
+        if not self.upstream_socket.poll(remaining * 1000):
+            self.logger.error("The root broker did not answer the "
+                              "registration of this sub-broker.")
+            self.context.destroy(0)
+            self.removeIpcPaths()
+            raise IOError("Could not register to the root broker at "
+                          "{0}:{1} within {2} seconds.".format(
+                              self.upstream.hostname,
+                              self.upstream.task_port,
+                              REGISTER_TIMEOUT,
+                          ))
+        return self.upstream_socket.recv()
+
+    def processConfig(self, worker_config):
+        """Update the pool configuration with a worker configuration. Only
+        the root broker is advertised on headless pools."""
+        self.config['headless'] |= worker_config.get("headless", False)
+
+    def createPoller(self):
+        poller = super(SubBroker, self).createPoller()
+        poller.register(self.upstream_socket, zmq.POLLIN)
+        poller.register(self.upstream_info_socket, zmq.POLLIN)
+        return poller
+
+    def processSockets(self, sockets):
+        if self.upstream_socket in sockets:
+            while self.upstream_socket.poll(0):
+                self.processUpstreamMessage(
+                    self.upstream_socket.recv_multipart(copy=False)
+                )
+        if self.upstream_info_socket in sockets:
+            while self.upstream_info_socket.poll(0):
+                if self.processUpstreamInfo(
+                        self.upstream_info_socket.recv_multipart()):
+                    self.shutdown()
+                    return True
+        # Sent once every pending done task was received
+        if self.done_batch and not (self.task_socket.getsockopt(zmq.EVENTS)
+                                    & zmq.POLLIN):
+            self.flushDone()
+        if (time.time() - self.lastUpdateTs
+                > scoop.TIME_BETWEEN_STATUS_REPORTS / 2):
+            self.sendStatusUpdate()
+        return super(SubBroker, self).processSockets(sockets)
+
+    def interceptMessage(self, msg_type, msg):
+        if msg_type == INIT:
+            # Replies to the new worker are routed through this sub-broker
+            self.local_workers.add(msg[0])
+            self.sendStatusUpdate()
+
+        elif msg_type == REQUEST:
+            if not self.unassigned_tasks:
+                self.upstream_socket.send_multipart([REQUEST] + msg[2:])
+
+        elif msg_type == STATUS_REQ:
+            try:
+                task_ids = decodeList(msg[2])
+            except struct.error:
+                self.logger.error("Could not decode status request.")
+                return True
+            statuses = self.taskStatuses(task_ids)
+            if STATUS_NONE not in statuses:
+                self.task_socket.send_multipart([
+                    msg[0], STATUS_ANS, b"".join(statuses),
+                ] + msg[3:])
+            else:
+                # The requester is echoed back in the answer of the root
+                self.status_requests[(msg[0], b"".join(msg[3:]))] = task_ids
+                self.upstream_socket.send_multipart(
+                    [STATUS_REQ, msg[2]] + msg[3:] + [msg[0]]
+                )
+            return True
+
+        elif msg_type == STATUS_DONE:
+            for task_id in msg[2:]:
+                self.releaseTask(msg[0], task_id)
+                self.recordDone(task_id)
+            self.done_batch.extend(msg[2:])
+            if len(self.done_batch) >= DONE_BATCH_SIZE:
+                self.flushDone()
+            return True
+
+        elif msg_type in (VARIABLE, VARIABLE_DEL, SHUTDOWN):
+            # Stored and broadcast by the root broker
+            self.upstream_socket.send_multipart(msg[1:])
+            return True
+
+        elif msg_type == VARIABLE_REQ:
+            # Retried by the worker if not yet received from the root broker
+            self.sendVariable(msg[0], msg[2])
+            return True
+
+        return False
+
+    def processUpstreamMessage(self, msg):
+        """Handles a message coming from the root broker."""
+        msg_type = msg[0].bytes
+        if msg_type == FORWARD:
+            self.processForward(msg)
+
+        elif msg_type in RELAYED:
+            origin, destination = msg[-2], msg[-1]
+            try:
+                self.task_socket.send_multipart(
+                    [destination] + msg[:-2] + [destination, origin],
+                    copy=False,
+                )
+            except zmq.ZMQError:
+                self.logger.warning("Could not deliver a message to "
+                                    "{0}.".format(destination.bytes))
+
+        elif msg_type == VARIABLE_ACK:
+            try:
+                self.task_socket.send_multipart([msg[-1]] + msg, copy=False)
+            except zmq.ZMQError:
+                pass
+
+        elif msg_type == VARIABLE:
+            # Value of a variable broadcast through the workers
+            key, value, owner, version = [frame.bytes for frame in msg[1:5]]
+            try:
+                version = decodeCount(version)
+            except struct.error:
+                self.logger.error("Could not decode shared variable version.")
+                return
+            if version >= self.requested_variables.get(key, version + 1):
+                del self.requested_variables[key]
+                self.storeVariable(key, value, owner, version)
+
+        elif msg_type == STATUS_ANS:
+            msg = [frame.bytes for frame in msg]
+            try:
+                task_ids = self.status_requests.pop(
+                    (msg[-1], b"".join(msg[2:-1]))
+                )
+            except KeyError:
+                self.logger.error("Unexpected status answer.")
+                return
+            # The root broker does not know the tasks queued here
+            statuses = self.taskStatuses(task_ids)
+            for index, status in enumerate(statuses):
+                if status == STATUS_NONE:
+                    statuses[index] = msg[1][index:index + 1]
+            try:
+                self.task_socket.send_multipart([
+                    msg[-1], STATUS_ANS, b"".join(statuses),
+                ] + msg[2:-1])
+            except zmq.ZMQError:
+                pass
+
+    def processUpstreamInfo(self, msg):
+        """Handles a message published by the root broker. Returns True on
+        shutdown."""
+        if msg[0] == SHUTDOWN:
+            self.logger.debug("SHUTDOWN received from the root broker.")
+            return True
+        try:
+            if msg[0] == VARIABLE:
+                key, value, address, version = msg[1:5]
+                self.requested_variables.pop(key, None)
+                if value:
+                    self.storeVariable(key, value, address,
+                                       decodeCount(version))
+                else:
+                    # Broadcast through the workers, fetched for the
+                    # workers to come
+                    self.deleteVariable(key, decodeCount(version))
+                    self.requested_variables[key] = decodeCount(version)
+                    self.upstream_socket.send_multipart([VARIABLE_REQ, key])
+                self.info_socket.send_multipart(msg)
+            elif msg[0] == VARIABLE_DEL:
+                self.requested_variables.pop(msg[1], None)
+                self.deleteVariable(msg[1], decodeCount(msg[2]))
+                self.info_socket.send_multipart(msg)
+        except struct.error:
+            self.logger.error("Could not decode shared variable version.")
+        return False
+
+    def flushDone(self):
+        """Reports the done tasks to the root broker in a single message."""
+        self.upstream_socket.send_multipart([STATUS_DONE] + self.done_batch)
+        self.done_batch = []
+
+    def sendStatusUpdate(self):
+        """Reports to the root broker the tasks held on this host and the
+        workers to which the replies must be routed."""
+        self.lastUpdateTs = time.time()
+        task_ids = set(
+            task_id for task_id, location in self.task_locations.items()
+            if location is QUEUED or location in self.local_workers
+        )
+        self.upstream_socket.send_multipart([
+            STATUS_UPDATE,
+            encodeList(task_ids),
+            encodeList(self.local_workers),
+        ])
+
+    def relayMessage(self, msg):
+        """Delivers an answer or a blob to a local worker, or relays it to
+        the root broker."""
+        destination = msg[-1]
+        if destination.bytes in self.local_workers:
+            super(SubBroker, self).relayMessage(msg)
+        else:
+            self.upstream_socket.send_multipart(
+                msg[1:-1] + [msg[0], destination], copy=False,
+            )
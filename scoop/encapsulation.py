@@ -14,12 +14,24 @@
 #    You should have received a copy of the GNU Lesser General Public
 #    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
 #
+import atexit
+import errno
 import marshal
+import mmap
 import tempfile
 import types
+import uuid
 import os
 from inspect import ismodule
 from functools import partial
+
+import scoop
+
+try:
+    import fcntl
+except ImportError:
+    # Without file locks, every worker fetches the value itself
+    fcntl = None
 try:
     import cPickle as pickle
 except ImportError:
@@ -120,6 +132,169 @@ class ExternalEncapsulation(object):
         return this_file.name
 
 
+class MappedEncapsulation(object):
+    """Handle on a large read-only buffer shared once per host.
+
+    This is used by setConst(..., shared_memory=True). The worker setting the
+    value writes it to a memory-mapped file on its host and serves it to the
+    other hosts; only this handle is sent to the workers. On the other hosts,
+    the first worker needing the value fetches it and writes the file, every
+    worker of the host then maps this file instead of holding its own copy.
+    Supports bytes-like objects and NumPy arrays."""
+    def __init__(self, value, name):
+        self.name = name
+        self.uid = uuid.uuid4().hex
+        self.owner = scoop.worker
+        self.dtype = None
+        self.shape = None
+        if type(value).__module__ == 'numpy':
+            import numpy
+            self.dtype = value.dtype.str
+            self.shape = value.shape
+            value = numpy.ascontiguousarray(value)
+        try:
+            data = memoryview(value)
+        except TypeError:
+            raise TypeError("Only bytes-like objects and NumPy arrays can "
+                            "be shared in memory: {0}.".format(name))
+        self.size = data.nbytes
+        self.writeFile(data)
+        ownedViews[name] = (self.uid, self._map())
+
+    @staticmethod
+    def directory():
+        """Returns the node-local directory of the mapped files."""
+        if os.path.isdir("/dev/shm"):
+            return "/dev/shm"
+        return tempfile.gettempdir()
+
+    def path(self):
+        return os.path.join(self.directory(),
+                            "scoop-const-{0}".format(self.uid))
+
+    def writeFile(self, data):
+        """Writes the value to its file unless another worker of the host
+        already did. The worker writing the file removes it when the value is
+        updated or deleted, or when it exits."""
+        path = self.path()
+        handle, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(data)
+            os.link(tmpPath, path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        else:
+            releaseMapped(self.name)
+            mappedFiles[self.name] = path
+        finally:
+            os.unlink(tmpPath)
+
+    def lock(self):
+        """Elects the worker of the host fetching the value. Returns False if
+        another worker of the host is already fetching it. The lock is
+        released by the system if its worker dies."""
+        if fcntl is None:
+            return True
+        handle = os.open(self.path() + ".lock", os.O_CREAT | os.O_WRONLY,
+                         0o600)
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            os.close(handle)
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return False
+        lockFiles[self.uid] = handle
+        return True
+
+    def unlock(self):
+        """Releases the lock, removing its file along with the ones left by
+        dead workers."""
+        handle = lockFiles.pop(self.uid, None)
+        if handle is not None:
+            try:
+                os.unlink(self.path() + ".lock")
+            except OSError:
+                pass
+            os.close(handle)
+
+    def releasePrevious(self):
+        """Removes the file written by this worker for a previous value."""
+        if mappedFiles.get(self.name) not in (None, self.path()):
+            releaseMapped(self.name)
+
+    def _map(self):
+        """Returns a read-only view on the file of the value, or None if it
+        was not written on this host."""
+        try:
+            f = open(self.path(), 'rb')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        with f:
+            if self.size == 0:
+                # Empty files cannot be mapped
+                return memoryview(b"")
+            return memoryview(mmap.mmap(f.fileno(), 0,
+                                        access=mmap.ACCESS_READ))
+
+    def getView(self):
+        """Returns a read-only view on the mapped value, or None if its file
+        was not written on this host yet."""
+        owned = ownedViews.get(self.name)
+        if owned is not None and owned[0] == self.uid:
+            view = owned[1]
+        else:
+            view = self._map()
+            if view is None:
+                return None
+        if self.dtype is not None:
+            import numpy
+            return numpy.frombuffer(view, dtype=self.dtype).reshape(self.shape)
+        return view
+
+
+# Files written by this worker {constant name: path}
+mappedFiles = {}
+
+# Descriptors of the lock files held by this worker {uid: descriptor}
+lockFiles = {}
+
+# Views on the values set by this worker, served to the other hosts
+# {constant name: (uid, view)}
+ownedViews = {}
+
+
+def ownedView(uid):
+    """Returns the view on a value set by this worker, or None if it was
+    updated or deleted since. Also called by the I/O thread."""
+    for owned in list(ownedViews.values()):
+        if owned[0] == uid:
+            return owned[1]
+    return None
+
+
+def releaseMapped(name):
+    """Removes the file written by this worker for a constant. The views
+    already mapped by the workers of the host stay valid."""
+    ownedViews.pop(name, None)
+    path = mappedFiles.pop(name, None)
+    if path is not None:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+@atexit.register
+def _releaseAllMapped():
+    for name in list(mappedFiles.keys()):
+        releaseMapped(name)
+
+
 # The following block handles callables pickling and unpickling
 
 # TODO: Make a factory to generate unpickling functions
@@ -46,7 +46,8 @@ def ensureScoopStartedProperlyMapFallback(func):
                     RuntimeWarning
                 )
                 ensureScoopStartedProperlyMapFallback.already = True
-            return map(*args, **kwargs)
+            # Options such as timeout or chunksize are meaningless serially
+            return map(*args)
         return func(*args, **kwargs)
     return wrapper
 
@@ -18,14 +18,18 @@ import os
 import sys
 from inspect import ismethod
 
-from collections import namedtuple
+from collections import namedtuple, deque
 
 try:
     from collections import Iterable
 except ImportError:
     from collections.abc import Iterable
-from functools import reduce
+from functools import reduce, partial
 import itertools
+try:
+    from itertools import izip as _lazyZip
+except ImportError:
+    _lazyZip = zip
 import copy
 import time
 
@@ -45,6 +49,11 @@ FIRST_EXCEPTION = 'FIRST_EXCEPTION'
 ALL_COMPLETED = 'ALL_COMPLETED'
 _AS_COMPLETED = '_AS_COMPLETED'
 
+# Targeted execution time (in seconds) of a chunk when chunksize='auto'
+CHUNK_TARGET_TIME = 0.05
+# Default number of outstanding Futures per worker for imap
+IMAP_IN_FLIGHT_PER_WORKER = 4
+
 # This is the greenlet for running the controller logic.
 _controller = None
 callbackGroupID = itertools.count()
@@ -75,7 +84,7 @@ def _startup(rootFuture, *args, **kargs):
     return result
 
 
-def _mapFuture(callable_, *iterables):
+def _mapFuture(callable_, *iterables, **kwargs):
     """Similar to the built-in map function, but each of its
     iteration will spawn a separate independent parallel Future that will run
     either locally or remotely as `callable(*args)`.
@@ -85,9 +94,15 @@ def _mapFuture(callable_, *iterables):
     :param iterables: A tuple of iterable objects; each will be zipped
         to form an iterable of arguments tuples that will be passed to the
         callable object as a separate Future.
+    :param chunksize: Number of arguments tuples packed in each Future, or
+        'auto' to deduce it from the execution statistics of the callable.
+    :param speculative: If True, the Futures lagging far behind the others
+        once most of them are done are executed again by another worker.
+    :param priority: Priority of the Futures. If None, the priority of the
+        calling Future is used.
 
     :returns: A list of Future objects, each corresponding to an iteration of
-        map.
+        map (or to a chunk of iterations if chunksize is greater than 1).
 
     On return, the Futures are pending execution locally, but may also be
     transfered remotely depending on global load. Execution may be carried on
@@ -95,15 +110,91 @@ def _mapFuture(callable_, *iterables):
     either wait for or join with the spawned Futures. See functions waitAny,
     waitAll, or joinAll. Alternatively, You may also use functions mapWait or
     mapJoin that will wait or join before returning."""
-    childrenList = []
-    for args in zip(*iterables):
-        childrenList.append(submit(callable_, *args))
+    chunksize = kwargs.get('chunksize', 1)
+    priority = kwargs.get('priority')
+    if chunksize == 1:
+        childrenList = []
+        for args in zip(*iterables):
+            childrenList.append(_submit(priority, callable_, *args))
+    else:
+        argsList = list(zip(*iterables))
+        chunksize = _getChunksize(callable_, chunksize, len(argsList))
+        if chunksize == 1:
+            childrenList = [_submit(priority, callable_, *args)
+                            for args in argsList]
+        else:
+            statsKey = hash(callable_)
+            callable_ = _shareCallable(callable_)
+            childrenList = [
+                _submitChunk(priority, callable_, statsKey,
+                             argsList[index:index + chunksize])
+                for index in range(0, len(argsList), chunksize)
+            ]
+
+    if kwargs.get('speculative', False):
+        control.execQueue.watchStragglers(childrenList)
     return childrenList
 
-def _mapGenerator(futures):
+
+def _getChunksize(callable_, chunksize, length=None):
+    """Returns the number of arguments tuples to pack in each Future.
+
+    When chunksize is 'auto', chunks are sized to last about CHUNK_TARGET_TIME
+    seconds according to the execution statistics of the callable, while
+    keeping enough chunks to feed every worker. Without statistics, the
+    number of elements is split evenly in four chunks per worker."""
+    if chunksize != 'auto':
+        return max(1, int(chunksize))
+
+    if length is not None:
+        # Keep at least four chunks per worker for load balancing
+        maximum = max(1, length // (4 * max(1, scoop.SIZE)))
+    else:
+        maximum = float("inf")
+
+    # Recorded by _chunkDone under the same key
+    median = control.execStats[hash(callable_)].median()
+    if 0 < median < float("inf"):
+        chunksize = int(CHUNK_TARGET_TIME / median)
+    elif length is not None:
+        chunksize = maximum
+    else:
+        chunksize = 1
+    return int(max(1, min(chunksize, maximum)))
+
+
+def _mapChunk(callable_, argsList):
+    """Executes the callable on every arguments tuple of a chunk. Used by the
+    map functions when a chunksize is given.
+
+    :returns: The list of results of the chunk, in order."""
+    return [callable_(*args) for args in argsList]
+
+
+def _submitChunk(priority, callable_, statsKey, argsList):
+    """Submits a Future executing a chunk of a map. Its execution time is
+    recorded on this worker, under the statistics of the mapped callable."""
+    future = _submit(priority, _mapChunk, callable_, argsList)
+    future.add_done_callback(partial(_chunkDone, statsKey, len(argsList)))
+    return future
+
+
+def _chunkDone(statsKey, length, future):
+    """Records the execution time per iteration of a done chunk. Called on
+    the worker which submitted it, wherever the chunk was executed."""
+    executionTime = getattr(future, 'executionTime', 0.)
+    if future.exceptionValue is None and executionTime > 0.:
+        control.recordStats(statsKey, executionTime / length)
+
+
+def _mapGenerator(futures, chunked=False):
     """Generator function that iterates through the results in-order."""
     for future in _waitAll(*futures):
-        yield future.resultValue
+        if chunked:
+            for result in future.resultValue:
+                yield result
+        else:
+            yield future.resultValue
 
 
 @ensureScoopStartedProperlyMapFallback
@@ -128,12 +219,26 @@ def map(func, *iterables, **kwargs):
         separate Future.
     :param timeout: The maximum number of seconds to wait. If None, then there
         is no limit on the wait time.
+    :param chunksize: The number of iterations packed in each Future. Using
+        a chunksize greater than 1 reduces the communication overhead of short
+        function calls. If 'auto', it is deduced from the execution time of
+        the function. Defaults to 1.
+    :param speculative: If True, once most of the iterations are done, those
+        taking far longer than usual are executed again by another worker and
+        the first result received is used. *func* must then be free of side
+        effects. Defaults to False.
+    :param priority: The priority of the iterations. See
+        :meth:`~scoop.futures.submitPriority`. Defaults to the priority of
+        the calling Future.
 
     :returns: A generator of map results, each corresponding to one map
         iteration."""
     # TODO: Handle timeout
-    futures = _mapFuture(func, *iterables)
-    return _mapGenerator(futures)
+    chunksize = kwargs.get('chunksize', 1)
+    futures = _mapFuture(func, *iterables, chunksize=chunksize,
+                         speculative=kwargs.get('speculative', False),
+                         priority=kwargs.get('priority'))
+    return _mapGenerator(futures, chunked=_isChunked(futures))
 
 
 def map_as_completed(func, *iterables, **kwargs):
@@ -149,15 +254,94 @@ def map_as_completed(func, *iterables, **kwargs):
         separate Future.
     :param timeout: The maximum number of seconds to wait. If None, then there
         is no limit on the wait time.
+    :param chunksize: The number of iterations packed in each Future. Results
+        of a chunk are yielded together, in order, once the chunk completes.
+        See :meth:`~scoop.futures.map`.
+    :param speculative: If True, the straggling iterations are executed again
+        by another worker. See :meth:`~scoop.futures.map`.
+    :param priority: The priority of the iterations. See
+        :meth:`~scoop.futures.submitPriority`.
 
     :returns: A generator of map results, each corresponding to one map
         iteration."""
     # TODO: Handle timeout
-    for future in as_completed(_mapFuture(func, *iterables)):
-        yield future.resultValue
+    chunksize = kwargs.get('chunksize', 1)
+    futures = _mapFuture(func, *iterables, chunksize=chunksize,
+                         speculative=kwargs.get('speculative', False),
+                         priority=kwargs.get('priority'))
+    chunked = _isChunked(futures)
+    for future in as_completed(futures):
+        if chunked:
+            for result in future.resultValue:
+                yield result
+        else:
+            yield future.resultValue
+
 
+@ensureScoopStartedProperlyMapFallback
+def imap(func, *iterables, **kwargs):
+    """imap(func, *iterables)
+    Equivalent to :meth:`~scoop.futures.map`, but the iterables are consumed
+    lazily and only a bounded number of Futures are kept outstanding at once.
+    This allows mapping over unbounded iterables or generators whose data
+    would not fit in memory. Results are returned in order.
 
-def _recursiveReduce(mapFunc, reductionFunc, scan, *iterables):
+    :param func: Any picklable callable object (function or class object with
+        *__call__* method); this object will be called to execute the Futures.
+        The callable must return a value.
+    :param iterables: Iterable objects; each will be zipped to form an iterable
+        of arguments tuples that will be passed to the callable object as a
+        separate Future.
+    :param max_in_flight: The maximum number of Futures submitted but not yet
+        yielded. Defaults to four times the number of workers.
+    :param chunksize: The number of iterations packed in each Future. See
+        :meth:`~scoop.futures.map`.
+
+    :returns: A generator of map results, each corresponding to one map
+        iteration."""
+    maxInFlight = kwargs.get('max_in_flight')
+    if maxInFlight is None:
+        maxInFlight = IMAP_IN_FLIGHT_PER_WORKER * max(1, scoop.SIZE)
+    chunksize = _getChunksize(func, kwargs.get('chunksize', 1))
+    return _imapGenerator(func, iterables, max(1, maxInFlight), chunksize)
+
+
+def _imapGenerator(func, iterables, maxInFlight, chunksize):
+    """Generator function submitting Futures as the previous results are
+    consumed. Used by imap."""
+    argsIterator = _lazyZip(*iterables)
+    statsKey = hash(func)
+    if chunksize > 1:
+        func = _shareCallable(func)
+    inFlight = deque()
+    while True:
+        argsList = list(itertools.islice(argsIterator, chunksize))
+        if argsList:
+            if chunksize > 1:
+                inFlight.append(_submitChunk(None, func, statsKey,
+                                             argsList))
+            else:
+                inFlight.append(submit(func, *argsList[0]))
+            if len(inFlight) < maxInFlight:
+                continue
+        if not inFlight:
+            break
+
+        # Waiting on a Future removes it from the futures dictionary
+        future = next(_waitAny(inFlight.popleft()))
+        if chunksize > 1:
+            for result in future.resultValue:
+                yield result
+        else:
+            yield future.resultValue
+
+
+def _isChunked(futures):
+    """True if the Futures returned by _mapFuture each hold a chunk."""
+    return bool(futures) and futures[0].callable is _mapChunk
+
+
+def _recursiveReduce(mapFunc, reductionFunc, scan, chunksize, *iterables):
     """Generates the recursive reduction tree. Used by mapReduce."""
     if iterables:
         half = min(len(x) // 2 for x in iterables)
@@ -172,12 +356,16 @@ def _recursiveReduce(mapFunc, reductionFunc, scan, *iterables):
     for index, data in enumerate([data_left, data_right]):
         if any(len(x) <= 1 for x in data):
             out_results[index] = mapFunc(*list(zip(*data))[0])
+        elif any(len(x) <= chunksize for x in data):
+            out_results[index] = _reduceChunk(mapFunc, reductionFunc, scan,
+                                              *data)
         else:
             out_futures[index] = submit(
                 _recursiveReduce,
                 mapFunc,
                 reductionFunc,
                 scan,
+                chunksize,
                 *data
             )
 
@@ -202,6 +390,27 @@ def _recursiveReduce(mapFunc, reductionFunc, scan, *iterables):
     return reductionFunc(*out_results)
 
 
+def _reduceChunk(mapFunc, reductionFunc, scan, *iterables):
+    """Serially maps and reduces a leaf of the reduction tree. Used by
+    mapReduce and mapScan when a chunksize is given."""
+    results = [mapFunc(*args) for args in zip(*iterables)]
+    if not scan:
+        return reduce(reductionFunc, results)
+    scanned = results[:1]
+    for result in results[1:]:
+        scanned.append(reductionFunc(scanned[-1], result))
+    return scanned
+
+
+def _reduceChunksize(mapFunc, iterables, kwargs):
+    """Returns the chunksize of the reduction tree leaves."""
+    chunksize = kwargs.get('chunksize', 1)
+    if chunksize == 'auto':
+        length = min(len(x) for x in iterables) if iterables else 0
+        return _getChunksize(mapFunc, chunksize, length)
+    return max(1, int(chunksize))
+
+
 @ensureScoopStartedProperly
 def mapScan(mapFunc, reductionFunc, *iterables, **kwargs):
     """Exectues the :meth:`~scoop.futures.map` function and then applies a
@@ -220,6 +429,8 @@ def mapScan(mapFunc, reductionFunc, *iterables, **kwargs):
         separate Future.
     :param timeout: The maximum number of seconds to wait. If None, then there
         is no limit on the wait time.
+    :param chunksize: The number of mapped elements serially reduced by each
+        leaf of the reduction tree, or 'auto'. Defaults to 1.
 
     :returns: Every return value of the reduction function applied to every
               mapped data sequentially ordered."""
@@ -228,6 +439,7 @@ def mapScan(mapFunc, reductionFunc, *iterables, **kwargs):
         mapFunc,
         reductionFunc,
         True,
+        _reduceChunksize(mapFunc, iterables, kwargs),
         *iterables
     ).result()
 
@@ -251,6 +463,8 @@ def mapReduce(mapFunc, reductionFunc, *iterables, **kwargs):
         separate Future.
     :param timeout: The maximum number of seconds to wait. If None, then there
         is no limit on the wait time.
+    :param chunksize: The number of mapped elements serially reduced by each
+        leaf of the reduction tree, or 'auto'. Defaults to 1.
 
     :returns: A single value."""
     return submit(
@@ -258,6 +472,7 @@ def mapReduce(mapFunc, reductionFunc, *iterables, **kwargs):
         mapFunc,
         reductionFunc,
         False,
+        _reduceChunksize(mapFunc, iterables, kwargs),
         *iterables
     ).result()
 
@@ -271,8 +486,12 @@ def _createFuture(func, *args, **kwargs):
     if scoop.IS_ORIGIN and "SCOOP_WORKER" not in sys.modules:
         sys.modules["SCOOP_WORKER"] = sys.modules["__main__"]
 
-    # If function is a lambda or class method, share it (or its parent object)
-    # beforehand
+    return Future(control.current.id, _shareCallable(func), *args, **kwargs)
+
+
+def _shareCallable(func):
+    """If function is a lambda or class method, share it (or its parent object)
+    beforehand and return a reference to it."""
     lambdaType = type(lambda: None)
     funcIsLambda = isinstance(func, lambdaType) and func.__name__ == '<lambda>'
     # Determine if function is a method. Methods derived from external
@@ -281,8 +500,7 @@ def _createFuture(func, *args, **kwargs):
     if funcIsLambda or funcIsMethod:
         from .shared import SharedElementEncapsulation
         func = SharedElementEncapsulation(func)
-
-    return Future(control.current.id, func, *args, **kwargs)
+    return func
 
 @ensureScoopStartedProperly
 def submit(func, *args, **kwargs):
@@ -303,8 +521,36 @@ def submit(func, *args, **kwargs):
     transfered remotely depending on load or on remote distributed workers. You
     may carry on with any further computations while the Future completes.
     Result retrieval is made via the :meth:`~scoop._types.Future.result`
-    function on the Future."""
+    function on the Future. The Future has the priority of the calling
+    Future."""
+    return _submit(None, func, *args, **kwargs)
+
+
+@ensureScoopStartedProperly
+def submitPriority(priority, func, *args, **kwargs):
+    """Submit a Future like :meth:`~scoop.futures.submit`, with the given
+    priority.
+
+    :param priority: A number; pending Futures of greater priority are
+        executed first. Each priority level counts as a head start of
+        :data:`~scoop._types.PRIORITY_AGING` seconds, so Futures of low
+        priority are not starved by a continuous flow of Futures of higher
+        priority. Defaults to 0 for the Futures of the root Future.
+    :param func: Any picklable callable object, see
+        :meth:`~scoop.futures.submit`.
+
+    :returns: A future object for retrieving the Future result."""
+    return _submit(priority, func, *args, **kwargs)
+
+
+def _submit(priority, func, *args, **kwargs):
+    """Creates a child Future of the calling Future and queues it. If
+    priority is None, the priority of the calling Future is inherited."""
     child = _createFuture(func, *args, **kwargs)
+    if priority is None:
+        priority = control.current.priority
+    child.priority = priority
+    child.depth = control.current.depth + 1
 
     control.futureDict[control.current.id].children[child] = None
     control.execQueue.append(child)
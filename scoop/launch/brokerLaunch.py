@@ -34,8 +34,10 @@ except ImportError:
 
 
 class localBroker(object):
-    def __init__(self, debug, nice=0, backend='ZMQ'):
-        """Starts a broker on random unoccupied ports"""
+    def __init__(self, debug, nice=0, backend='ZMQ', upstream=None,
+                 hostname="127.0.0.1", threaded=False):
+        """Starts a broker on random unoccupied ports. It is the sub-broker
+        of the broker described by the upstream BrokerInfo, if given."""
         self.backend = backend
         if backend == 'ZMQ':
             from ..broker.brokerzmq import Broker
@@ -47,8 +49,15 @@ class localBroker(object):
                 raise ImportError("psutil is needed for nice functionnality.")
             p = psutil.Process(os.getpid())
             p.set_nice(nice)
-        self.localBroker = Broker(debug=debug)
+        if upstream is not None:
+            from ..broker.subbroker import SubBroker
+            self.localBroker = SubBroker(upstream, debug=debug,
+                                         hostname=hostname)
+        else:
+            self.localBroker = Broker(debug=debug)
+            self.localBroker.threaded = threaded
         self.brokerPort, self.infoPort = self.localBroker.getPorts()
+        self.ipc = getattr(self.localBroker, 'ipc', False)
         self.broker = Thread(target=self.localBroker.run)
         self.broker.daemon = True
         self.broker.start()
@@ -61,6 +70,7 @@ class localBroker(object):
         # Imported dynamically - Not used if only one broker
         if self.backend == 'ZMQ':
             import zmq
+            from ..broker.brokerzmq import CONNECT
             self.context = zmq.Context()
             self.socket = self.context.socket(zmq.DEALER)
             self.socket.setsockopt(zmq.IDENTITY, b'launcher')
@@ -69,7 +79,7 @@ class localBroker(object):
                     port=self.brokerPort,
                 )
             )
-            self.socket.send_multipart([b"CONNECT",
+            self.socket.send_multipart([CONNECT,
                                         pickle.dumps(data,
                                                      pickle.HIGHEST_PROTOCOL)])
         else:
@@ -88,8 +98,11 @@ class localBroker(object):
 
 class remoteBroker(object):
     def __init__(self, hostname, pythonExecutable, debug=False, nice=0,
-                 backend='ZMQ', rsh=False, ssh_executable='ssh'):
-        """Starts a broker on the specified hostname on unoccupied ports"""
+                 backend='ZMQ', rsh=False, ssh_executable='ssh',
+                 upstream=None, threaded=False):
+        """Starts a broker on the specified hostname on unoccupied ports. It
+        is the sub-broker of the broker described by the upstream BrokerInfo,
+        if given."""
         self.backend = backend
         brokerString = ("{pythonExec} -m scoop.broker.__main__ "
                         "--echoGroup "
@@ -101,6 +114,16 @@ class remoteBroker(object):
                         )
         if nice:
             brokerString += "--nice {nice} ".format(nice=nice)
+        if threaded:
+            brokerString += "--threaded "
+        if upstream is not None:
+            brokerString += ("--upstream {0}:{1}:{2} "
+                             "--externalHostname {3} ".format(
+                                 upstream.hostname,
+                                 upstream.task_port,
+                                 upstream.info_port,
+                                 hostname,
+                             ))
         if debug:
             brokerString += "--debug --path {path} ".format(
                 path=os.getcwd()
@@ -132,7 +155,8 @@ class remoteBroker(object):
         receivedLine = self.shell.stdout.readline()
         try:
             ports = receivedLine.decode().strip().split(",")
-            self.brokerPort, self.infoPort = ports
+            self.brokerPort, self.infoPort, ipc = ports
+            self.ipc = ipc == "1"
         except ValueError:
             # Following line for Python 2.6 compatibility (instead of [as e])
             e = sys.exc_info()[1]
@@ -161,6 +185,7 @@ class remoteBroker(object):
         # Imported dynamically - Not used if only one broker
         if self.backend == 'ZMQ':
             import zmq
+            from ..broker.brokerzmq import CONNECT
             self.context = zmq.Context()
             self.socket = self.context.socket(zmq.DEALER)
             if sys.version_info < (3,):
@@ -173,7 +198,7 @@ class remoteBroker(object):
                     hostname = self.hostname
                 )
             )
-            self.socket.send_multipart([b"CONNECT",
+            self.socket.send_multipart([CONNECT,
                                         pickle.dumps(data,
                                                      pickle.HIGHEST_PROTOCOL)])
         else:
@@ -35,8 +35,9 @@ class Host(object):
         'launchingArguments',
         [
             'pythonPath', 'path', 'nice', 'pythonExecutable', 'size', 'origin',
-            'brokerHostname', 'brokerPorts', 'debug', 'profiling', 'executable',
-            'verbose', 'args', 'prolog', 'backend'
+            'brokerHostname', 'brokerPorts', 'brokerIpc', 'debug',
+            'profiling', 'executable', 'verbose', 'args', 'prolog', 'backend',
+            'serializer', 'ioThread', 'workStealing', 'treeBroadcast'
         ]
     )
 
@@ -137,6 +138,8 @@ class Host(object):
         c.extend(['--externalBrokerHostname', worker.brokerHostname])
         c.extend(['--taskPort', str(worker.brokerPorts[0])])
         c.extend(['--metaPort', str(worker.brokerPorts[1])])
+        if worker.brokerIpc:
+            c.append('--brokerIpc')
         if worker.origin and worker.executable:
             c.append('--origin')
         if worker.debug:
@@ -145,6 +148,14 @@ class Host(object):
             c.append('--profile')
         if worker.backend:
             c.append('--backend={0}'.format(worker.backend))
+        if worker.serializer:
+            c.append('--serializer={0}'.format(worker.serializer))
+        if worker.ioThread:
+            c.append('--io-thread')
+        if worker.workStealing:
+            c.append('--work-stealing')
+        if worker.treeBroadcast:
+            c.append('--tree-broadcast')
         if worker.verbose >= 1:
             c.append('-' + 'v' * worker.verbose)
         return c
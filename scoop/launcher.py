@@ -48,7 +48,9 @@ class ScoopApp(object):
     def __init__(self, hosts, n, b, verbose, python_executable,
             externalHostname, executable, arguments, tunnel, path, debug,
             nice, env, profile, pythonPath, prolog, backend, rsh,
-            ssh_executable):
+            ssh_executable, serializer='pickle', ioThread=False,
+            workStealing=False, subBrokers=False, threadedBroker=False,
+            treeBroadcast=False):
         # Assure setup sanity
         assert type(hosts) == list and hosts, (
             "You should at least specify one host.")
@@ -71,6 +73,12 @@ class ScoopApp(object):
         self.nice = nice
         self.profile = profile
         self.backend = backend
+        self.serializer = serializer
+        self.ioThread = ioThread
+        self.workStealing = workStealing
+        self.subBrokers = subBrokers
+        self.threadedBroker = threadedBroker
+        self.treeBroadcast = treeBroadcast
         self.rsh = rsh
         self.errors = None
 
@@ -108,6 +116,19 @@ class ScoopApp(object):
                       'reference.'.format(self.externalHostname))
         scoop.logger.debug('The python executable to execute the program with is: '
                      '{0}.'.format(self.python_executable))
+        if self.subBrokers and (self.tunnel or self.backend != 'ZMQ'):
+            scoop.logger.warning("Sub-brokers are only available with the ZMQ "
+                                 "backend and without --tunnel. Workers will "
+                                 "connect to the root broker.")
+            self.subBrokers = False
+        if self.threadedBroker and self.backend != 'ZMQ':
+            scoop.logger.warning("The threaded broker is only available with "
+                                 "the ZMQ backend.")
+            self.threadedBroker = False
+        if self.treeBroadcast and self.backend != 'ZMQ':
+            scoop.logger.warning("The tree broadcast of shared constants is "
+                                 "only available with the ZMQ backend.")
+            self.treeBroadcast = False
 
         # Create launch lists
         self.broker_hosts = self.divideHosts(hosts[:], self.b)
@@ -134,6 +155,8 @@ class ScoopApp(object):
 
         self.workers = []
         self.brokers = []
+        # Sub-broker of every worker host {hostname: (brokerHostname, broker)}
+        self.hostBrokers = {}
 
     def initLogging(self):
         """Configures the logger."""
@@ -196,7 +219,7 @@ class ScoopApp(object):
                 )
             )
 
-    def _setWorker_args(self, origin):
+    def _setWorker_args(self, origin, hostname=None):
         """Create the arguments to pass to the addWorker call.
             The returned args and kwargs must ordered/named according to the namedtuple
             in LAUNCH_HOST_CLASS.LAUNCHING_ARGUMENTS .
@@ -204,6 +227,9 @@ class ScoopApp(object):
             both args and kwargs are supported for full flexibility,
             but usage of kwargs only is strongly advised.
         """
+        brokerHostname, broker = self.hostBrokers.get(
+            hostname, (self.externalHostname, self.brokers[0])
+        )
         args = []
         kwargs = {
             'pythonPath': self.pythonpath,
@@ -213,14 +239,20 @@ class ScoopApp(object):
             'pythonExecutable': self.python_executable,
             'size': self.n,
             'origin': origin,
-            'brokerHostname': self.externalHostname,
-            'brokerPorts': (self.brokers[0].brokerPort,
-                            self.brokers[0].infoPort),
+            'brokerHostname': brokerHostname,
+            'brokerPorts': (broker.brokerPort,
+                            broker.infoPort),
+            # Tunneled brokers are not on the host of their workers
+            'brokerIpc': broker.ipc and not self.tunnel,
             'debug': self.debug,
             'profiling': self.profile,
             'executable': self.executable,
             'verbose': self.verbose,
             'backend': self.backend,
+            'serializer': self.serializer,
+            'ioThread': self.ioThread,
+            'workStealing': self.workStealing,
+            'treeBroadcast': self.treeBroadcast,
             'args': self.args,
         }
         return args, kwargs
@@ -236,7 +268,7 @@ class ScoopApp(object):
             )
         )
 
-        add_args, add_kwargs = self._setWorker_args(origin)
+        add_args, add_kwargs = self._setWorker_args(origin, hostname)
         self.workers[-1].setWorker(*add_args, **add_kwargs)
         self.workers[-1].setWorkerAmount(workerAmount)
 
@@ -250,6 +282,7 @@ class ScoopApp(object):
                         debug=self.debug,
                         nice=self.nice,
                         backend=self.backend,
+                        threaded=self.threadedBroker,
                     ))
                 else:
                     self.brokers.append(remoteBroker(
@@ -260,6 +293,7 @@ class ScoopApp(object):
                         backend=self.backend,
                         rsh=self.rsh,
                         ssh_executable=self.ssh_executable,
+                        threaded=self.threadedBroker,
                     ))
 
         # Share connection information between brokers
@@ -270,13 +304,18 @@ class ScoopApp(object):
                     BrokerInfo(
                         x.getHost(),
                         *x.getPorts(),
-                        externalHostname=x.getHost()
+                        externalHostname=x.getHost(),
+                        ipc=x.ipc
                     )
                     for x in self.brokers
                     if x is not broker
                 ]
                 broker.sendConnect(connect_data)
 
+        # Launch a sub-broker on every worker host
+        if self.subBrokers:
+            self.launchSubBrokers()
+
         # Launch the workers
         shells = []
         origin_launched = False
@@ -317,6 +356,42 @@ class ScoopApp(object):
         scoop.logger.info('Root process is done.')
         return self.errors
 
+    def launchSubBrokers(self):
+        """Launch a sub-broker relaying the traffic of the workers of every
+        host to the root broker."""
+        upstream = BrokerInfo(
+            self.externalHostname,
+            *self.brokers[0].getPorts(),
+            externalHostname=self.externalHostname
+        )
+        workersLeft = self.workersLeft
+        for hostname, nb_workers in self.worker_hosts:
+            if hostname in utils.localHostnames:
+                broker = localBroker(
+                    debug=self.debug,
+                    nice=self.nice,
+                    backend=self.backend,
+                    upstream=upstream,
+                    hostname=self.externalHostname,
+                )
+                self.hostBrokers[hostname] = (self.externalHostname, broker)
+            else:
+                broker = remoteBroker(
+                    hostname=hostname,
+                    pythonExecutable=self.python_executable,
+                    debug=self.debug,
+                    nice=self.nice,
+                    backend=self.backend,
+                    rsh=self.rsh,
+                    ssh_executable=self.ssh_executable,
+                    upstream=upstream,
+                )
+                self.hostBrokers[hostname] = (hostname, broker)
+            self.brokers.append(broker)
+            workersLeft -= min(nb_workers, workersLeft)
+            if workersLeft <= 0:
+                break
+
     def close(self):
         """Subprocess cleanup."""
         # Give time to flush data if debug was on
@@ -436,6 +511,40 @@ def makeParser():
                         help="Choice of communication backend",
                         choices=['ZMQ', 'TCP'],
                         default='ZMQ')
+    parser.add_argument('--serializer',
+                        help="Choice of serializer used to transmit futures",
+                        choices=['pickle', 'cloudpickle'],
+                        default='pickle')
+    parser.add_argument('--io-thread',
+                        help="Perform the communications of the workers in a "
+                             "separate thread, overlapping them with the "
+                             "execution of the futures",
+                        action='store_true',
+                        dest='ioThread')
+    parser.add_argument('--work-stealing',
+                        help="Let idle workers take futures directly from "
+                             "busy ones, the broker only handing out the "
+                             "futures they cannot keep",
+                        action='store_true',
+                        dest='workStealing')
+    parser.add_argument('--sub-brokers',
+                        help="Launch a sub-broker on every host, relaying "
+                             "the traffic of its workers to the root broker "
+                             "and balancing their tasks locally first",
+                        action='store_true',
+                        dest='subBrokers')
+    parser.add_argument('--threaded-broker',
+                        help="Relay the replies and futures for idle "
+                             "workers in a separate thread of the broker, its "
+                             "main loop only scheduling futures",
+                        action='store_true',
+                        dest='threadedBroker')
+    parser.add_argument('--tree-broadcast',
+                        help="Broadcast the large shared constants through "
+                             "the workers, each one forwarding their chunks "
+                             "to its peers, instead of from the broker",
+                        action='store_true',
+                        dest='treeBroadcast')
     parser.add_argument('executable',
                         nargs='?',
                         help='The executable to start with SCOOP')
@@ -478,7 +587,10 @@ def main():
                             args.path, args.debug, args.nice,
                             utils.getEnv(), args.profile, args.pythonpath[0],
                             args.prolog[0], args.backend, args.rsh,
-                            args.ssh_executable)
+                            args.ssh_executable, args.serializer,
+                            args.ioThread, args.workStealing,
+                            args.subBrokers, args.threadedBroker,
+                            args.treeBroadcast)
 
     rootTaskExitCode = False
     interruptPreventer = Thread(target=thisScoopApp.close)
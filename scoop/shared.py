@@ -18,8 +18,6 @@
 
 import itertools
 from inspect import ismethod
-from functools import reduce
-import time
 
 from . import encapsulation, utils
 import scoop
@@ -27,17 +25,73 @@ from .fallbacks import ensureScoopStartedProperly, NotStartedProperly
 
 
 elements = None
+# Flat name -> value index of the elements, kept in sync by the communicators
+index = {}
+# Version of every element, increasing on each update
+versions = {}
+
+
+def setElements(newElements, newVersions=None):
+    """Replaces the shared elements by the ones received from a broker.
+
+    :param newElements: Dictionary of {worker: {name: value}}.
+    :param newVersions: Dictionary of {name: version}."""
+    global elements
+    elements = newElements
+    index.clear()
+    for values in elements.values():
+        index.update(values)
+    versions.clear()
+    versions.update(dict.fromkeys(index, 0))
+    versions.update(newVersions or {})
+
+
+def storeElement(owner, name, value, version=None):
+    """Stores a shared element received or acknowledged on this worker.
+
+    :param version: Version of the value. If None, the stored value is
+        replaced keeping its version.
+
+    :returns: False if a newer version of the element is already stored."""
+    if version is not None:
+        if version <= versions.get(name, -1):
+            return False
+        versions[name] = version
+    if name in index:
+        # The element may have been updated by another worker
+        for values in elements.values():
+            values.pop(name, None)
+    elements.setdefault(owner, {})[name] = value
+    index[name] = value
+    return True
+
+
+def removeElement(name, version=None):
+    """Removes a deleted shared element from this worker."""
+    if version is not None and version < versions.get(name, -1):
+        return
+    for owner, values in list(elements.items()):
+        values.pop(name, None)
+        if not values:
+            del elements[owner]
+    index.pop(name, None)
+    versions.pop(name, None)
+    encapsulation.releaseMapped(name)
 
 
 def _ensureAtomicity(fn):
     """Ensure atomicity of passed elements on the whole worker pool"""
     @ensureScoopStartedProperly
     def wrapper(*args, **kwargs):
-        """setConst(**kwargs)
+        """setConst(shared_memory=False, **kwargs)
         Set a constant that will be shared to every workers.
         This call blocks until the constant has propagated to at least one
         worker.
 
+        :param shared_memory: If True, the values (bytes-like objects or NumPy
+            arrays) are written once per host in a memory-mapped file. The
+            workers then get read-only views on this file instead of their
+            own copy.
         :param \*\*kwargs: One or more combination(s) key=value. Key being the
             variable name and value the object to share.
 
@@ -50,28 +104,30 @@ def _ensureAtomicity(fn):
 
         from . import _control
 
+        sharedMemory = kwargs.pop('shared_memory', False)
+
         # Enforce retrieval of currently awaiting constants
         _control.execQueue.socket.pumpInfoSocket()
 
         for key, value in kwargs.items():
             # Object name existence check
-            if key in itertools.chain(*(elem.keys() for elem in elements.values())):
+            if key in index:
                 raise TypeError("This constant already exists: {0}.".format(key))
 
-        # Retry element propagation until it is returned
+        # Retry element propagation until it is acknowledged
         while all(key in elements.get(scoop.worker, []) for key in kwargs.keys()) is not True:
             scoop.logger.debug("Sending global variables {0}...".format(
                 list(kwargs.keys())
             ))
             # Call the function
-            fn(*args, **kwargs)
+            fn(*args, shared_memory=sharedMemory, **kwargs)
+
+            # Block until the broker acknowledges the constants
+            _control.execQueue.socket.waitVariables(kwargs.keys())
 
             # Enforce retrieval of currently awaiting constants
             _control.execQueue.socket.pumpInfoSocket()
 
-            # TODO: Make previous blocking instead of sleep
-            time.sleep(0.1)
-
         # Atomicity check
         elementNames = list(itertools.chain(*(elem.keys() for elem in elements.values())))
         if len(elementNames) != len(set(elementNames)):
@@ -81,10 +137,12 @@ def _ensureAtomicity(fn):
 
 
 @_ensureAtomicity
-def setConst(**kwargs):
-    """setConst(**kwargs)
+def setConst(shared_memory=False, **kwargs):
+    """setConst(shared_memory=False, **kwargs)
     Set a constant that will be shared to every workers.
 
+    :param shared_memory: If True, the values are shared once per host in a
+        memory-mapped file.
     :param **kwargs: One or more combination(s) key=value. Key being the
         variable name and value the object to share.
 
@@ -92,20 +150,93 @@ def setConst(**kwargs):
 
     Usage: setConst(name=value)
     """
+    _sendVariables(kwargs, shared_memory)
+
+
+def _sendVariables(values, shared_memory):
+    """Sends the values of shared constants to a broker."""
     from . import _control
-    
+
     sendVariable = _control.execQueue.socket.sendVariable
 
-    for key, value in kwargs.items():
+    for key, value in values.items():
         # Propagate the constant
         # for file-like objects, see encapsulation.py where copyreg was
         # used to overload standard pickling.
-        if callable(value):
+        if shared_memory:
+            sendVariable(key, encapsulation.MappedEncapsulation(value, key))
+        elif callable(value):
             sendVariable(key, encapsulation.FunctionEncapsulation(value, key))
         else:
             sendVariable(key, value)
 
 
+@ensureScoopStartedProperly
+def updateConst(shared_memory=False, **kwargs):
+    """Replace the value of constants already shared to every workers.
+    This call blocks until the new values have propagated to at least one
+    worker. The previous values are freed by the broker.
+
+    :param shared_memory: If True, the values are shared once per host in a
+        memory-mapped file.
+    :param **kwargs: One or more combination(s) key=value. Key being the
+        name of an existing constant and value its new value.
+
+    :returns: Dictionary of the new version of each constant.
+
+    Usage: updateConst(name=value)
+    """
+    from . import _control
+
+    socket = _control.execQueue.socket
+    socket.pumpInfoSocket()
+
+    for key in kwargs.keys():
+        if key not in index:
+            raise KeyError("This constant does not exist: {0}.".format(key))
+
+    previous = dict((key, versions.get(key, 0)) for key in kwargs.keys())
+    while True:
+        pending = dict((key, value) for key, value in kwargs.items()
+                       if versions.get(key, 0) <= previous[key])
+        if not pending:
+            break
+        scoop.logger.debug("Updating global variables {0}...".format(
+            list(pending.keys())
+        ))
+        _sendVariables(pending, shared_memory)
+        socket.waitVariables(pending.keys())
+        socket.pumpInfoSocket()
+
+    return dict((key, versions.get(key)) for key in kwargs.keys())
+
+
+@ensureScoopStartedProperly
+def delConst(*names):
+    """Delete shared constants from every workers and the brokers.
+    This call blocks until the deletion is acknowledged by a broker.
+
+    :param *names: Names of the constants to delete.
+
+    :returns: None.
+
+    Usage: delConst('name')
+    """
+    from . import _control
+
+    socket = _control.execQueue.socket
+    socket.pumpInfoSocket()
+
+    for name in names:
+        if name not in index:
+            raise KeyError("This constant does not exist: {0}.".format(name))
+
+    while any(name in index for name in names):
+        socket.deleteVariables([name for name in names if name in index])
+        socket.waitVariables(names)
+        socket.pumpInfoSocket()
+
+
 def getConst(name, timeout=0.1):
     """Get a shared constant.
 
@@ -125,24 +256,36 @@ def getConst(name, timeout=0.1):
         # Enforce retrieval of currently awaiting constants
         _control.execQueue.socket.pumpInfoSocket()
 
-        # Constants concatenation
-        constants = dict(reduce(
-            lambda x, y: x + list(y.items()),
-            elements.values(),
-            []
-        ))
-        timeoutHappened = time.time() - timeStamp > timeout
-        if constants.get(name) is not None or timeoutHappened:
-            return constants.get(name)
-        time.sleep(0.01)
+        value = index.get(name)
+        if isinstance(value, encapsulation.MappedEncapsulation):
+            value = _mapElement(name, value)
+        if value is not None or time.time() - timeStamp > timeout:
+            return value
+        _control.execQueue.socket.receiveVariables(0.01)
+
+
+def _mapElement(name, handle):
+    """Maps a value shared in memory on its first use on this worker."""
+    from . import _control
+
+    view = _control.execQueue.socket.mapVariable(handle)
+    if view is not None and index.get(name) is handle:
+        # Not updated while it was fetched
+        for values in elements.values():
+            if values.get(name) is handle:
+                values[name] = view
+        index[name] = view
+    return view
 
 
 class SharedElementEncapsulation(object):
     """Encapsulates a reference to an element available in the shared module.
 
-    This is used by Futures (map on lambda, for instance)."""
+    This is used by Futures (map on lambda, for instance). The shared element
+    is resolved once per worker and version, subsequent calls reusing it."""
     def __init__(self, element):
         self.isMethod = False
+        self._resolved = None
         if utils.isStr(element):
             # Already shared element
             assert getConst(element, timeout=0) != None, (
@@ -169,16 +312,28 @@ class SharedElementEncapsulation(object):
     def __repr__(self):
         return self.uniqueID
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Resolved again on the receiving worker
+        state['_resolved'] = None
+        return state
+
+    def resolve(self):
+        """Returns the shared callable, waiting for its propagation if
+        needed. It is resolved again once the element is updated."""
+        version = versions.get(self.uniqueID)
+        if self._resolved is None or self._resolved[0] != version:
+            resolved = index.get(self.uniqueID)
+            if resolved is None:
+                resolved = getConst(self.uniqueID, timeout=float("inf"))
+                version = versions.get(self.uniqueID)
+            if self.isMethod:
+                resolved = getattr(resolved, self.methodName)
+            self._resolved = (version, resolved)
+        return self._resolved[1]
+
     def __call__(self, *args, **kwargs):
-        if self.isMethod:
-            wholeObj = getConst(
-                self.__repr__(),
-                timeout=float("inf"),
-            )
-            return getattr(wholeObj, self.methodName)(*args, **kwargs)
-        else:
-            return getConst(self.__repr__(),
-                            timeout=float("inf"))(*args, **kwargs)
+        return self.resolve()(*args, **kwargs)
 
     def __name__(self):
         return self.__repr__()
@@ -22,6 +22,8 @@ import re
 import sys
 import socket
 import logging
+import tempfile
+import getpass
 
 if sys.version_info < (2, 7):
     from scoop.backports.dictconfig import dictConfig
@@ -109,6 +111,17 @@ def externalHostname(hosts):
     return hostname
 
 
+def ipcPath(port, name):
+    """Returns the path of the ipc endpoint bound by a process of this user
+    alongside the local tcp port of a socket."""
+    try:
+        user = os.getuid()
+    except AttributeError:
+        user = getpass.getuser()
+    return os.path.join(tempfile.gettempdir(),
+                        "scoop-{0}-{1}-{2}".format(user, name, port))
+
+
 def groupTogether(in_list):
     # TODO: This algorithm is not efficient, use itertools.groupby()
     return_value = []
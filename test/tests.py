@@ -27,13 +27,18 @@ import sys
 import operator
 import signal
 import math
+import pickle
+import struct
+import zmq
 from tests_parser import TestUtils
-from tests_stat import TestStat
+from tests_stat import TestStat, TestTimedDeque
 from tests_stopwatch import TestStopWatch
 
-from scoop import futures, _control, utils, shared
-from scoop._types import FutureQueue
+from scoop import futures, _control, utils, shared, encapsulation
+from scoop._types import FutureQueue, Future
+from scoop._comm.scoopexceptions import ReferenceBroken
 from scoop.broker.structs import BrokerInfo
+from scoop.broker import protocol
 
 
 subprocesses = []
@@ -76,6 +81,15 @@ def func4(n):
     return result
 
 
+def funcSleep(n):
+    time.sleep(0.01)
+    return n * n
+
+
+def funcMultiBroker(n):
+    return sum(futures.map(funcSleep, [i+1 for i in range(n)]))
+
+
 def funcLambda(n):
     lambda_func = lambda x : x*x
     result = list(futures.map(lambda_func, [i+1 for i in range(n)]))
@@ -223,6 +237,140 @@ def funcSharedConstant():
     return result
 
 
+def funcUseSharedConstants(n):
+    return [shared.getConst('constant{0}'.format(i), timeout=1)
+            for i in range(n)]
+
+
+def funcSharedConstants(n):
+    # Every constant costs a round-trip to the broker
+    begin = time.time()
+    for i in range(n):
+        shared.setConst(**{'constant{0}'.format(i): i})
+    elapsed = time.time() - begin
+    result = futures.submit(funcUseSharedConstants, n).result()
+    return elapsed, result
+
+
+def funcSharedLookup(n):
+    shared.setConst(lookupConstant=n)
+    inc = shared.SharedElementEncapsulation(lambda x: x + 1)
+    resolved = inc.resolve()
+    return (shared.index['lookupConstant'] == n,
+            inc.resolve() is resolved,
+            sum(futures.map(inc, range(n))))
+
+
+def funcUseSharedMemory():
+    view = shared.getConst('mappedConstant', timeout=1)
+    return isinstance(view, memoryview), view.readonly, view.tobytes()
+
+
+def funcSharedMemory(n):
+    shared.setConst(mappedConstant=bytes(bytearray(range(n))),
+                    shared_memory=True)
+    return [futures.submit(funcUseSharedMemory).result() for _ in range(4)]
+
+
+def funcUseFetchedMemory(i):
+    time.sleep(0.1)
+    return shared.getConst('fetchedConstant', timeout=1).tobytes()
+
+
+def funcFetchSharedMemory(n):
+    data = bytes(bytearray(range(256))) * n
+    shared.setConst(fetchedConstant=data, shared_memory=True)
+    # Only a handle is sent, the value stays in the file of the origin
+    handleSize = len(pickle.dumps(shared.index['fetchedConstant']))
+    # As if the workers were on another host than the origin
+    os.unlink(encapsulation.mappedFiles['fetchedConstant'])
+    results = list(futures.map(funcUseFetchedMemory, range(16)))
+    return handleSize < 1024, all(result == data for result in results)
+
+
+def funcUnreachableSharedMemory(n):
+    shared.setConst(unreachableConstant=bytes(bytearray(n)),
+                    shared_memory=True)
+    handle = shared.index['unreachableConstant']
+    # As if the origin was lost after sending the handle to another host
+    encapsulation.releaseMapped('unreachableConstant')
+    handle.owner = b"127.0.0.1:9"
+    try:
+        shared.getConst('unreachableConstant')
+    except ReferenceBroken:
+        return True
+    return False
+
+
+# Worker elected to fetch a value shared in memory, then killed
+LOCKING_WORKER = """import pickle, sys, time
+handle = pickle.loads(bytes.fromhex(sys.argv[1]))
+print(handle.lock())
+sys.stdout.flush()
+time.sleep(60)
+"""
+
+
+def funcWaitVersionedConstant(expected):
+    begin = time.time()
+    while (shared.getConst('versioned', timeout=0) != expected
+           and time.time() - begin < 2):
+        time.sleep(0.01)
+    return shared.getConst('versioned', timeout=0)
+
+
+def funcVersionedConstants(n):
+    shared.setConst(versioned=0)
+    versions, values = [], []
+    for i in range(1, n + 1):
+        versions.append(shared.updateConst(versioned=i)['versioned'])
+        values.append(futures.submit(funcWaitVersionedConstant, i).result())
+    shared.delConst('versioned')
+    deleted = futures.submit(funcWaitVersionedConstant, None).result()
+    try:
+        shared.updateConst(versioned=0)
+    except KeyError:
+        missing = True
+    else:
+        missing = False
+    # The name can be used again once deleted
+    shared.setConst(versioned=-1)
+    return (versions == sorted(set(versions)), values, deleted, missing,
+            shared.getConst('versioned'))
+
+
+def funcVersionOne(x):
+    return 1
+
+
+def funcVersionTwo(x):
+    return 2
+
+
+# Shared callables reused by the futures run on this worker
+_versionedCallables = {}
+
+
+def funcCallVersionedCallable(expected):
+    versioned = _versionedCallables.setdefault(
+        'versionedFunc', shared.SharedElementEncapsulation('versionedFunc')
+    )
+    begin = time.time()
+    while versioned(0) != expected and time.time() - begin < 2:
+        time.sleep(0.01)
+    return versioned(0)
+
+
+def funcUpdateSharedCallable():
+    shared.setConst(versionedFunc=funcVersionOne)
+    before = [funcCallVersionedCallable(1),
+              futures.submit(funcCallVersionedCallable, 1).result()]
+    shared.updateConst(versionedFunc=funcVersionTwo)
+    after = [funcCallVersionedCallable(2),
+             futures.submit(funcCallVersionedCallable, 2).result()]
+    return before, after
+
+
 def funcSharedFunction():
     shared.setConst(myRemoteFunc=func4)
     result = True
@@ -239,6 +387,346 @@ def funcMapAsCompleted(n):
     return sum(result)
 
 
+def funcMapChunksize(n, chunksize):
+    result = list(futures.map(func4, [i+1 for i in range(n)],
+                              chunksize=chunksize))
+    return sum(result)
+
+
+def funcAutoChunksize(n):
+    chunksizes = []
+    for func in (funcSleep, lambda x: funcSleep(x)):
+        before = futures._getChunksize(func, 'auto', n)
+        list(futures.map(func, range(n), chunksize='auto'))
+        chunksizes.append((before, futures._getChunksize(func, 'auto', n)))
+    return chunksizes
+
+
+def funcMapAsCompletedChunksize(n, chunksize):
+    result = list(futures.map_as_completed(func4, [i+1 for i in range(n)],
+                                           chunksize=chunksize))
+    return sum(result)
+
+
+def funcMapReduceChunksize(l, chunksize):
+    return futures.mapReduce(func4, operator.add, l, chunksize=chunksize)
+
+
+def funcMapScanChunksize(l, chunksize):
+    return futures.mapScan(func4, operator.add, l, chunksize=chunksize)
+
+
+def funcImap(n, max_in_flight, chunksize=1):
+    result = 0
+    peak = 0
+    for value in futures.imap(func4, (i+1 for i in range(n)),
+                              max_in_flight=max_in_flight,
+                              chunksize=chunksize):
+        result += value
+        peak = max(peak, len(_control.futureDict) - 1)
+    return result, peak
+
+
+class LargeBuffer(object):
+    """Buffer pickled out-of-band with pickle protocol 5, like NumPy arrays."""
+    def __init__(self, data):
+        self.data = bytearray(data)
+
+    def __reduce_ex__(self, protocol):
+        if protocol >= 5:
+            return (LargeBuffer, (pickle.PickleBuffer(self.data),))
+        return (LargeBuffer, (bytes(self.data),))
+
+
+def funcBufferSum(buf, delay=0):
+    time.sleep(delay)
+    return LargeBuffer(bytearray([buf.data[0] + 1]) * len(buf.data))
+
+
+def funcBlobSum(data, offset):
+    return sum(data) + offset
+
+
+def funcBlob(n):
+    # Large argument shared by every future
+    data = list(range(100000))
+    return sum(futures.map(funcBlobSum, [data] * n, range(n)))
+
+
+def funcBlobSlowSum(data, offset):
+    time.sleep(0.1)
+    return sum(data) + offset
+
+
+def funcBlobAnswered(n):
+    data = list(range(100000))
+    result = sum(futures.map(funcBlobSlowSum, [data] * n, range(n)))
+    # The requests of the other worker arrived while this one was busy
+    return result, scoop._control.execQueue.socket.blobsAnswered
+
+
+def funcBlobRelease(n):
+    data = list(range(100000))
+    result = sum(futures.map(funcBlobSum, [data] * n, range(n)))
+    # Every future ended, whether it was run here or remotely
+    socket = scoop._control.execQueue.socket
+    return result, len(socket.blobStore), len(socket.futureBlobs)
+
+
+class CountedState(object):
+    """Argument counting how many times it was pickled."""
+    pickled = 0
+
+    def __init__(self):
+        self.data = list(range(100))
+
+    def __getstate__(self):
+        CountedState.pickled += 1
+        return self.__dict__
+
+
+def funcPickledOnce():
+    CountedState.pickled = 0
+    received, _ = receiveFuture(_control.execQueue.socket, CountedState(), 0)
+    return CountedState.pickled
+
+
+def funcMutatedArgument():
+    socket = _control.execQueue.socket
+    data = bytearray(2**19)
+    first, _ = receiveFuture(socket, data, 0)
+    # Refilled in place between two submits
+    data[:] = b"\x01" * len(data)
+    second, _ = receiveFuture(socket, data, 0)
+    sums = []
+    for received in (first, second):
+        socket._resolveBlobs(received)
+        socket.loadArguments(received)
+        sums.append(sum(received.args[0]))
+        socket.releaseBlobs(received.id)
+    return sums
+
+
+class BrokenState(object):
+    """Argument whose definition is missing where it is deserialized."""
+    def __init__(self):
+        self.value = 1
+
+    def __setstate__(self, state):
+        raise AttributeError("BrokenState is not defined on this worker")
+
+
+def receiveFuture(socket, *args):
+    # Sends a future of this worker to itself, as a peer would receive it
+    future = Future(_control.current.id, funcBlobSum, *args)
+    _control.delFuture(future)
+    frames = [zmq.Frame(bytes(frame))
+              for frame in socket._futureFrames(future)]
+    received, end = socket._loadFuture(frames, 0)
+    received.wireFrames = frames[:end]
+    return received, frames[:end]
+
+
+def funcForwardWireFrames():
+    socket = _control.execQueue.socket
+    received, frames = receiveFuture(socket, list(range(10)), 5)
+    # The arguments are only deserialized when the future runs
+    lazy = received.args is None
+    forwarded = socket._futureFrames(received)
+    unchanged = (len(forwarded) == len(frames)
+                 and all(a is b for a, b in zip(forwarded, frames)))
+    socket.loadArguments(received)
+    return (lazy, unchanged, received.wireFrames,
+            received.args, received.kargs)
+
+
+def funcLazyBrokenArgument():
+    socket = _control.execQueue.socket
+    received, _ = receiveFuture(socket, BrokenState(), 0)
+    loaded = received.args is None
+    _control.runFuture(received)
+    return loaded, type(received.exceptionValue)
+
+
+class HeavyCallable(object):
+    """Callable holding a state larger than a plain function."""
+    def __init__(self):
+        self.table = list(range(1000))
+
+    def __call__(self, n):
+        return self.table[n % 1000] + n
+
+
+def funcHeavyCallable(n):
+    return sum(futures.map(HeavyCallable(), range(n)))
+
+
+stragglerDelays = [20]
+
+
+def funcStraggler(i):
+    # The first iteration run by another worker lags far behind
+    if not scoop.IS_ORIGIN and stragglerDelays:
+        time.sleep(stragglerDelays.pop())
+    time.sleep(0.05)
+    return i
+
+
+def funcSpeculative(n):
+    start = time.time()
+    result = sum(futures.map(funcStraggler, range(n), speculative=True))
+    return result, time.time() - start
+
+
+def funcSpeculativeRetired(n):
+    result = sum(futures.map(funcStraggler, range(n), speculative=True))
+    # Every future of the map is done, its group is retired
+    _control.execQueue.sendStragglers()
+    return (result, len(_control.execQueue.stragglerGroups),
+            len(_control.execQueue.speculated))
+
+
+def funcExecutionTime(i):
+    time.sleep(0.01)
+    return time.time()
+
+
+def funcPriority(n):
+    low = futures.map(funcExecutionTime, range(n), priority=-1)
+    normal = [futures.submit(funcExecutionTime, i) for i in range(n)]
+    high = [futures.submitPriority(1, funcExecutionTime, i) for i in range(n)]
+    # The Future left in the local queue may run before the others
+    mean = lambda times: sum(times) / len(times)
+    low = mean(list(low))
+    normal = mean([future.result() for future in normal])
+    high = mean([future.result() for future in high])
+    return high < normal < low
+
+
+def funcDepth(n):
+    # Returns the depth of the deepest Future spawned
+    if n == 0:
+        return _control.current.depth
+    return max(futures.map(funcDepth, [n - 1, n - 1]))
+
+
+def funcExecutor(i):
+    time.sleep(0.01)
+    return scoop.worker
+
+
+def funcExecutors(n):
+    # Warm up the execution statistics of funcExecutor
+    list(futures.map(funcExecutor, range(4)))
+    return list(futures.map(funcExecutor, range(n)))
+
+
+def funcStolenExecutors(n):
+    executors = funcExecutors(n)
+    # This worker may be the thief or the one stolen from
+    socket = _control.execQueue.socket
+    return executors, socket.futuresGiven + socket.futuresStolen
+
+
+def funcPeerEndpoints(port):
+    # Socket file left by a killed worker which did not advertise ipc
+    stale = utils.ipcPath(port, "peer")
+    open(stale, 'w').close()
+    try:
+        socket = _control.execQueue.socket
+        return (socket._peerEndpoint("127.0.0.1:{0}".format(port).encode()),
+                socket._peerEndpoint(scoop.worker),
+                socket.ipcPath)
+    finally:
+        os.unlink(stale)
+
+
+def funcUseLargeConstant(i):
+    time.sleep(0.01)
+    value = shared.getConst('largeConstant', timeout=5)
+    return scoop.worker, len(value), value[-1]
+
+
+def funcLargeConstant(workers, size=2**21):
+    # The workers connected before the broadcast receive the constant through
+    # each other
+    begin = time.time()
+    while (len(set(futures.map(funcExecutor, range(4 * workers)))) < workers
+           and time.time() - begin < 10):
+        pass
+    shared.setConst(largeConstant=bytearray(size - 1) + bytearray([7]))
+    results = list(futures.map(funcUseLargeConstant, range(8 * workers)))
+    return (len(set(result[0] for result in results)),
+            set(result[1:] for result in results))
+
+
+def funcBusyExecutor(delay):
+    time.sleep(delay)
+    return scoop.worker
+
+
+def funcRequestedLargeConstant(i):
+    time.sleep(0.01)
+    value = shared.getConst('largeConstant', timeout=5)
+    socket = _control.execQueue.socket
+    return scoop.worker, len(value), socket.variablesRequested
+
+
+def funcBroadcastWhileBusy(workers, size=2**21):
+    begin = time.time()
+    while (len(set(futures.map(funcExecutor, range(4 * workers)))) < workers
+           and time.time() - begin < 10):
+        pass
+    busy = [futures.submit(funcBusyExecutor, 1.) for _ in range(2 * workers)]
+    # Let the other workers start them
+    time.sleep(0.3)
+    shared.setConst(largeConstant=bytearray(size - 1) + bytearray([7]))
+    # The chunks are sent to the workers while they are busy
+    _control.execQueue.socket.waitVariables(['largeConstant'])
+    futures.wait(busy)
+    results = list(futures.map(funcRequestedLargeConstant,
+                               range(8 * workers)))
+    requested = dict((result[0], result[2]) for result in results)
+    return (len(requested), set(result[1] for result in results),
+            sum(1 for count in requested.values() if count == 0))
+
+
+def funcForwardedChunk(port):
+    # Fake peer, to which the chunk is forwarded while this worker is busy
+    address = "127.0.0.1:{0}".format(port).encode()
+    context = zmq.Context()
+    peer = context.socket(zmq.ROUTER)
+    peer.setsockopt(zmq.IDENTITY, address)
+    peer.bind("tcp://127.0.0.1:{0}".format(port))
+    sender = context.socket(zmq.DEALER)
+    try:
+        socket = _control.execQueue.socket
+        socket.addPeer(address)
+        host, own = scoop.worker.decode().split(":")[:2]
+        sender.connect("tcp://{0}:{1}".format(host, own))
+        time.sleep(0.5)
+        head = [protocol.VARIABLE_CHUNK, pickle.dumps('forwarded'),
+                scoop.worker, protocol.encodeCount(2**20),
+                protocol.encodeCount(0), protocol.encodeCount(1)]
+        sender.send_multipart(head + [protocol.encodeList([address]),
+                                      b"chunk"])
+        # Blocks this thread as a future would
+        if not peer.poll(5000):
+            return None
+        return head + [protocol.encodeList([]), b"chunk"], \
+            peer.recv_multipart()[1:]
+    finally:
+        sender.close(0)
+        peer.close(0)
+        context.term()
+
+
+def funcLargeBuffer(n, size=2**17, delay=0):
+    buffers = [LargeBuffer(bytearray([i]) * size) for i in range(n)]
+    results = futures.map(funcBufferSum, buffers, [delay] * n)
+    return [sum(result.data) for result in results]
+
+
 def funcIter(n):
     result = list(futures.map(func4, (i+1 for i in range(n))))
     return sum(result)
@@ -299,6 +787,9 @@ def port_ready(port, socket):
 
 
 class TestScoopCommon(unittest.TestCase):
+    # Additional arguments of the started broker
+    brokerArguments = []
+
     def __init__(self, *args, **kwargs):
         # Parent initialization
         super(TestScoopCommon, self).__init__(*args, **kwargs)
@@ -307,7 +798,7 @@ class TestScoopCommon(unittest.TestCase):
         global subprocesses
         worker = subprocess.Popen([sys.executable, "-m", "scoop.bootstrap.__main__",
         "--brokerHostname", "127.0.0.1", "--taskPort", "5555",
-        "--metaPort", "5556", "tests.py"])
+        "--metaPort", "5556", "--workingDirectory", os.getcwd(), "tests.py"])
         subprocesses.append(worker)
         return worker
 
@@ -317,7 +808,7 @@ class TestScoopCommon(unittest.TestCase):
 
         # Start the server
         self.server = subprocess.Popen([sys.executable, "-m", "scoop.broker.__main__",
-        "--tPort", "5555", "--mPort", "5556"])
+        "--tPort", "5555", "--mPort", "5556"] + self.brokerArguments)
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         begin = datetime.datetime.now()
         while not port_ready(5555, s):
@@ -530,6 +1021,16 @@ class TestApi(TestScoopCommon):
         result = futures._startup(funcLambda, 30)
         self.assertEqual(result, 9455)
 
+    def test_peer_endpoints(self):
+        from scoop._comm.scoopzmq import IPC_AVAILABLE
+        if not IPC_AVAILABLE:
+            self.skipTest("ipc is not available")
+        stale, own, path = futures._startup(funcPeerEndpoints, 40000)
+        self.assertEqual(stale, "tcp://127.0.0.1:40000")
+        self.assertEqual(own, "ipc://" + path)
+        # Removed when the worker shut down
+        self.assertFalse(os.path.exists(path))
+
     def test_submit_with_keyword(self):
         result = futures._startup(funcKeywords, 2, kwarg=3.1415926)
         self.assertEqual(result, { "kwarg": 3.1415926} )
@@ -598,6 +1099,173 @@ class TestApi(TestScoopCommon):
         result = futures._startup(funcMapAsCompleted, 30)
         self.assertEqual(result, 9455)
 
+    def test_map_chunksize_single(self):
+        result = futures._startup(funcMapChunksize, 30, 4)
+        self.assertEqual(result, 9455)
+
+    def test_map_chunksize_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcMapChunksize, 30, 4)
+        self.assertEqual(result, 9455)
+
+    def test_map_chunksize_auto(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcMapChunksize, 30, 'auto')
+        self.assertEqual(result, 9455)
+
+    def test_auto_chunksize_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcAutoChunksize, 80)
+        # Sized from the stats of the first map: 10 ms per call
+        self.assertEqual(len(result), 2)
+        for before, after in result:
+            self.assertEqual(before, 10)
+            self.assertTrue(1 < after < before)
+
+    def test_map_as_completed_chunksize(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcMapAsCompletedChunksize, 30, 7)
+        self.assertEqual(result, 9455)
+
+    def test_imap_single(self):
+        result, peak = futures._startup(funcImap, 30, 5)
+        self.assertEqual(result, 9455)
+        self.assertLessEqual(peak, 5)
+
+    def test_imap_multi(self):
+        self.w = self.multiworker_set()
+        result, peak = futures._startup(funcImap, 30, 5, 3)
+        self.assertEqual(result, 9455)
+
+    def test_multi_broker(self):
+        import socket, zmq
+        # Start a fellow broker and connect both brokers together
+        broker = subprocess.Popen([sys.executable, "-m", "scoop.broker.__main__",
+        "--tPort", "5557", "--mPort", "5558"])
+        subprocesses.append(broker)
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        while not port_ready(5557, s):
+            time.sleep(0.1)
+        context = zmq.Context()
+        for port, fellow in ((5555, 5557), (5557, 5555)):
+            sock = context.socket(zmq.DEALER)
+            sock.connect("tcp://127.0.0.1:{0}".format(port))
+            sock.send_multipart([protocol.CONNECT, pickle.dumps([
+                BrokerInfo("127.0.0.1", fellow, fellow + 1, "127.0.0.1"),
+            ])])
+        time.sleep(0.5)
+        context.destroy(1000)
+        try:
+            self.w = self.multiworker_set()
+            result = futures._startup(funcMultiBroker, 200)
+            self.assertEqual(result, 2686700)
+        finally:
+            broker.terminate()
+            broker.wait()
+
+    def test_sub_broker(self):
+        import socket
+        # Start a sub-broker relaying the worker traffic to the broker
+        broker = subprocess.Popen([sys.executable, "-m", "scoop.broker.__main__",
+        "--tPort", "5557", "--mPort", "5558",
+        "--upstream", "127.0.0.1:5555:5556"])
+        subprocesses.append(broker)
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        while not port_ready(5557, s):
+            time.sleep(0.1)
+        try:
+            self.w = subprocess.Popen([sys.executable, "-m",
+            "scoop.bootstrap.__main__", "--brokerHostname", "127.0.0.1",
+            "--taskPort", "5557", "--metaPort", "5558", "--workingDirectory",
+            os.getcwd(), "tests.py"])
+            subprocesses.append(self.w)
+            result = futures._startup(funcMultiBroker, 200)
+            self.assertEqual(result, 2686700)
+        finally:
+            broker.terminate()
+            broker.wait()
+
+    def test_blob_single(self):
+        result = futures._startup(funcBlob, 20)
+        self.assertEqual(result, 20 * 4999950000 + 190)
+
+    def test_blob_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcBlob, 20)
+        self.assertEqual(result, 20 * 4999950000 + 190)
+
+    def test_blob_release(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcBlobRelease, 40)
+        self.assertEqual(result, (40 * 4999950000 + 780, 0, 0))
+
+    def test_pickled_once(self):
+        result = futures._startup(funcPickledOnce)
+        self.assertEqual(result, 1)
+
+    def test_mutated_argument(self):
+        result = futures._startup(funcMutatedArgument)
+        self.assertEqual(result, [0, 2**19])
+
+    def test_forward_wire_frames(self):
+        result = futures._startup(funcForwardWireFrames)
+        self.assertEqual(result, (True, True, None, (list(range(10)), 5), {}))
+
+    def test_lazy_broken_argument(self):
+        result = futures._startup(funcLazyBrokenArgument)
+        self.assertEqual(result, (True, ReferenceBroken))
+
+    def test_heavy_callable_single(self):
+        result = futures._startup(funcHeavyCallable, 30)
+        self.assertEqual(result, 870)
+
+    def test_heavy_callable_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcHeavyCallable, 30)
+        self.assertEqual(result, 870)
+
+    def test_speculative_single(self):
+        result, _ = futures._startup(funcSpeculative, 30)
+        self.assertEqual(result, 435)
+
+    def test_speculative_multi(self):
+        self.w = self.multiworker_set()
+        result, elapsed = futures._startup(funcSpeculative, 30)
+        self.assertEqual(result, 435)
+        self.assertLess(elapsed, 15)
+
+    def test_speculative_retired(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcSpeculativeRetired, 30)
+        self.assertEqual(result, (435, 0, 0))
+
+    def test_priority_single(self):
+        result = futures._startup(funcPriority, 10)
+        self.assertTrue(result)
+
+    def test_depth_single(self):
+        result = futures._startup(funcDepth, 5)
+        self.assertEqual(result, 5)
+
+    def test_depth_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcDepth, 5)
+        self.assertEqual(result, 5)
+
+    def test_large_buffer_single(self):
+        result = futures._startup(funcLargeBuffer, 4)
+        self.assertEqual(result, [(i + 1) * 2**17 for i in range(4)])
+
+    def test_large_buffer_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcLargeBuffer, 4)
+        self.assertEqual(result, [(i + 1) * 2**17 for i in range(4)])
+
+    def test_large_reply_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcLargeBuffer, 8, 2**21, 0.1)
+        self.assertEqual(result, [(i + 1) * 2**21 for i in range(8)])
+
     def test_from_generator_single(self):
         result = futures._startup(funcIter, 30)
         self.assertEqual(result, 9455)
@@ -624,6 +1292,14 @@ class TestCoherent(TestScoopCommon):
         result = futures._startup(funcMapScan, [10, 20, 30])
         self.assertEqual(max(result), 1400)
 
+    def test_mapReduce_chunksize(self):
+        result = futures._startup(funcMapReduceChunksize, list(range(20)), 3)
+        self.assertEqual(result, 2470)
+
+    def test_mapScan_chunksize(self):
+        result = futures._startup(funcMapScanChunksize, list(range(20)), 3)
+        self.assertEqual(max(result), 2470)
+
 
 class TestShared(TestScoopCommon):
     def __init(self, *args, **kwargs):
@@ -637,6 +1313,483 @@ class TestShared(TestScoopCommon):
         result = futures._startup(funcSharedConstant)
         self.assertEqual(result, True)
 
+    def test_shareConstants_multi(self):
+        self.w = self.multiworker_set()
+        elapsed, result = futures._startup(funcSharedConstants, 30)
+        self.assertEqual(result, list(range(30)))
+        self.assertLess(elapsed, 1.5)
+
+    def test_shareLookup_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcSharedLookup, 20)
+        self.assertEqual(result, (True, True, sum(range(1, 21))))
+
+    def test_versionedConstants_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcVersionedConstants, 10)
+        self.assertEqual(result,
+                         (True, list(range(1, 11)), None, True, -1))
+
+    def test_updateSharedCallable_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcUpdateSharedCallable)
+        self.assertEqual(result, ([1, 1], [2, 2]))
+
+    def test_shareMemory_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcSharedMemory, 200)
+        self.assertEqual(result,
+                         [(True, True, bytes(bytearray(range(200))))] * 4)
+
+    def test_fetchSharedMemory_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcFetchSharedMemory, 4096)
+        self.assertEqual(result, (True, True))
+
+    def test_unreachableSharedMemory(self):
+        from scoop._comm import scoopzmq
+        timeout = scoopzmq.TIME_BEFORE_MAPPED_FAILURE
+        scoopzmq.TIME_BEFORE_MAPPED_FAILURE = 2.5
+        try:
+            begin = time.time()
+            result = futures._startup(funcUnreachableSharedMemory, 64)
+        finally:
+            scoopzmq.TIME_BEFORE_MAPPED_FAILURE = timeout
+        self.assertTrue(result)
+        self.assertGreaterEqual(time.time() - begin, 2.5)
+
+    def test_sharedMemoryLockOfKilledWorker(self):
+        handle = encapsulation.MappedEncapsulation(b"\0" * 16, "lockedConstant")
+        encapsulation.releaseMapped("lockedConstant")
+        elected = subprocess.Popen([sys.executable, "-c", LOCKING_WORKER,
+                                    pickle.dumps(handle).hex()],
+                                   stdout=subprocess.PIPE)
+        try:
+            self.assertEqual(elected.stdout.readline().strip(), b"True")
+            self.assertFalse(handle.lock())
+        finally:
+            elected.kill()
+            elected.wait()
+            elected.stdout.close()
+        # Released by the system, the lock is taken by another worker
+        self.assertTrue(handle.lock())
+        handle.unlock()
+        self.assertFalse(os.path.exists(handle.path() + ".lock"))
+
+
+class TestIOThread(TestScoopCommon):
+    def __init(self, *args, **kwargs):
+        super(TestIOThread, self).__init(*args, **kwargs)
+
+    def multiworker_set(self):
+        global subprocesses
+        worker = subprocess.Popen([sys.executable, "-m", "scoop.bootstrap.__main__",
+        "--brokerHostname", "127.0.0.1", "--taskPort", "5555",
+        "--metaPort", "5556", "--workingDirectory", os.getcwd(),
+        "--io-thread", "tests.py"])
+        subprocesses.append(worker)
+        return worker
+
+    def setUp(self):
+        scoop.CONFIGURATION['ioThread'] = True
+        super(TestIOThread, self).setUp()
+
+    def tearDown(self):
+        super(TestIOThread, self).tearDown()
+        scoop.CONFIGURATION.pop('ioThread', None)
+
+    def test_map_single(self):
+        result = futures._startup(func3, 30)
+        self.assertEqual(result, 9455)
+
+    def test_map_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(func3, 30)
+        self.assertEqual(result, 9455)
+
+    def test_blob_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcBlob, 20)
+        self.assertEqual(result, 20 * 4999950000 + 190)
+
+    def test_large_buffer_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcLargeBuffer, 4)
+        self.assertEqual(result, [(i + 1) * 2**17 for i in range(4)])
+
+    def test_blob_answered_multi(self):
+        self.w = self.multiworker_set()
+        result, answered = futures._startup(funcBlobAnswered, 40)
+        self.assertEqual(result, 40 * 4999950000 + 780)
+        self.assertGreater(answered, 0)
+
+    def test_chunk_forwarded(self):
+        result = futures._startup(funcForwardedChunk, 40001)
+        self.assertIsNotNone(result)
+        expected, received = result
+        self.assertEqual(received, expected)
+
+
+class TestTreeBroadcast(TestScoopCommon):
+    def __init(self, *args, **kwargs):
+        super(TestTreeBroadcast, self).__init(*args, **kwargs)
+
+    def multiworker_set(self, *args):
+        global subprocesses
+        worker = subprocess.Popen([sys.executable, "-m", "scoop.bootstrap.__main__",
+        "--brokerHostname", "127.0.0.1", "--taskPort", "5555",
+        "--metaPort", "5556", "--workingDirectory", os.getcwd(),
+        "--tree-broadcast"] + list(args) + ["tests.py"])
+        subprocesses.append(worker)
+        return worker
+
+    def setUp(self):
+        scoop.CONFIGURATION['treeBroadcast'] = True
+        super(TestTreeBroadcast, self).setUp()
+
+    def tearDown(self):
+        super(TestTreeBroadcast, self).tearDown()
+        scoop.CONFIGURATION.pop('treeBroadcast', None)
+
+    def test_shareConstant_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcSharedFunction)
+        self.assertEqual(result, True)
+
+    def test_broadcast_multi(self):
+        self.w = self.multiworker_set()
+        for _ in range(2):
+            self.addCleanup(self.multiworker_set().terminate)
+        result = futures._startup(funcLargeConstant, 4)
+        self.assertEqual(result, (4, set([(2**21, 7)])))
+
+    def test_broadcast_busy_multi(self):
+        scoop.CONFIGURATION['ioThread'] = True
+        self.addCleanup(scoop.CONFIGURATION.pop, 'ioThread', None)
+        self.w = self.multiworker_set("--io-thread")
+        for _ in range(2):
+            self.addCleanup(self.multiworker_set("--io-thread").terminate)
+        workers, sizes, quiet = futures._startup(funcBroadcastWhileBusy, 4)
+        self.assertEqual(workers, 4)
+        self.assertEqual(sizes, set([2**21]))
+        # The busy workers forwarded the chunks from their I/O thread
+        self.assertGreaterEqual(quiet, 3)
+
+
+class TestWorkStealing(TestScoopCommon):
+    def __init(self, *args, **kwargs):
+        super(TestWorkStealing, self).__init(*args, **kwargs)
+
+    def multiworker_set(self):
+        global subprocesses
+        worker = subprocess.Popen([sys.executable, "-m", "scoop.bootstrap.__main__",
+        "--brokerHostname", "127.0.0.1", "--taskPort", "5555",
+        "--metaPort", "5556", "--workingDirectory", os.getcwd(),
+        "--work-stealing", "tests.py"])
+        subprocesses.append(worker)
+        return worker
+
+    def setUp(self):
+        scoop.CONFIGURATION['workStealing'] = True
+        super(TestWorkStealing, self).setUp()
+
+    def tearDown(self):
+        super(TestWorkStealing, self).tearDown()
+        scoop.CONFIGURATION.pop('workStealing', None)
+
+    def test_map_single(self):
+        result = futures._startup(func3, 30)
+        self.assertEqual(result, 9455)
+
+    def test_map_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(func3, 30)
+        self.assertEqual(result, 9455)
+
+    def test_steal_multi(self):
+        self.w = self.multiworker_set()
+        executors, given = futures._startup(funcStolenExecutors, 200)
+        self.assertEqual(len(executors), 200)
+        self.assertEqual(len(set(executors)), 2)
+        # Futures changed worker through steals, not only through the broker
+        self.assertGreater(given, 0)
+
+    def test_depth_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcDepth, 5)
+        self.assertEqual(result, 5)
+
+    def test_blob_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcBlob, 20)
+        self.assertEqual(result, 20 * 4999950000 + 190)
+
+
+class TestProtocol(unittest.TestCase):
+    def test_id(self):
+        fid = (b"127.0.0.1:50000", 2**40 + 3)
+        self.assertEqual(protocol.decodeId(protocol.encodeId(fid)), fid)
+
+    def test_list(self):
+        ids = [protocol.encodeId((b"127.0.0.1:50000", i)) for i in range(3)]
+        self.assertEqual(protocol.decodeList(protocol.encodeList(ids)), ids)
+        self.assertEqual(protocol.decodeList(protocol.encodeList([])), [])
+
+    def test_values(self):
+        self.assertEqual(protocol.decodeCount(protocol.encodeCount(7)), 7)
+        self.assertEqual(protocol.decodeKey(protocol.encodeKey(-1.5)), -1.5)
+        self.assertEqual(protocol.decodeFlag(protocol.encodeFlag(True)), True)
+
+    def test_version(self):
+        self.assertTrue(protocol.isCompatible(protocol.TASK))
+        self.assertFalse(protocol.isCompatible(b"T"))
+
+
+class TestBroker(unittest.TestCase):
+    """Talks to a broker run in a thread of the test process."""
+    def setUp(self):
+        import threading
+        import zmq
+        from scoop.broker.brokerzmq import Broker
+        self.broker = Broker("tcp://127.0.0.1:*", "tcp://127.0.0.1:*")
+        self.thread = threading.Thread(target=self.broker.run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.context = zmq.Context()
+        self.workers = []
+
+    def tearDown(self):
+        self.worker(b"shutdown").send(protocol.SHUTDOWN)
+        self.thread.join(5)
+        self.context.destroy(0)
+
+    def worker(self, name):
+        """Returns a socket sending on behalf of the worker name."""
+        import zmq
+        sock = self.context.socket(zmq.DEALER)
+        sock.setsockopt(zmq.IDENTITY, name)
+        sock.setsockopt(zmq.RCVTIMEO, 2000)
+        sock.connect("tcp://127.0.0.1:{0}".format(self.broker.t_sock_port))
+        self.workers.append(sock)
+        return sock
+
+    def sync(self, sock):
+        """Waits until the broker handled the messages sent by sock."""
+        sock.send_multipart([protocol.STATUS_REQ, protocol.encodeList([]),
+                             protocol.encodeCount(0)])
+        return sock.recv_multipart()
+
+    @staticmethod
+    def sendTask(sock, name, rank):
+        fid = protocol.encodeId((name, rank))
+        sock.send_multipart([protocol.TASK, fid, protocol.encodeKey(rank),
+                             b"", fid])
+        return fid
+
+    def test_request_credit(self):
+        origin, worker = self.worker(b"origin"), self.worker(b"worker")
+        for rank in range(5):
+            self.sendTask(origin, b"origin", rank)
+        self.sync(origin)
+
+        # Up to the credit is sent in a single message, in order
+        worker.send_multipart([protocol.REQUEST, protocol.encodeCount(3)])
+        msg = worker.recv_multipart()
+        self.assertEqual(msg[0], protocol.TASK)
+        self.assertEqual(msg[2::2], [protocol.encodeId((b"origin", rank))
+                                     for rank in range(3)])
+        worker.send_multipart([protocol.REQUEST, protocol.encodeCount(3)])
+        msg = worker.recv_multipart()
+        self.assertEqual(msg[2::2], [protocol.encodeId((b"origin", rank))
+                                     for rank in range(3, 5)])
+
+        # An empty queue makes the worker wait for the next task
+        worker.send_multipart([protocol.REQUEST, protocol.encodeCount(3)])
+        self.sync(worker)
+        fid = self.sendTask(origin, b"origin", 5)
+        self.assertEqual(worker.recv_multipart(), [protocol.TASK, b"", fid])
+
+    def test_task_locations(self):
+        from scoop.broker.brokerzmq import QUEUED
+        origin, worker = self.worker(b"origin"), self.worker(b"worker")
+        fids = [self.sendTask(origin, b"origin", rank) for rank in range(3)]
+        self.sync(origin)
+        self.assertEqual(self.broker.task_locations,
+                         dict.fromkeys(fids, QUEUED))
+
+        worker.send_multipart([protocol.REQUEST, protocol.encodeCount(2)])
+        worker.recv_multipart()
+        self.sync(worker)
+        self.assertEqual(self.broker.task_locations,
+                         {fids[0]: b"worker", fids[1]: b"worker",
+                          fids[2]: QUEUED})
+
+        worker.send_multipart([protocol.STATUS_DONE, fids[0]])
+        # The worker does not hold the second task anymore
+        worker.send_multipart([protocol.STATUS_UPDATE,
+                               protocol.encodeList([])])
+        self.sync(worker)
+        self.assertEqual(self.broker.task_locations, {fids[2]: QUEUED})
+
+        # The remaining task is handed to the next idle worker
+        worker.send_multipart([protocol.REQUEST, protocol.encodeCount(1)])
+        worker.recv_multipart()
+        worker.send_multipart([protocol.STATUS_UPDATE,
+                               protocol.encodeList([fids[2]])])
+        self.sync(worker)
+        self.assertEqual(self.broker.task_locations, {fids[2]: b"worker"})
+
+    def test_malformed_status_update(self):
+        sub = self.worker(b"sub")
+        sub.send_multipart([protocol.INIT, pickle.dumps({
+            'subBroker': BrokerInfo("127.0.0.1", 1, 2, "127.0.0.1"),
+        })])
+        sub.recv_multipart()
+        sub.recv_multipart()
+        # The list of the workers behind the sub-broker is truncated
+        sub.send_multipart([protocol.STATUS_UPDATE, protocol.encodeList([]),
+                            b"\x01"])
+        self.assertEqual(self.sync(sub)[0], protocol.STATUS_ANS)
+        self.assertNotIn(b"sub", self.broker.assigned_tasks)
+
+    def test_ipc_endpoints(self):
+        from scoop.broker.brokerzmq import IPC_AVAILABLE
+        if not IPC_AVAILABLE:
+            self.skipTest("ipc is not available")
+        self.assertTrue(self.broker.ipc)
+        paths = self.broker.ipcPaths
+        self.assertEqual(len(paths), 2)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+        self.worker(b"shutdown").send(protocol.SHUTDOWN)
+        self.thread.join(5)
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_unreachable_root_broker(self):
+        from scoop.broker import subbroker
+        timeout = subbroker.REGISTER_TIMEOUT
+        subbroker.REGISTER_TIMEOUT = 0.5
+        try:
+            # Nothing listens on this port
+            unused = self.context.socket(zmq.DEALER)
+            port = unused.bind_to_random_port("tcp://127.0.0.1")
+            unused.close(0)
+            with self.assertRaises(IOError):
+                subbroker.SubBroker(BrokerInfo("127.0.0.1", port, port,
+                                               "127.0.0.1"),
+                                    "tcp://127.0.0.1:*", "tcp://127.0.0.1:*")
+        finally:
+            subbroker.REGISTER_TIMEOUT = timeout
+
+    def test_status_request(self):
+        origin, worker = self.worker(b"origin"), self.worker(b"worker")
+        fids = [self.sendTask(origin, b"origin", rank) for rank in range(3)]
+        worker.send_multipart([protocol.REQUEST, protocol.encodeCount(2)])
+        worker.recv_multipart()
+        worker.send_multipart([protocol.STATUS_DONE, fids[0]])
+        self.sync(worker)
+
+        # A single answer holds the status of every requested id, in order
+        unknown = protocol.encodeId((b"origin", 10))
+        origin.send_multipart([
+            protocol.STATUS_REQ,
+            protocol.encodeList([unknown, fids[2], fids[1], fids[0]]),
+            protocol.encodeCount(7),
+        ])
+        self.assertEqual(origin.recv_multipart(), [
+            protocol.STATUS_ANS,
+            protocol.STATUS_NONE + protocol.STATUS_HERE
+            + protocol.STATUS_GIVEN + protocol.STATUS_NONE,
+            protocol.encodeCount(7),
+        ])
+
+
+class TestRelay(unittest.TestCase):
+    """Runs the relay thread of a broker whose loop is not started."""
+    def setUp(self):
+        import zmq
+        from scoop.broker.brokerzmq import Broker
+        self.broker = Broker("tcp://127.0.0.1:*", "tcp://127.0.0.1:*")
+        self.context = zmq.Context()
+        self.sock = self.context.socket(zmq.DEALER)
+        self.sock.setsockopt(zmq.IDENTITY, b"worker")
+        self.sock.setsockopt(zmq.RCVTIMEO, 2000)
+        self.sock.connect(
+            "tcp://127.0.0.1:{0}".format(self.broker.t_sock_port)
+        )
+        # The broker knows the worker once its first message is received
+        self.sock.send(protocol.REQUEST)
+        self.broker.task_socket.recv_multipart()
+
+    def tearDown(self):
+        self.context.destroy(0)
+        self.broker.context.destroy(0)
+
+    def test_send_queued_on_stop(self):
+        from scoop.broker.relay import RelayThread
+        relay = RelayThread(self.broker)
+        # Queued by the broker loop right before its shutdown
+        for rank in range(3):
+            self.broker.task_socket.send_multipart(
+                [b"worker", protocol.STATUS_ANS, protocol.encodeCount(rank)]
+            )
+        relay.control.send(b"")
+        relay.start()
+        relay.join(5)
+        relay.stop()
+        self.assertEqual(
+            [protocol.decodeCount(self.sock.recv_multipart()[1])
+             for _ in range(3)],
+            [0, 1, 2],
+        )
+
+    def test_incompatible_message(self):
+        from scoop.broker.relay import RelayThread
+        relay = RelayThread(self.broker)
+        relay.start()
+        try:
+            otherVersion = (struct.pack("!B", protocol.PROTOCOL_VERSION + 1)
+                            + protocol.REPLY[1:])
+            self.sock.send_multipart([otherVersion, b"fid", b"", b"worker"])
+            self.sock.send_multipart([protocol.REPLY, b"fid", b"", b"worker"])
+            # Only the answer of this protocol version is relayed, the other
+            # one is neither relayed nor passed to the broker loop
+            self.assertEqual(self.sock.recv_multipart()[0], protocol.REPLY)
+            self.assertFalse(self.sock.poll(200))
+            self.assertFalse(self.broker.task_socket.poll(0))
+        finally:
+            relay.stop()
+
+
+class TestThreadedBroker(TestScoopCommon):
+    brokerArguments = ["--threaded"]
+
+    def __init(self, *args, **kwargs):
+        super(TestThreadedBroker, self).__init(*args, **kwargs)
+
+    def test_map_single(self):
+        result = futures._startup(func3, 30)
+        self.assertEqual(result, 9455)
+
+    def test_map_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(func3, 30)
+        self.assertEqual(result, 9455)
+
+    def test_exception_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcExcept, 19)
+        self.assertTrue(result)
+
+    def test_shareConstant_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcSharedConstant)
+        self.assertEqual(result, True)
+
+    def test_blob_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcBlob, 20)
+        self.assertEqual(result, 20 * 4999950000 + 190)
+
 
 if __name__ == '__main__' and os.environ.get('IS_ORIGIN', "1") == "1":
     utSimple = unittest.TestLoader().loadTestsFromTestCase(TestSingleFunction)
@@ -647,6 +1800,12 @@ if __name__ == '__main__' and os.environ.get('IS_ORIGIN', "1") == "1":
     utShared = unittest.TestLoader().loadTestsFromTestCase(TestShared)
     utStat = unittest.TestLoader().loadTestsFromTestCase(TestStat)
     utStopWatch = unittest.TestLoader().loadTestsFromTestCase(TestStopWatch)
+    utIOThread = unittest.TestLoader().loadTestsFromTestCase(TestIOThread)
+    utWorkStealing = unittest.TestLoader().loadTestsFromTestCase(TestWorkStealing)
+    utThreadedBroker = unittest.TestLoader().loadTestsFromTestCase(TestThreadedBroker)
+    utProtocol = unittest.TestLoader().loadTestsFromTestCase(TestProtocol)
+    utBroker = unittest.TestLoader().loadTestsFromTestCase(TestBroker)
+    utTreeBroadcast = unittest.TestLoader().loadTestsFromTestCase(TestTreeBroadcast)
 
     if len(sys.argv) > 1:
         if sys.argv[1] == "simple":
@@ -665,6 +1824,18 @@ if __name__ == '__main__' and os.environ.get('IS_ORIGIN', "1") == "1":
             unittest.TextTestRunner(verbosity=2).run(utStat)
         elif sys.argv[1] == "stopwatch":
             unittest.TextTestRunner(verbosity=2).run(utStopWatch)
+        elif sys.argv[1] == "iothread":
+            unittest.TextTestRunner(verbosity=2).run(utIOThread)
+        elif sys.argv[1] == "workstealing":
+            unittest.TextTestRunner(verbosity=2).run(utWorkStealing)
+        elif sys.argv[1] == "threadedbroker":
+            unittest.TextTestRunner(verbosity=2).run(utThreadedBroker)
+        elif sys.argv[1] == "protocol":
+            unittest.TextTestRunner(verbosity=2).run(utProtocol)
+        elif sys.argv[1] == "broker":
+            unittest.TextTestRunner(verbosity=2).run(utBroker)
+        elif sys.argv[1] == "treebroadcast":
+            unittest.TextTestRunner(verbosity=2).run(utTreeBroadcast)
         elif sys.argv[1] == "verbose":
             sys.argv = sys.argv[0:1]
             unittest.main(verbosity=2)
@@ -1,4 +1,5 @@
-from scoop._control import _stat
+from scoop._control import _stat, execStats
+from scoop._types import TimedDeque, TimedHeap
 import unittest
 
 class TestStat(unittest.TestCase):
@@ -66,6 +67,124 @@ class TestStat(unittest.TestCase):
         stats.appendleft(1000)
         self.assertAlmostEqual(stats.median(), 9.03600168611)
 
+
+class _FakeFuture(object):
+    def __init__(self, callable_, key=0):
+        self.callable = callable_
+        self.key = key
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+def _timedFunc():
+    pass
+
+
+def _untimedFunc():
+    pass
+
+
+class TestTimedDeque(unittest.TestCase):
+    def setUp(self):
+        execStats.pop(hash(_timedFunc), None)
+        execStats.pop(hash(_untimedFunc), None)
+        for _ in range(10):
+            execStats[hash(_timedFunc)].appendleft(2.)
+
+    def test_timelen(self):
+        queue = TimedDeque()
+        self.assertEqual(queue.timelen(), 0.)
+        for _ in range(5):
+            queue.append(_FakeFuture(_timedFunc))
+        self.assertAlmostEqual(queue.timelen(), 10.)
+        queue.popleft()
+        self.assertAlmostEqual(queue.timelen(), 8.)
+        queue.clear()
+        self.assertEqual(queue.timelen(), 0.)
+
+    def test_unknown_stats(self):
+        queue = TimedDeque()
+        queue.append(_FakeFuture(_timedFunc))
+        unknown = _FakeFuture(_untimedFunc)
+        queue.append(unknown)
+        self.assertEqual(queue.timelen(), float("inf"))
+        queue.remove(unknown)
+        self.assertAlmostEqual(queue.timelen(), 2.)
+
+    def test_stats_changed(self):
+        queue = TimedDeque()
+        for _ in range(3):
+            queue.append(_FakeFuture(_untimedFunc))
+        self.assertEqual(queue.timelen(), float("inf"))
+        for _ in range(10):
+            execStats[hash(_untimedFunc)].appendleft(1.)
+        queue.statsChanged(hash(_untimedFunc))
+        self.assertAlmostEqual(queue.timelen(), 3.)
+
+
+class TestTimedHeap(unittest.TestCase):
+    def setUp(self):
+        execStats.pop(hash(_timedFunc), None)
+        execStats.pop(hash(_untimedFunc), None)
+        for _ in range(10):
+            execStats[hash(_timedFunc)].appendleft(2.)
+
+    def test_order(self):
+        queue = TimedHeap()
+        keys = [5, 1, 4, 2, 3]
+        for key in keys:
+            queue.append(_FakeFuture(_timedFunc, key))
+        self.assertEqual([queue.popleft().key for _ in keys], sorted(keys))
+
+    def test_timelen(self):
+        queue = TimedHeap()
+        futures = [_FakeFuture(_timedFunc, key) for key in range(5)]
+        for future in futures:
+            queue.append(future)
+        self.assertAlmostEqual(queue.timelen(), 10.)
+        queue.remove(futures[2])
+        self.assertAlmostEqual(queue.timelen(), 8.)
+        self.assertEqual(queue.popleft().key, 0)
+        self.assertAlmostEqual(queue.timelen(), 6.)
+        queue.append(_FakeFuture(_untimedFunc, -1))
+        self.assertEqual(queue.timelen(), float("inf"))
+        self.assertEqual(queue.popleft().key, -1)
+        self.assertAlmostEqual(queue.timelen(), 6.)
+        queue.clear()
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.timelen(), 0.)
+
+    def test_pop_first(self):
+        queue = TimedHeap(lambda future: -future.key)
+        keys = [5, 1, 4, 2, 3]
+        for key in keys:
+            queue.append(_FakeFuture(_timedFunc, key))
+        last = queue.popFirst()
+        self.assertEqual(last.key, 5)
+        self.assertAlmostEqual(queue.timelen(), 8.)
+        self.assertEqual([queue.popleft().key for _ in range(4)], [1, 2, 3, 4])
+
+    def test_both_orders(self):
+        queue = TimedHeap(lambda future: -future.key)
+        futures = [_FakeFuture(_timedFunc, key) for key in range(100)]
+        for future in futures:
+            queue.append(future)
+        queue.remove(futures[99])
+        queue.remove(futures[0])
+        self.assertNotIn(futures[0], queue)
+        self.assertIn(futures[1], queue)
+        self.assertEqual([queue.popFirst().key for _ in range(40)],
+                         list(range(98, 58, -1)))
+        self.assertEqual([queue.popleft().key for _ in range(40)],
+                         list(range(1, 41)))
+        self.assertEqual(len(queue), 18)
+        self.assertEqual(sorted(future.key for future in queue),
+                         list(range(41, 59)))
+        self.assertAlmostEqual(queue.timelen(), 36.)
+        self.assertRaises(ValueError, queue.remove, futures[0])
+
+
 if __name__ == "__main__":
     t = unittest.TestLoader().loadTestsFromTestCase(TestStat)
     unittest.TextTestRunner(verbosity=2).run(t)